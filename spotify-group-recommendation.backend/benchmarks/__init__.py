@@ -0,0 +1,6 @@
+"""Benchmarks for the backend.
+
+Run the modules from the backend directory, e.g.
+``python -m benchmarks.feature_weights``.
+
+"""
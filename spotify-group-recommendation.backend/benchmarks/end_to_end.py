@@ -0,0 +1,122 @@
+__author__ = 'Numan Tok'
+
+
+import argparse
+import tempfile
+import time
+
+from benchmarks.fake_spotify import FakeCatalog, FakeSpotify
+from feature_cache import AudioFeatureCache
+from jobs import STAGES
+from library_store import LibraryStore
+from result_cache import ResultCache
+from spotify_client import SpotifyClient, TokenBucket
+from universe_store import UniverseStore
+import ml_main
+import spotify_api
+# mainly() imports these on its first call, which is not to be measured
+import graph  # noqa: F401
+import prepare_data  # noqa: F401
+import send_data  # noqa: F401
+
+
+def fake_authorize(catalog, latency, error_rate):
+    """Returns a replacement for spotify_api.authorize() with fake clients.
+
+    Each token is used as the ID of a user of catalog. The fake clients are
+    wrapped in SpotifyClient like real ones, with a rate limiter that never
+    blocks and short backoffs, so injected errors go through the retries.
+
+    """
+
+    rate_limiter = TokenBucket(rate=1e9, capacity=1e9)
+
+    def authorize(tokens, trace=None):
+        clients = [SpotifyClient(FakeSpotify(catalog, token, latency,
+                                             error_rate, seed=i),
+                                 rate_limiter=rate_limiter,
+                                 max_retries=10, backoff_base=0.001,
+                                 trace=trace)
+                   for i, token in enumerate(tokens)]
+        return clients, [client.current_user()['id'] for client in clients]
+
+    return authorize
+
+
+def run(universe_size, group_size, latency=0.0, error_rate=0.0, seed=0):
+    """Runs ml_main.mainly() against a fake spotify API twice.
+
+    The first run starts with an empty universe store, audio feature cache
+    and library store, the second one reuses all of them. The result cache is disabled, so both
+    runs go through every stage.
+
+    Returns:
+        A tuple of two dicts (cold, warm) that map 'auth', each stage of
+        jobs.STAGES and 'total' to seconds.
+
+    """
+
+    catalog = FakeCatalog.synthetic(universe_size, group_size,
+                                    markets=ml_main.UNIVERSE_MARKETS,
+                                    seed=seed)
+    authorize = spotify_api.authorize
+    settings = (ml_main.feature_cache, ml_main.universe_store,
+                ml_main.library_store, ml_main.result_cache)
+    spotify_api.authorize = fake_authorize(catalog, latency, error_rate)
+    try:
+        with tempfile.TemporaryDirectory() as path:
+            ml_main.feature_cache = AudioFeatureCache(':memory:')
+            ml_main.universe_store = UniverseStore(
+                path, max_age=ml_main.UNIVERSE_MAX_AGE)
+            ml_main.library_store = LibraryStore(':memory:')
+            ml_main.result_cache = ResultCache(max_size=0)
+            return tuple(_timed_mainly(list(catalog.users))
+                         for _ in range(2))
+    finally:
+        spotify_api.authorize = authorize
+        (ml_main.feature_cache, ml_main.universe_store,
+         ml_main.library_store, ml_main.result_cache) = settings
+
+
+def _timed_mainly(tokens):
+    timestamps = [('auth', time.perf_counter())]
+    ml_main.mainly(tokens, progress=lambda stage: timestamps.append(
+        (stage, time.perf_counter())))
+    end = time.perf_counter()
+
+    timings = {stage: 0.0 for stage in ['auth'] + STAGES}
+    for (stage, start), (_, stop) in zip(timestamps,
+                                         timestamps[1:] + [(None, end)]):
+        timings[stage] += stop - start
+    timings['total'] = end - timestamps[0][1]
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure mainly() end to end against a fake spotify API.')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 50000],
+                        help='universe sizes to benchmark')
+    parser.add_argument('--groups', type=int, nargs='+', default=[2, 5, 10],
+                        help='group sizes to benchmark')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds each fake API call takes')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='probability that a fake API call fails')
+    args = parser.parse_args()
+
+    columns = ['auth'] + STAGES + ['total']
+    print('%10s %6s %5s' % ('universe', 'group', 'run') +
+          ''.join('%11s' % column for column in columns) + '   [s]')
+    for size in args.sizes:
+        for group_size in args.groups:
+            cold, warm = run(size, group_size, args.latency, args.error_rate)
+            for name, timings in (('cold', cold), ('warm', warm)):
+                print('%10d %6d %5s' % (size, group_size, name) +
+                      ''.join('%11.4f' % timings[column]
+                              for column in columns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+__author__ = 'Numan Tok'
+
+
+from collections import Counter
+import json
+import random
+import threading
+import time
+
+import numpy as np
+import spotipy.exceptions
+
+from universe_store import AUDIO_FEATURES
+
+
+class FakeCatalog:
+    """The data served by FakeSpotify clients.
+
+    A catalog is either generated with synthetic() or loaded from a JSON
+    fixture with load(), e.g. one recorded from the real API. A fixture has
+    the keys 'tracks' (track ID -> dict of AUDIO_FEATURES), 'featured'
+    (market -> list of playlists), 'playlists' (playlist ID -> dict with
+    'snapshot_id', 'owner', 'tracks', a list of track IDs, and optionally
+    'public', True by default) and 'users' (user ID -> dict with
+    'playlists' and 'top_tracks', lists of IDs).
+
+    Attributes:
+        track_ids (numpy.ndarray(str)): The IDs of all tracks.
+        features (numpy.ndarray(float64)): The AUDIO_FEATURES of each track.
+        featured (dict): Maps markets to their featured playlist IDs.
+        playlists (dict): Maps playlist IDs to playlists as described above.
+        users (dict): Maps user IDs to users as described above.
+
+    """
+
+    def __init__(self, track_ids, features, featured, playlists,
+                 users) -> None:
+        self.track_ids = np.asarray(track_ids)
+        self.features = np.asarray(features, dtype='float64')
+        self.featured = featured
+        self.playlists = playlists
+        self.users = users
+        self._rows = {track_id: row
+                      for row, track_id in enumerate(self.track_ids)}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def synthetic(cls, universe_size, num_users, playlists_per_user=10,
+                  playlist_length=50, featured_length=100, markets=('DE',),
+                  seed=0):
+        """Creates a random catalog.
+
+        The featured playlists of each market hold universe_size different
+        tracks. The library playlists of the users are drawn from a separate
+        pool of tracks, so the universe size does not depend on the group.
+
+        Args:
+            universe_size (int): The number of tracks in the featured
+                playlists of each market.
+            num_users (int): The number of users, called user_0, user_1 ...
+            playlists_per_user (int): The number of library playlists.
+            playlist_length (int): The mean length of a library playlist.
+            featured_length (int): The length of a featured playlist.
+            markets (tuple(str)): The markets with featured playlists.
+            seed (int): The seed of the random number generator.
+
+        Returns:
+            A FakeCatalog.
+
+        """
+
+        rng = np.random.default_rng(seed)
+        num_library_tracks = max(1, num_users * playlists_per_user *
+                                 playlist_length // 2)
+        num_tracks = universe_size * len(markets) + num_library_tracks
+        track_ids = np.array(['%022d' % i for i in range(num_tracks)])
+        features = rng.random((num_tracks, len(AUDIO_FEATURES)))
+
+        playlists = {}
+        featured = {}
+        for m, market in enumerate(markets):
+            market_tracks = track_ids[m * universe_size:
+                                      (m + 1) * universe_size].tolist()
+            featured[market] = []
+            for start in range(0, universe_size, featured_length):
+                playlist_id = 'featured_%s_%d' % (market, start)
+                playlists[playlist_id] = {
+                    'snapshot_id': '1', 'owner': 'spotify',
+                    'tracks': market_tracks[start:start + featured_length]}
+                featured[market].append(playlist_id)
+
+        library_tracks = track_ids[universe_size * len(markets):]
+        users = {}
+        for u in range(num_users):
+            user_id = 'user_%d' % u
+            users[user_id] = {'playlists': [], 'top_tracks':
+                              rng.choice(library_tracks, 3).tolist()}
+            for p in range(playlists_per_user):
+                playlist_id = '%s_playlist_%d' % (user_id, p)
+                length = int(rng.integers(1, 2 * playlist_length))
+                playlists[playlist_id] = {
+                    'snapshot_id': '1', 'owner': user_id,
+                    'tracks': rng.choice(library_tracks, length).tolist()}
+                users[user_id]['playlists'].append(playlist_id)
+
+        return cls(track_ids, features, featured, playlists, users)
+
+    @classmethod
+    def load(cls, path):
+        """Loads a catalog from a JSON fixture."""
+
+        with open(path) as file:
+            fixture = json.load(file)
+        track_ids = list(fixture['tracks'])
+        features = [[fixture['tracks'][track_id][feature]
+                     for feature in AUDIO_FEATURES]
+                    for track_id in track_ids]
+        return cls(track_ids, np.reshape(features, (-1, len(AUDIO_FEATURES))),
+                   fixture['featured'], fixture['playlists'],
+                   fixture['users'])
+
+    def save(self, path):
+        """Saves the catalog as a JSON fixture that load() can read."""
+
+        fixture = {
+            'tracks': {track_id: dict(zip(AUDIO_FEATURES, row))
+                       for track_id, row in zip(self.track_ids.tolist(),
+                                                self.features.tolist())},
+            'featured': self.featured,
+            'playlists': self.playlists,
+            'users': self.users,
+        }
+        with open(path, 'w') as file:
+            json.dump(fixture, file)
+
+    def audio_features(self, track_id):
+        row = self._rows.get(track_id)
+        if row is None:
+            return None
+        features = dict(zip(AUDIO_FEATURES, self.features[row].tolist()))
+        features['id'] = track_id
+        return features
+
+    def create_playlist(self, user_id, name):
+        with self._lock:
+            playlist_id = '%s_playlist_%d' % (user_id, len(self.playlists))
+            self.playlists[playlist_id] = {'snapshot_id': '1', 'name': name,
+                                           'owner': user_id, 'tracks': []}
+            self.users[user_id]['playlists'].append(playlist_id)
+        return playlist_id
+
+    def set_tracks(self, playlist_id, track_ids, append=False):
+        with self._lock:
+            playlist = self.playlists[playlist_id]
+            playlist['tracks'] = (playlist['tracks'] if append else []) + \
+                list(track_ids)
+            playlist['snapshot_id'] = str(int(playlist['snapshot_id']) + 1)
+
+
+class FakeSpotify:
+    """An offline stand-in for spotipy.Spotify of one user.
+
+    Implements the subset of spotipy that the backend uses, serves the data
+    of a FakeCatalog and can add latency and errors to every call. Paging
+    objects have the same keys as the real ones, and their 'next' links can
+    be followed with next(). Injected errors are 429 responses with a
+    Retry-After header and 503 responses, like the ones SpotifyClient
+    retries.
+
+    Attributes:
+        catalog (FakeCatalog): The served data.
+        user_id (str): The ID of the user the client belongs to.
+        latency (float): The seconds each call takes.
+        error_rate (float): The probability that a call fails.
+        retry_after (float): The Retry-After of injected 429 responses.
+        calls (collections.Counter): The number of calls per method.
+
+    """
+
+    def __init__(self, catalog, user_id, latency=0.0, error_rate=0.0,
+                 retry_after=0.0, seed=0) -> None:
+        self.catalog = catalog
+        self.user_id = user_id
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _request(self, method):
+        with self._lock:
+            self.calls[method] += 1
+            fails = self._random.random() < self.error_rate
+            rate_limited = self._random.random() < 0.5
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if fails and rate_limited:
+            raise spotipy.exceptions.SpotifyException(
+                429, -1, 'API rate limit exceeded',
+                headers={'Retry-After': str(self.retry_after)})
+        if fails:
+            raise spotipy.exceptions.SpotifyException(
+                503, -1, 'Service unavailable')
+
+    @staticmethod
+    def _page(method, args, items, limit, offset):
+        total = len(items)
+        next_offset = offset + limit
+        return {
+            'items': items[offset:next_offset],
+            'limit': limit,
+            'offset': offset,
+            'total': total,
+            'next': json.dumps([method, args, limit, next_offset])
+            if next_offset < total else None,
+            'previous': None,
+        }
+
+    def next(self, result):
+        if not result['next']:
+            return None
+        method, args, limit, offset = json.loads(result['next'])
+        return getattr(self, method)(*args, limit=limit, offset=offset)
+
+    def current_user(self):
+        self._request('current_user')
+        return {'id': self.user_id}
+
+    def _playlist_object(self, playlist_id):
+        playlist = self.catalog.playlists[playlist_id]
+        return {'id': playlist_id,
+                'name': playlist.get('name', playlist_id),
+                'snapshot_id': playlist['snapshot_id'],
+                'owner': {'id': playlist['owner']},
+                'public': playlist.get('public', True),
+                'tracks': {'total': len(playlist['tracks'])}}
+
+    def featured_playlists(self, locale=None, country=None, timestamp=None,
+                           limit=20, offset=0):
+        self._request('featured_playlists')
+        playlists = [self._playlist_object(playlist_id) for playlist_id
+                     in self.catalog.featured.get(country, [])]
+        page = self._page('featured_playlists', [locale, country, timestamp],
+                          playlists, limit, offset)
+        return {'message': 'Featured', 'playlists': page}
+
+    def current_user_playlists(self, limit=50, offset=0):
+        self._request('current_user_playlists')
+        playlists = [self._playlist_object(playlist_id) for playlist_id
+                     in self.catalog.users[self.user_id]['playlists']]
+        return self._page('current_user_playlists', [], playlists, limit,
+                          offset)
+
+    def current_user_top_tracks(self, limit=20, offset=0,
+                                time_range='medium_term'):
+        self._request('current_user_top_tracks')
+        tracks = [{'id': track_id} for track_id
+                  in self.catalog.users[self.user_id]['top_tracks']]
+        return self._page('current_user_top_tracks', [], tracks, limit,
+                          offset)
+
+    def playlist_tracks(self, playlist_id, fields=None, limit=100, offset=0,
+                        market=None, additional_types=('track',)):
+        self._request('playlist_tracks')
+        if playlist_id not in self.catalog.playlists:
+            raise spotipy.exceptions.SpotifyException(
+                404, -1, 'Not found.')
+        items = [{'track': {'id': track_id}} for track_id
+                 in self.catalog.playlists[playlist_id]['tracks']]
+        return self._page('playlist_tracks', [playlist_id], items, limit,
+                          offset)
+
+    def _get(self, url, args=None, payload=None, **kwargs):
+        if url != 'audio-features':
+            raise NotImplementedError('GET %s is not faked.' % url)
+        self._request('audio_features')
+        return {'audio_features': [self.catalog.audio_features(track_id)
+                                   for track_id in kwargs['ids'].split(',')]}
+
+    def user_playlist_create(self, user, name, public=True,
+                             collaborative=False, description=''):
+        self._request('user_playlist_create')
+        return {'id': self.catalog.create_playlist(user, name)}
+
+    def playlist_replace_items(self, playlist_id, items):
+        self._request('playlist_replace_items')
+        self.catalog.set_tracks(playlist_id, items)
+
+    def playlist_add_items(self, playlist_id, items, position=None):
+        self._request('playlist_add_items')
+        self.catalog.set_tracks(playlist_id, items, append=True)
@@ -0,0 +1,93 @@
+__author__ = 'Numan Tok'
+
+
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import random_tracks
+from graph import GraphModel
+
+
+def legacy_feature_weights(users_playlists, num_features):
+    """The original row by row implementation, kept as reference."""
+
+    overall_distances = np.zeros(num_features)
+    for user in users_playlists:
+        for playlist in user:
+            for i in range(len(playlist.index)-1):
+                current_track_features = playlist.iloc[[i]].drop(
+                    columns=['id']).values[0]
+                next_track_features = playlist.iloc[[
+                    i+1]].drop(columns=['id']).values[0]
+                overall_distances += np.absolute(
+                    next_track_features - current_track_features)
+
+    dist_weights = overall_distances / np.sum(overall_distances)
+    return 1 / dist_weights
+
+
+def run(num_playlists, playlist_length, num_users, skip_legacy, seed=0):
+    """Times the legacy and the batched weight computation.
+
+    Returns:
+        A tuple (legacy_seconds, batched_seconds). legacy_seconds is None if
+        skip_legacy is set.
+
+    """
+
+    rng = np.random.default_rng(seed)
+    per_user = [num_playlists // num_users] * num_users
+    for i in range(num_playlists % num_users):
+        per_user[i] += 1
+    users_playlists = [
+        [random_tracks(rng, rng.integers(2, 2 * playlist_length))
+         for _ in range(count)]
+        for count in per_user if count > 0]
+
+    model = GraphModel(users_playlists, random_tracks(rng, 100), 10,
+                       random_tracks(rng, 3))
+
+    start = time.perf_counter()
+    batched_weights = model.calc_feature_weights()
+    batched_seconds = time.perf_counter() - start
+
+    legacy_seconds = None
+    if not skip_legacy:
+        start = time.perf_counter()
+        legacy_weights = legacy_feature_weights(
+            users_playlists, model.num_features)
+        legacy_seconds = time.perf_counter() - start
+        assert np.allclose(legacy_weights, batched_weights), \
+            'batched feature weights differ from the reference'
+
+    return legacy_seconds, batched_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark GraphModel.calc_feature_weights.')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10, 100, 1000],
+                        help='numbers of playlists to benchmark')
+    parser.add_argument('--playlist-length', type=int, default=50)
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--skip-legacy', action='store_true',
+                        help='only time the batched implementation')
+    args = parser.parse_args()
+
+    print('%10s %12s %12s %9s' % ('playlists', 'legacy [s]', 'batched [s]',
+                                  'speedup'))
+    for size in args.sizes:
+        legacy, batched = run(size, args.playlist_length, args.users,
+                              args.skip_legacy)
+        if legacy is None:
+            print('%10d %12s %12.5f %9s' % (size, '-', batched, '-'))
+        else:
+            print('%10d %12.5f %12.5f %8.1fx' % (size, legacy, batched,
+                                                 legacy / batched))
+
+
+if __name__ == '__main__':
+    main()
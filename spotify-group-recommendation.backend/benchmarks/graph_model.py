@@ -0,0 +1,224 @@
+__author__ = 'Numan Tok'
+
+
+import argparse
+import itertools
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.synthetic import NUM_FEATURES, random_tracks
+from graph import GraphModel
+from track_matrix import PlaylistCollection, TrackMatrix
+
+
+PRESETS = {
+    'quick': {'sizes': [1000, 100000], 'users': [1, 10],
+              'playlists': [10], 'lengths': [10, 100]},
+    'full': {'sizes': [1000, 10000, 100000, 1000000], 'users': [1, 10, 50],
+             'playlists': [1, 10, 100], 'lengths': [10, 100, 1000]},
+}
+OPERATIONS = ['calc_feature_weights', 'find_path', 'find_group_playlist',
+              'find_group_playlist_lockstep']
+
+
+def random_playlist_collection(rng, num_users, playlists_per_user,
+                               playlist_length, num_features=NUM_FEATURES):
+    """Creates random playlists without going through DataFrames.
+
+    The playlist lengths are drawn uniformly around playlist_length and
+    every playlist has its own tracks.
+
+    Returns:
+        A track_matrix.PlaylistCollection.
+
+    """
+
+    lengths = rng.integers(max(2, playlist_length // 2),
+                           playlist_length * 3 // 2 + 1,
+                           num_users * playlists_per_user)
+    num_tracks = int(lengths.sum())
+    tracks = TrackMatrix(np.arange(num_tracks).astype(str),
+                         rng.random((num_tracks, num_features)))
+    return PlaylistCollection(
+        tracks, np.arange(num_tracks),
+        np.concatenate([[0], np.cumsum(lengths)]),
+        np.arange(num_users + 1) * playlists_per_user)
+
+
+def measure(function, repeat):
+    """Times function and measures the memory it allocates at its peak.
+
+    The time is the best of repeat runs without tracing, the memory is
+    measured with tracemalloc in an extra run.
+
+    Returns:
+        A tuple (seconds, peak_bytes).
+
+    """
+
+    seconds = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds = min(seconds, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        function()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return seconds, peak_bytes
+
+
+def run(universe_size, num_users, playlists_per_user, playlist_length,
+        num_tracks_to_find=50, repeat=3, seed=0):
+    """Benchmarks the operations of GraphModel for one scenario.
+
+    Returns:
+        A dict that maps each operation of OPERATIONS to a dict with
+        'seconds', 'peak_bytes' and 'throughput'. The throughput is the
+        number of playlist tracks per second for calc_feature_weights and
+        the number of found tracks per second otherwise.
+
+    """
+
+    rng = np.random.default_rng(seed)
+    users_playlists = random_playlist_collection(
+        rng, num_users, playlists_per_user, playlist_length)
+    selectable_tracks = TrackMatrix.from_dataframe(
+        random_tracks(rng, universe_size))
+    start_points = random_tracks(rng, min(3 * num_users, num_tracks_to_find))
+    model = GraphModel(users_playlists, selectable_tracks,
+                       num_tracks_to_find, start_points)
+
+    work = {
+        'calc_feature_weights': (model.calc_feature_weights,
+                                 len(users_playlists.track_indices)),
+        'find_path': (lambda: model.find_path(start_points.iloc[[0]],
+                                              num_tracks_to_find),
+                      num_tracks_to_find),
+        'find_group_playlist': (model.find_group_playlist,
+                                num_tracks_to_find),
+        'find_group_playlist_lockstep': (
+            lambda: model.find_group_playlist(lockstep=True),
+            num_tracks_to_find),
+    }
+    results = {}
+    for operation in OPERATIONS:
+        function, num_items = work[operation]
+        seconds, peak_bytes = measure(function, repeat)
+        results[operation] = {'seconds': seconds, 'peak_bytes': peak_bytes,
+                              'throughput': num_items / seconds}
+
+    return results
+
+
+def scenario_key(scenario):
+    return tuple(scenario[name] for name in
+                 ('universe_size', 'num_users', 'playlists_per_user',
+                  'playlist_length'))
+
+
+def compare(results, baseline, tolerance):
+    """Compares the times of results to the ones of baseline.
+
+    Returns:
+        A list including a tuple (scenario, operation, ratio) for every
+        operation that got slower than tolerance times its baseline.
+
+    """
+
+    baseline_results = {scenario_key(result['scenario']): result
+                        for result in baseline['results']}
+    regressions = []
+    for result in results:
+        previous = baseline_results.get(scenario_key(result['scenario']))
+        if previous is None:
+            continue
+        for operation in OPERATIONS:
+            if operation not in previous:
+                continue
+            ratio = result[operation]['seconds'] / \
+                previous[operation]['seconds']
+            if ratio > tolerance:
+                regressions.append((result['scenario'], operation, ratio))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure how GraphModel scales.')
+    parser.add_argument('--preset', choices=PRESETS, default='quick',
+                        help='the scenarios to run, single dimensions can be '
+                             'overridden by the options below')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        help='universe sizes')
+    parser.add_argument('--users', type=int, nargs='+',
+                        help='numbers of users')
+    parser.add_argument('--playlists', type=int, nargs='+',
+                        help='numbers of playlists per user')
+    parser.add_argument('--lengths', type=int, nargs='+',
+                        help='mean playlist lengths')
+    parser.add_argument('--tracks', type=int, default=50,
+                        help='group playlist length')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write the results as JSON to this '
+                                         'file')
+    parser.add_argument('--baseline', help='a JSON file of an earlier run to '
+                                           'compare with')
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help='slowdown relative to the baseline that counts '
+                             'as a regression')
+    args = parser.parse_args()
+
+    grid = dict(PRESETS[args.preset])
+    for name in grid:
+        if getattr(args, name) is not None:
+            grid[name] = getattr(args, name)
+
+    print('%9s %5s %9s %6s %28s %10s %12s %10s' % (
+        'universe', 'users', 'playlists', 'length', 'operation', 'time [s]',
+        'items/s', 'peak [MB]'))
+    results = []
+    for size, users, playlists, length in itertools.product(
+            grid['sizes'], grid['users'], grid['playlists'], grid['lengths']):
+        result = run(size, users, playlists, length, args.tracks, args.repeat)
+        for operation in OPERATIONS:
+            print('%9d %5d %9d %6d %28s %10.4f %12.0f %10.1f' % (
+                size, users, playlists, length, operation,
+                result[operation]['seconds'], result[operation]['throughput'],
+                result[operation]['peak_bytes'] / 2**20))
+        result['scenario'] = {'universe_size': size, 'num_users': users,
+                              'playlists_per_user': playlists,
+                              'playlist_length': length,
+                              'num_tracks_to_find': args.tracks}
+        results.append(result)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'python': platform.python_version(),
+                       'numpy': np.__version__,
+                       'machine': platform.machine(),
+                       'created_at': time.time(),
+                       'results': results}, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for scenario, operation, ratio in regressions:
+            print('Regression: %s is %.2fx slower for %s' % (
+                operation, ratio, scenario))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+__author__ = 'Numan Tok'
+
+
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import random_tracks, random_users_playlists
+from graph import GraphModel
+from neighbor_graph import NeighborGraph
+from track_matrix import TrackMatrix
+
+
+def path_cost(model, playlist):
+    """Returns the sum of the weighted distances between consecutive tracks.
+
+    The first track is the start point of a path, which is not in the
+    universe, so every path is measured from its second track on.
+
+    """
+
+    rows = {track_id: row
+            for row, track_id in enumerate(model.track_matrix.ids.tolist())}
+    features = model.track_matrix.features[
+        [rows[track_id] for track_id in playlist if track_id in rows]]
+    return float(np.absolute(np.diff(features, axis=0)).sum(axis=0)
+                 @ model.feature_weights)
+
+
+def run(universe_size, k, num_tracks_to_find, num_start_points, seed=0):
+    """Finds a group playlist with and without a neighbour graph.
+
+    Returns:
+        A dict with the seconds it took to build the graph, the seconds of
+        the exact and of the graph search, the share of tracks both
+        playlists have in common and the ratio of their path costs.
+
+    """
+
+    rng = np.random.default_rng(seed)
+    users_playlists = random_users_playlists(rng, 3, 5, 20)
+    selectable_tracks = TrackMatrix.from_dataframe(
+        random_tracks(rng, universe_size))
+    start_points = random_tracks(rng, num_start_points)
+
+    start = time.perf_counter()
+    neighbor_graph = NeighborGraph.build(selectable_tracks.features, k)
+    build_seconds = time.perf_counter() - start
+
+    exact = GraphModel(users_playlists, selectable_tracks, num_tracks_to_find,
+                       start_points)
+    walking = GraphModel(users_playlists, selectable_tracks,
+                         num_tracks_to_find, start_points,
+                         feature_weights=exact.feature_weights,
+                         neighbor_graph=neighbor_graph)
+    playlists = {}
+    seconds = {}
+    for name, model in (('exact', exact), ('graph', walking)):
+        start = time.perf_counter()
+        playlists[name] = model.find_group_playlist()
+        seconds[name] = time.perf_counter() - start
+
+    return {'build_seconds': build_seconds,
+            'exact_seconds': seconds['exact'],
+            'graph_seconds': seconds['graph'],
+            'overlap': len(set(playlists['exact']) & set(playlists['graph']))
+            / len(playlists['exact']),
+            'cost_ratio': path_cost(walking, playlists['graph']) /
+            path_cost(exact, playlists['exact'])}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare the exact path search of GraphModel with '
+                    'walking a precomputed neighbour graph.')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000],
+                        help='universe sizes to benchmark')
+    parser.add_argument('--k', type=int, default=32,
+                        help='neighbours per track')
+    parser.add_argument('--tracks', type=int, default=50,
+                        help='group playlist length')
+    parser.add_argument('--start-points', type=int, default=9)
+    args = parser.parse_args()
+
+    print('%10s %11s %11s %11s %8s %6s' % (
+        'universe', 'build [s]', 'exact [s]', 'graph [s]', 'overlap',
+        'cost'))
+    for size in args.sizes:
+        result = run(size, args.k, args.tracks, args.start_points)
+        print('%10d %11.4f %11.4f %11.4f %8.2f %6.2f' % (
+            size, result['build_seconds'], result['exact_seconds'],
+            result['graph_seconds'], result['overlap'],
+            result['cost_ratio']))
+
+
+if __name__ == '__main__':
+    main()
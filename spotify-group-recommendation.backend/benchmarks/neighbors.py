@@ -0,0 +1,74 @@
+__author__ = 'Numan Tok'
+
+
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import random_tracks, random_users_playlists
+from graph import GraphModel
+from neighbors import NEIGHBOR_BACKENDS
+
+
+def run(universe_size, num_tracks_to_find, num_start_points, seed=0):
+    """Builds a group playlist with every neighbour backend.
+
+    Raises an AssertionError if a backend finds another playlist than the
+    brute force reference or if a second call gives another playlist.
+
+    Returns:
+        A dict that maps each backend name to a tuple (build_seconds,
+        search_seconds).
+
+    """
+
+    rng = np.random.default_rng(seed)
+    users_playlists = random_users_playlists(rng, 3, 5, 20)
+    selectable_tracks = random_tracks(rng, universe_size)
+    start_points = random_tracks(rng, num_start_points)
+
+    timings = {}
+    playlists = {}
+    for backend in NEIGHBOR_BACKENDS:
+        start = time.perf_counter()
+        model = GraphModel(users_playlists, selectable_tracks,
+                           num_tracks_to_find, start_points,
+                           neighbor_backend=backend)
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        playlists[backend] = model.find_group_playlist()
+        timings[backend] = (build_seconds, time.perf_counter() - start)
+        assert model.find_group_playlist() == playlists[backend], \
+            '%s found another playlist on the second call' % backend
+
+    for backend, playlist in playlists.items():
+        assert playlist == playlists['brute'], \
+            '%s found another playlist than the brute force search' % backend
+
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare the neighbour backends of GraphModel.')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000, 1000000],
+                        help='universe sizes to benchmark')
+    parser.add_argument('--tracks', type=int, default=50,
+                        help='group playlist length')
+    parser.add_argument('--start-points', type=int, default=9)
+    args = parser.parse_args()
+
+    print('%10s %8s %11s %12s' % ('universe', 'backend', 'build [s]',
+                                  'search [s]'))
+    for size in args.sizes:
+        timings = run(size, args.tracks, args.start_points)
+        for backend, (build_seconds, search_seconds) in timings.items():
+            print('%10d %8s %11.4f %12.4f' % (size, backend, build_seconds,
+                                               search_seconds))
+
+
+if __name__ == '__main__':
+    main()
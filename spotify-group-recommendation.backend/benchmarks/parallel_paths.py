@@ -0,0 +1,65 @@
+__author__ = 'Numan Tok'
+
+
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import random_tracks, random_users_playlists
+from graph import GraphModel
+
+
+def run(universe_size, num_tracks_to_find, num_start_points, max_workers,
+        seed=0):
+    """Builds a group playlist sequentially and in parallel.
+
+    Raises an AssertionError if both playlists differ.
+
+    Returns:
+        A tuple (sequential_seconds, parallel_seconds).
+
+    """
+
+    rng = np.random.default_rng(seed)
+    model = GraphModel(random_users_playlists(rng, 3, 5, 20),
+                       random_tracks(rng, universe_size), num_tracks_to_find,
+                       random_tracks(rng, num_start_points))
+
+    start = time.perf_counter()
+    sequential_playlist = model.find_group_playlist()
+    sequential_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    parallel_playlist = model.find_group_playlist(
+        parallel=True, max_workers=max_workers)
+    parallel_seconds = time.perf_counter() - start
+
+    assert parallel_playlist == sequential_playlist, \
+        'the parallel mode found another playlist'
+
+    return sequential_seconds, parallel_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare the sequential and the parallel path search.')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 100000, 1000000],
+                        help='universe sizes to benchmark')
+    parser.add_argument('--tracks', type=int, default=300,
+                        help='group playlist length')
+    parser.add_argument('--start-points', type=int, default=30,
+                        help='e.g. 10 users with 3 top tracks each')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    print('%10s %15s %13s' % ('universe', 'sequential [s]', 'parallel [s]'))
+    for size in args.sizes:
+        sequential, parallel = run(size, args.tracks, args.start_points,
+                                   args.workers)
+        print('%10d %15.4f %13.4f' % (size, sequential, parallel))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+__author__ = 'Numan Tok'
+
+
+import itertools
+
+import pandas as pd
+
+
+NUM_FEATURES = 13
+
+# Every synthetic track gets a new ID, like real tracks with different
+# features would
+_track_counter = itertools.count()
+
+
+def random_tracks(rng, num_tracks, num_features=NUM_FEATURES):
+    """Creates a DataFrame of random normalized tracks.
+
+    Args:
+        rng (numpy.random.Generator): The random number generator to use.
+        num_tracks (int): Number of rows.
+        num_features (int): Number of audio feature columns.
+
+    Returns:
+        A pandas DataFrame with 'id' and num_features feature columns.
+
+    """
+
+    features = pd.DataFrame(rng.random((num_tracks, num_features)))
+    ids = pd.Series(['track_%d' % next(_track_counter)
+                     for _ in range(num_tracks)], name='id')
+    return pd.concat([ids, features], axis=1)
+
+
+def random_users_playlists(rng, num_users, playlists_per_user,
+                           playlist_length, num_features=NUM_FEATURES):
+    """Creates random playlists for a group of users.
+
+    The playlist lengths are drawn uniformly around playlist_length.
+
+    Returns:
+        A list including a list of playlist DataFrames for each user.
+
+    """
+
+    return [
+        [random_tracks(rng, rng.integers(2, 2 * playlist_length), num_features)
+         for _ in range(playlists_per_user)]
+        for _ in range(num_users)]
@@ -0,0 +1,175 @@
+__author__ = 'Numan Tok'
+
+
+from collections import OrderedDict
+import json
+import sqlite3
+import threading
+import time
+
+
+# Tracks without audio features may get them later, e.g. after an upload
+DEFAULT_MISSING_TTL = 24 * 60 * 60  # seconds
+
+
+class AudioFeatureCache:
+    """A persistent cache for the audio features of tracks.
+
+    The audio features of a track never change, so they are stored by track
+    ID in a SQLite database. An in-process LRU cache in front of the database
+    answers repeated lookups without touching the disk. The cache can be
+    shared between threads.
+
+    Tracks for which the API has no audio features get a negative entry 
+    that expires after missing_ttl seconds, so they are not requested again 
+    by every group that has them in its playlists. A negative entry counts 
+    as a hit.
+
+    Attributes:
+        path (str): The path of the SQLite database file. ':memory:' creates
+            a cache that is not persisted.
+        lru_size (int): How many tracks are kept in the in-process cache.
+        missing_ttl (float): How many seconds a negative entry is kept.
+        memory_hits (int): Number of tracks found in the in-process cache.
+        disk_hits (int): Number of tracks found in the database.
+        misses (int): Number of tracks that were not cached.
+
+    """
+
+    def __init__(self, path, lru_size=100000,
+                 missing_ttl=DEFAULT_MISSING_TTL) -> None:
+        self.path = path
+        self.lru_size = lru_size
+        self.missing_ttl = missing_ttl
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        # Maps track IDs to their audio features or, for negative entries, 
+        # to the time.time() at which they expire
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS audio_features ('
+                'track_id TEXT PRIMARY KEY, features TEXT NOT NULL)')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS missing_audio_features ('
+                'track_id TEXT PRIMARY KEY, expires_at REAL NOT NULL)')
+
+    @property
+    def hits(self):
+        return self.memory_hits + self.disk_hits
+
+    def stats(self):
+        """Returns the hit and miss counters as a dict."""
+
+        with self._lock:
+            return {'memory_hits': self.memory_hits,
+                    'disk_hits': self.disk_hits,
+                    'misses': self.misses}
+
+    def get_many(self, track_ids):
+        """Looks up the audio features of tracks.
+
+        Args:
+            track_ids (iterable(str)): The IDs of the tracks.
+
+        Returns:
+            A dict that maps the IDs of all cached tracks to their audio
+            features (dict) as returned by the spotify API, or to None for 
+            tracks with a negative entry. Tracks that are not cached are 
+            missing.
+
+        """
+
+        found = {}
+        now = time.time()
+        with self._lock:
+            not_in_memory = []
+            for track_id in dict.fromkeys(track_ids):
+                if track_id not in self._lru:
+                    not_in_memory.append(track_id)
+                    continue
+                features = self._lru[track_id]
+                if isinstance(features, float):
+                    if features <= now:
+                        del self._lru[track_id]
+                        not_in_memory.append(track_id)
+                        continue
+                    features = None
+                self._lru.move_to_end(track_id)
+                found[track_id] = features
+            self.memory_hits += len(found)
+
+            # Stay below SQLite's limit of variables per statement
+            num_disk_hits = 0
+            for i in range(0, len(not_in_memory), 500):
+                chunk = not_in_memory[i:i+500]
+                rows = self._connection.execute(
+                    'SELECT track_id, features FROM audio_features '
+                    'WHERE track_id IN (%s)' % ','.join('?' * len(chunk)),
+                    chunk).fetchall()
+                for track_id, features in rows:
+                    features = json.loads(features)
+                    found[track_id] = features
+                    self._remember(track_id, features)
+                num_disk_hits += len(rows)
+
+                chunk = [track_id for track_id in chunk
+                         if track_id not in found]
+                if not chunk:
+                    continue
+                rows = self._connection.execute(
+                    'SELECT track_id, expires_at FROM missing_audio_features '
+                    'WHERE track_id IN (%s) AND expires_at > ?'
+                    % ','.join('?' * len(chunk)), chunk + [now]).fetchall()
+                for track_id, expires_at in rows:
+                    found[track_id] = None
+                    self._remember(track_id, float(expires_at))
+                num_disk_hits += len(rows)
+            self.disk_hits += num_disk_hits
+            self.misses += len(not_in_memory) - num_disk_hits
+
+        return found
+
+    def put_many(self, audio_features):
+        """Stores the audio features of tracks.
+
+        Args:
+            audio_features (dict): A dict that maps track IDs to their audio
+                features (dict) as returned by the spotify API, or to None 
+                for tracks without audio features, which get a negative 
+                entry.
+
+        """
+
+        expires_at = time.time() + self.missing_ttl
+        found = {track_id: features
+                 for track_id, features in audio_features.items()
+                 if features is not None}
+        missing = [track_id for track_id, features in audio_features.items()
+                   if features is None]
+        with self._lock:
+            with self._connection:
+                self._connection.executemany(
+                    'INSERT OR REPLACE INTO audio_features VALUES (?, ?)',
+                    [(track_id, json.dumps(features))
+                     for track_id, features in found.items()])
+                self._connection.executemany(
+                    'DELETE FROM missing_audio_features WHERE track_id = ?',
+                    [(track_id,) for track_id in found])
+                self._connection.executemany(
+                    'INSERT OR REPLACE INTO missing_audio_features '
+                    'VALUES (?, ?)',
+                    [(track_id, expires_at) for track_id in missing])
+            for track_id, features in found.items():
+                self._remember(track_id, features)
+            for track_id in missing:
+                self._remember(track_id, expires_at)
+
+    def _remember(self, track_id, features):
+        self._lru[track_id] = features
+        self._lru.move_to_end(track_id)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
@@ -0,0 +1,126 @@
+__author__ = 'Numan Tok'
+
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import threading
+
+
+class ConcurrentFetcher:
+    """Runs blocking spotify API calls concurrently.
+
+    The calls are run on thread pools whose size is bounded by
+    max_concurrency. All calls of a fetcher also share max_concurrency
+    slots, so streams that feed each other, like imap() over the results of
+    another imap(), together keep at most max_concurrency requests in
+    flight. The results are always returned in the order of the inputs, so
+    the output does not depend on which request finishes first.
+
+    Attributes:
+        max_concurrency (int): The maximal number of requests in flight.
+
+    """
+
+    def __init__(self, max_concurrency=8) -> None:
+        if max_concurrency < 1:
+            raise ValueError('max_concurrency must be at least 1.')
+        self.max_concurrency = max_concurrency
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+    def _limited(self, function):
+        def call(item):
+            with self._slots:
+                return function(item)
+
+        return call
+
+    def map(self, function, items):
+        """Calls function for each item concurrently.
+
+        Must not be nested, i.e. function must not call map() or imap() of
+        the same fetcher again, which could wait for a slot forever.
+
+        Args:
+            function (callable): The function to call with each item.
+            items (iterable): The inputs.
+
+        Returns:
+            A list including the result of function for each item, in the
+            order of items.
+
+        """
+
+        function = self._limited(function)
+        items = list(items)
+        num_workers = min(self.max_concurrency, len(items))
+        if num_workers <= 1:
+            return [function(item) for item in items]
+
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            return list(executor.map(function, items))
+
+    def imap(self, function, items):
+        """Like map(), but yields the results as a generator.
+
+        items is consumed lazily and at most max_concurrency items are in 
+        flight or finished but not yet consumed, so memory stays bounded 
+        even for long or endless inputs.
+
+        Args:
+            function (callable): The function to call with each item.
+            items (iterable): The inputs.
+
+        Yields:
+            The result of function for each item, in the order of items.
+
+        """
+
+        function = self._limited(function)
+        items = iter(items)
+        if self.max_concurrency == 1:
+            for item in items:
+                yield function(item)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            futures = deque(executor.submit(function, item) for item
+                            in islice(items, self.max_concurrency))
+            try:
+                while futures:
+                    result = futures.popleft().result()
+                    for item in islice(items, 1):
+                        futures.append(executor.submit(function, item))
+                    yield result
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    def iter_remaining_pages(self, first_pages, fetch_page):
+        """Fetches all pages after the first page of several paging objects.
+
+        Instead of following the 'next' links one by one, the offsets of all 
+        remaining pages are derived from 'total' and 'limit' of the first 
+        page and fetched concurrently.
+
+        Args:
+            first_pages (list(dict)): The first page of each paging object as 
+                returned by the spotify API. Only 'offset', 'limit', 'total' 
+                and 'next' are used, so the items may already be dropped.
+            fetch_page (callable): Called with the index of a paging object 
+                in first_pages and an offset, returns the page at the offset.
+
+        Returns:
+            A generator of tuples (index of the paging object, page) for each 
+            remaining page. The pages of each paging object are yielded in 
+            order.
+
+        """
+
+        requests = ((i, offset)
+                    for i, page in enumerate(first_pages)
+                    if page['next']
+                    for offset in range(page['offset'] + page['limit'],
+                                        page['total'], page['limit']))
+        return self.imap(lambda request: (request[0], fetch_page(*request)),
+                         requests)
@@ -1,8 +1,165 @@
 __author__ = 'Numan Tok'
 
 
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 
+from neighbors import build_neighbor_index
+from track_matrix import PlaylistCollection, TrackMatrix
+
+
+# Stands in for the distance share of features that never change between
+# consecutive playlist tracks, which would get an infinite weight
+MIN_DISTANCE_SHARE = 1e-6
+
+
+def calc_groups_feature_weights(groups_users_playlists, num_features):
+    """Calculates the feature weight vectors of several groups at once.
+
+    The feature matrices of all playlists of all groups are stacked once and 
+    the distances between all consecutive tracks are calculated in a single 
+    pass. Pairs that cross the boundary between 2 playlists are masked out 
+    and the remaining distances are summed up per group. Groups whose 
+    PlaylistCollection has distance_sums reuse those instead of their 
+    tracks. See GraphModel.calc_feature_weights() for how the weights follow 
+    from them.
+
+    Args:
+        groups_users_playlists (list): The users_playlists of each group, 
+            either a list(list(pandas.core.frame.DataFrame(float64))) or a 
+            track_matrix.PlaylistCollection.
+        num_features (int): The number of audio features.
+
+    Returns:
+        A numpy ndarray of shape (number of groups, num_features) including 
+        the feature weight vector of each group. The weights are always 
+        finite: a group without any pair of consecutive tracks gets uniform 
+        weights, and a feature without any distance is weighted as if its 
+        share of the distances was MIN_DISTANCE_SHARE.
+
+    """
+
+    num_groups = len(groups_users_playlists)
+    overall_distances = np.zeros((num_groups, num_features))
+    feature_blocks = []
+    playlist_lengths = []
+    playlist_groups = []
+    for group_idx, users_playlists in enumerate(groups_users_playlists):
+        if isinstance(users_playlists, PlaylistCollection) and \
+                users_playlists.distance_sums is not None:
+            # Precomputed per playlist, e.g. by an earlier library sync
+            overall_distances[group_idx] = \
+                users_playlists.distance_sums.sum(axis=0)
+            continue
+        elif isinstance(users_playlists, PlaylistCollection):
+            # Already stacked, only the rows of the tracks are gathered
+            feature_blocks.append(users_playlists.stacked_features())
+            lengths = np.diff(users_playlists.playlist_offsets)
+        else:
+            playlists = [playlist.drop(columns=['id']).to_numpy(
+                dtype='float64') for user in users_playlists
+                for playlist in user]
+            feature_blocks.extend(playlists)
+            lengths = [len(playlist) for playlist in playlists]
+        playlist_lengths.extend(lengths)
+        playlist_groups.extend([group_idx] * len(lengths))
+
+    # Empty playlists do not contribute any pairs
+    playlist_lengths = np.asarray(playlist_lengths, dtype='int64')
+    playlist_groups = np.asarray(playlist_groups, dtype='int64')
+    is_not_empty = playlist_lengths > 0
+    playlist_lengths = playlist_lengths[is_not_empty]
+    playlist_groups = playlist_groups[is_not_empty]
+
+    if len(playlist_lengths) > 0:
+        stacked_features = np.concatenate(
+            [block for block in feature_blocks if len(block) > 0], axis=0)
+
+        # Calculate the distances between all consecutive tracks at once
+        dist_to_next_track = np.absolute(np.diff(stacked_features, axis=0))
+
+        # Mask out the pairs that cross the boundary between 2 playlists
+        playlist_ends = np.cumsum(playlist_lengths)[:-1] - 1
+        is_consecutive = np.ones(len(dist_to_next_track), dtype=bool)
+        is_consecutive[playlist_ends] = False
+        dist_to_next_track = dist_to_next_track[is_consecutive]
+        pair_groups = np.repeat(playlist_groups, playlist_lengths)[:-1]
+        pair_groups = pair_groups[is_consecutive]
+
+        # Sum up the distances per group, the pairs are ordered by group
+        group_starts = np.searchsorted(pair_groups, np.arange(num_groups))
+        group_ends = np.append(group_starts[1:], len(pair_groups))
+        has_pairs = group_starts < group_ends
+        if has_pairs.any():
+            overall_distances[has_pairs] += np.add.reduceat(
+                dist_to_next_track, group_starts[has_pairs], axis=0)
+
+    # Without any distances, e.g. for empty libraries, no feature is more 
+    # important than another
+    dist_sum = np.sum(overall_distances, axis=1, keepdims=True)
+    has_no_distances = dist_sum[:, 0] == 0
+    overall_distances[has_no_distances] = 1
+    dist_sum[has_no_distances] = num_features
+    dist_weights = np.maximum(overall_distances / dist_sum,
+                              MIN_DISTANCE_SHARE)
+    feature_weights = 1 / dist_weights
+
+    return feature_weights
+
+
+def find_group_playlists(groups, selectable_tracks, num_tracks_to_find,
+                         neighbor_backend='kdtree', max_workers=None):
+    """Creates the group playlists of several groups at once.
+
+    All groups share one track universe that is converted only once. The 
+    feature weights of all groups are calculated in one batch and the 
+    playlists of the groups are then found at the same time on a thread pool.
+
+    The neighbour index is built once and shared by all groups as far as it 
+    does not depend on the feature weights: the brute force backend shares 
+    the features and the quantized backends share their compact codes. A 
+    KD-tree is built in the weighted feature space, so every group still 
+    gets its own tree.
+
+    Args:
+        groups (list(tuple)): A tuple (users_playlists, start_points) for each 
+            group, see GraphModel.
+        selectable_tracks (pandas.core.frame.DataFrame(float64) or 
+            TrackMatrix): The pool of tracks to select from that is shared by 
+            all groups.
+        num_tracks_to_find (int): The desired length of each group playlist.
+        neighbor_backend (str): The neighbour search of the models.
+        max_workers (int): The maximal number of threads.
+
+    Returns:
+        A list including a group playlist (list of track ID strings) for each 
+        group, in the order of groups.
+
+    """
+
+    if not groups:
+        return []
+    if not isinstance(selectable_tracks, TrackMatrix):
+        selectable_tracks = TrackMatrix.from_dataframe(selectable_tracks)
+    groups_feature_weights = calc_groups_feature_weights(
+        [users_playlists for users_playlists, _ in groups],
+        selectable_tracks.num_features)
+    shared_index = build_neighbor_index(
+        neighbor_backend, selectable_tracks.features,
+        groups_feature_weights[0])
+
+    def find(group_idx):
+        users_playlists, start_points = groups[group_idx]
+        model = GraphModel(users_playlists, selectable_tracks,
+                           num_tracks_to_find, start_points,
+                           feature_weights=groups_feature_weights[group_idx],
+                           neighbor_index=shared_index)
+        return model.find_group_playlist()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(find, range(len(groups))))
+
 
 class GraphModel:
     """Graph model that finds a group playlist.
@@ -15,29 +172,65 @@ class GraphModel:
     sub-playlists. 
 
     Attributes:
-        users_playlists (list(list(pandas.core.frame.DataFrame(float64)))): 
-            Includes all retrieved playlists (with tracks) of all users in a 
-            DataFrame with 'id' and  the audio features as columns.
-        selectable_tracks (pandas.core.frame.DataFrame(float64)): The pool of 
-            tracks to select from (aka track universe) with 'id' and  the audio 
+        users_playlists (list(list(pandas.core.frame.DataFrame(float64))) or 
+            PlaylistCollection): Includes all retrieved playlists (with 
+            tracks) of all users in a DataFrame with 'id' and  the audio 
             features as columns.
+        selectable_tracks (pandas.core.frame.DataFrame(float64) or 
+            TrackMatrix): The pool of tracks to select from (aka track 
+            universe) with 'id' and  the audio features as columns. It is 
+            never modified by the model.
         num_tracks_to_find (int): The desired group playlist length.
         start_points (pandas.core.frame.DataFrame(float64)): Top tracks of all 
             users with 'id' and  the audio features as columns.
+        neighbor_backend (str): The neighbour search used to find the next 
+            track of a path, 'kdtree', the brute force reference 'brute' or 
+            the scan of compact features 'uint8' or 'float16'.
+        feature_weights (numpy.ndarray(float64)): Precomputed feature weights, 
+            e.g. from calc_groups_feature_weights(). By default they are 
+            calculated from users_playlists.
+        neighbor_graph (neighbor_graph.NeighborGraph): An optional graph of 
+            the nearest neighbours of the selectable tracks. If given, the 
+            paths walk its edges instead of searching all selectable tracks 
+            in every step, see _search_path().
+        neighbor_index: The index used to find the next track. If an index 
+            of the selectable tracks, e.g. of another group, is passed to 
+            the constructor, it is used with the feature weights of the 
+            model and neighbor_backend is ignored.
 
     """
 
     def __init__(self, users_playlists, selectable_tracks, num_tracks_to_find,
-                 start_points) -> None:
+                 start_points, neighbor_backend='kdtree',
+                 feature_weights=None, neighbor_graph=None,
+                 neighbor_index=None) -> None:
         self.users_playlists = users_playlists
         self.selectable_tracks = selectable_tracks
         self.num_tracks_to_find = num_tracks_to_find
         self.start_points = start_points
-        self.num_features = len(
-            self.selectable_tracks.columns) - 1  # -1 for the id
-        self.num_selectable_tracks = len(
-            self.selectable_tracks.index)  # number of rows
-        self.feature_weights = self.calc_feature_weights()
+        if not isinstance(selectable_tracks, TrackMatrix):
+            selectable_tracks = TrackMatrix.from_dataframe(selectable_tracks)
+        self.track_matrix = selectable_tracks
+        self.num_features = self.track_matrix.num_features
+        self.num_selectable_tracks = len(self.track_matrix)
+        self.feature_weights = feature_weights if feature_weights is not None \
+            else self.calc_feature_weights()
+
+        if neighbor_index is not None:
+            if len(neighbor_index) != self.num_selectable_tracks:
+                raise ValueError('The neighbour index does not belong to '
+                                 'the selectable tracks.')
+            self.neighbor_index = neighbor_index.with_weights(
+                self.feature_weights)
+        else:
+            self.neighbor_index = build_neighbor_index(
+                neighbor_backend, self.track_matrix.features,
+                self.feature_weights)
+        if neighbor_graph is not None and \
+                len(neighbor_graph) != self.num_selectable_tracks:
+            raise ValueError('The neighbour graph does not belong to the '
+                             'selectable tracks.')
+        self.neighbor_graph = neighbor_graph
 
     def calc_feature_weights(self):
         """Calculate a feature weight vector from the user playlists. 
@@ -53,27 +246,11 @@ class GraphModel:
 
         """
 
-        overall_distances = np.zeros(self.num_features)
-        for user in self.users_playlists:
-            for playlist in user:
-                for i in range(len(playlist.index)-1):
-                    # Get 2 consecutive tracks
-                    current_track_features = playlist.iloc[[i]].drop(
-                        columns=['id'], axis=1).values[0]
-                    next_track_features = playlist.iloc[[
-                        i+1]].drop(columns=['id'], axis=1).values[0]
-                    # Calculate the distances between 2 tracks and add them up
-                    dist_to_next_track = np.absolute(
-                        next_track_features - current_track_features)
-                    overall_distances += dist_to_next_track
-
-        dist_sum = np.sum(overall_distances)
-        dist_weights = overall_distances / dist_sum
-        feature_weights = 1 / dist_weights
-
-        return feature_weights
-
-    def find_group_playlist(self):
+        return calc_groups_feature_weights(
+            [self.users_playlists], self.num_features)[0]
+
+    def find_group_playlist(self, parallel=False, max_workers=None,
+                            lockstep=False):
         """Creates a list of track IDs.
 
         The output list should form the group playlist. The list consists of 
@@ -82,6 +259,19 @@ class GraphModel:
         start_points. The sub-playlists have almost the same length and are 
         concatenated in the order of the starting tracks.
 
+        The model is not changed, so calling this method again gives the 
+        same playlist.
+
+        Args:
+            parallel (bool): Whether to find the sub-playlists at the same 
+                time on a thread pool. The result is the same as without.
+            max_workers (int): The maximal number of threads used if parallel 
+                is set. Defaults to the default of ThreadPoolExecutor.
+            lockstep (bool): Whether to advance all sub-playlists together, 
+                see _find_paths_lockstep(). This gives another result than 
+                the default order, in which each sub-playlist is completed 
+                before the next one starts.
+
         Returns:
             A list including a number of self.num_tracks_to_find track IDs 
             (strings).
@@ -94,59 +284,269 @@ class GraphModel:
         for i in range(self.num_tracks_to_find % num_paths):
             tracks_per_path[i] += 1
 
-        # For each starting point, find an own path through the graph
-        # (=playlist part) and connect them together
+        if lockstep:
+            path_indices = self._find_paths_lockstep(tracks_per_path)
+        elif parallel:
+            path_indices = self._find_paths_parallel(
+                tracks_per_path, max_workers)
+        else:
+            # For each starting point, find an own path through the graph
+            # (=playlist part). Tracks used by one path are not available to 
+            # the following paths.
+            available_tracks = self._available_tracks(
+                self.start_points['id'].values)
+            path_indices = [
+                self._find_path_indices(i, tracks_per_path[i], available_tracks)
+                for i in range(num_paths)]
+
+        # Connect the paths together
         paths = []
         for i in range(num_paths):
-            start_point = self.start_points.iloc[[i]]
-            path_lenght = tracks_per_path[i]
-            path_i = self.find_path(start_point, path_lenght)
-            paths.extend(path_i)
+            paths.append(self.start_points['id'].values[i])
+            paths.extend(self.track_matrix.ids[path_indices[i]].tolist())
 
         return paths
 
-    def find_path(self, start_point, path_length):
+    def _find_paths_parallel(self, tracks_per_path, max_workers):
+        """Finds the paths of all starting points on a thread pool.
+
+        Each path may only use tracks that are not used by any path of a 
+        previous starting point, just like in the sequential order. All paths 
+        are first found at the same time, each excluding the tracks that the 
+        previous paths currently use. A path is final once all previous paths 
+        are final and it is still valid for their tracks, otherwise it is 
+        found again in the next round. A path found while excluding a subset 
+        of the final tracks, that does not use any of them, is valid because 
+        every track it picked is still the nearest available one. This 
+        resolves conflicts deterministically and gives the same result as the 
+        sequential order, while usually taking only one or two rounds.
+
+        Args:
+            tracks_per_path (list(int)): The length of the path for each 
+                starting point.
+            max_workers (int): The maximal number of threads.
+
+        Returns:
+            A list including a list of selectable track indices for each path.
+
+        """
+
+        num_paths = len(tracks_per_path)
+        paths = [None]*num_paths
+        # The mask of tracks that was excluded when finding each path
+        excluded_tracks = [None]*num_paths
+        num_final_paths = 0
+        final_tracks = ~self._available_tracks(self.start_points['id'].values)
+
+        def is_valid(i, used_tracks):
+            return paths[i] is not None and \
+                not used_tracks[paths[i]].any() and \
+                not (excluded_tracks[i] & ~used_tracks).any()
+
+        def find(i, used_tracks):
+            path = self._find_path_indices(
+                i, tracks_per_path[i], ~used_tracks)
+            return path, used_tracks
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while num_final_paths < num_paths:
+                # Find all paths that are not valid for the tracks that the 
+                # previous paths currently use
+                used_tracks = final_tracks.copy()
+                futures = {}
+                for i in range(num_final_paths, num_paths):
+                    if not is_valid(i, used_tracks):
+                        futures[i] = executor.submit(
+                            find, i, used_tracks.copy())
+                    if paths[i] is not None:
+                        used_tracks[paths[i]] = True
+                for i, future in futures.items():
+                    paths[i], excluded_tracks[i] = future.result()
+
+                # Finalize all paths that are valid for the final tracks
+                while num_final_paths < num_paths and \
+                        is_valid(num_final_paths, final_tracks):
+                    final_tracks[paths[num_final_paths]] = True
+                    num_final_paths += 1
+
+        return paths
+
+    def _find_paths_lockstep(self, tracks_per_path):
+        """Finds the paths of all starting points one step at a time.
+
+        In every round each unfinished path gets its next track. The 
+        distances between the last tracks of all these paths and all 
+        selectable tracks are calculated in one pass over the selectable 
+        tracks. If several paths pick the same track in a round, the path of 
+        the earlier starting point gets it and the others take their nearest 
+        track that is still available. So the selectable tracks are passed 
+        once per round instead of once per found track. The neighbour index 
+        and graph are not used.
+
+        Args:
+            tracks_per_path (list(int)): The length of the path for each 
+                starting point.
+
+        Returns:
+            A list including a list of selectable track indices for each path.
+
+        """
+
+        num_paths = len(tracks_per_path)
+        paths = [[] for _ in range(num_paths)]
+        path_lengths = np.asarray(tracks_per_path) - 1
+        current_points = np.array(self.start_points.iloc[:, 1:],
+                                  dtype='float64')
+        available_tracks = self._available_tracks(
+            self.start_points['id'].values)
+
+        for step in range(path_lengths.max(initial=0)):
+            active_paths = np.flatnonzero(path_lengths > step)
+            distances = self.neighbor_index.distance_matrix(
+                current_points[active_paths])
+            distances[:, ~available_tracks] = np.inf
+            nearest_points = np.argmin(distances, axis=1)
+
+            # Settle the conflicts in the order of the starting points
+            for row, path_idx in enumerate(active_paths):
+                nearest_point_idx = int(nearest_points[row])
+                if not available_tracks[nearest_point_idx]:
+                    candidates = np.flatnonzero(available_tracks)
+                    if len(candidates) == 0:
+                        raise ValueError(
+                            'There are no selectable tracks left.')
+                    nearest_point_idx = int(candidates[np.argmin(
+                        distances[row, candidates])])
+                paths[path_idx].append(nearest_point_idx)
+                available_tracks[nearest_point_idx] = False
+                current_points[path_idx] = \
+                    self.track_matrix.features[nearest_point_idx]
+
+        return paths
+
+    def find_path(self, start_point, path_length, available_tracks=None):
         """Finds a path of length path_length that starts with start_point.
 
         Successively adds the next nearest point (compared to the last added 
         point) to the path until the desired length is reached. The nearest 
-        point is the one with the smallest weighted feature distance.
+        point is the one with the smallest weighted feature distance. If the 
+        model has a neighbor_graph, it is searched among the graph 
+        neighbours of the last added point.
 
         Args:
             start_point (pandas.core.frame.DataFrame(float64)): A track that 
                 serves as starting point for the path with 'id' and  the audio 
                 features as columns.
             path_length (int): Length of the path.
+            available_tracks (numpy.ndarray(bool)): A mask over the selectable 
+                tracks that is False for tracks that must not be used. The 
+                tracks added to the path are set to False. By default all 
+                selectable tracks except start_point are available.
 
         Returns:
             A list including a number of path_length track IDs (strings).
 
         """
 
-        path = [start_point['id'].values[0]]
-        current_point = start_point
-        current_point_feature_vec = current_point.iloc[:, 1:].to_numpy()
+        if available_tracks is None:
+            available_tracks = self._available_tracks(
+                start_point['id'].values)
+
+        start_point_feature_vec = start_point.iloc[0, 1:].to_numpy(
+            dtype='float64')
+        path_indices = self._search_path(
+            start_point_feature_vec, path_length, available_tracks)
+
+        return [start_point['id'].values[0]] + \
+            self.track_matrix.ids[path_indices].tolist()
+
+    def _available_tracks(self, start_ids):
+        """Returns a mask over the selectable tracks for a new search.
+
+        The starting tracks already are in the playlist, so the selectable 
+        tracks with their IDs are not available.
+
+        Args:
+            start_ids (numpy.ndarray(str)): The IDs of the starting tracks.
+
+        Returns:
+            A numpy ndarray(bool) that is False for the starting tracks.
+
+        """
+
+        return ~np.isin(self.track_matrix.ids, start_ids)
+
+    def _find_path_indices(self, start_point_idx, path_length,
+                           available_tracks):
+        """Finds a path for the start point with index start_point_idx.
+
+        Returns:
+            A list including path_length-1 selectable track indices (int) that 
+            follow the start point.
+
+        """
+
+        start_point_feature_vec = self.start_points.iloc[
+            start_point_idx, 1:].to_numpy(dtype='float64')
+        return self._search_path(
+            start_point_feature_vec, path_length, available_tracks)
+
+    def _search_path(self, start_point_feature_vec, path_length,
+                     available_tracks):
+        """Successively searches the nearest available tracks.
+
+        With a self.neighbor_graph the next track is the nearest available 
+        neighbour of the last added track in the graph, under the weighted 
+        feature distance. All selectable tracks are only searched for the 
+        first track and when every neighbour has been used.
+
+        Returns:
+            A list including path_length-1 selectable track indices (int) that 
+            follow the start point.
+
+        """
+
+        path = []
+        current_point_feature_vec = start_point_feature_vec
 
         for i in range(path_length-1):
-            # Calculate the weighted feature distances between the last added
-            # point/track and all other points/tracks
-            neighbor_features = self.selectable_tracks.iloc[:, 1:].to_numpy()
-            neighbor_feature_distances = \
-                neighbor_features - current_point_feature_vec
-            weighted_neighbor_feature_distances = \
-                neighbor_feature_distances*self.feature_weights
-            neighbor_distance_vec = np.sum(
-                weighted_neighbor_feature_distances, axis=0)
-
-            # Find the nearest point and add it to the path
-            nearest_point_idx = np.argmin(neighbor_distance_vec)
-            nearest_point = self.selectable_tracks.iloc[[nearest_point_idx]]
-            nearest_point_id = nearest_point['id'].values[0]
-            path.append(nearest_point_id)
-
-            # Update the current point and delete it from the selectable_tracks
-            current_point_feature_vec = nearest_point.iloc[:, 1:].to_numpy()
-            self.selectable_tracks = self.selectable_tracks.drop(
-                index=nearest_point_idx).reset_index(drop=True)
+            # Find the point/track with the smallest weighted feature distance
+            # to the last added point/track and add it to the path
+            nearest_point_idx = None
+            if self.neighbor_graph is not None and len(path) > 0:
+                nearest_point_idx = self._nearest_neighbor(
+                    path[-1], available_tracks)
+            if nearest_point_idx is None:
+                nearest_point_idx = self.neighbor_index.nearest(
+                    current_point_feature_vec, available_tracks)
+            path.append(nearest_point_idx)
+
+            # Update the current point and exclude it from the selectable
+            # tracks
+            current_point_feature_vec = \
+                self.track_matrix.features[nearest_point_idx]
+            available_tracks[nearest_point_idx] = False
 
         return path
+
+    def _nearest_neighbor(self, track_idx, available_tracks):
+        """Re-ranks the graph neighbours of a track with the feature weights.
+
+        Ties are broken in favour of the track with the lowest index, like in 
+        the neighbour indexes.
+
+        Returns:
+            The index (int) of the nearest available neighbour or None if 
+            all neighbours have been used.
+
+        """
+
+        neighbors = self.neighbor_graph.neighbors(track_idx)
+        candidates = np.sort(neighbors[available_tracks[neighbors]])
+        if len(candidates) == 0:
+            return None
+
+        distances = self.neighbor_index.distances(
+            self.track_matrix.features[candidates],
+            self.track_matrix.features[track_idx])
+        return int(candidates[np.argmin(distances)])
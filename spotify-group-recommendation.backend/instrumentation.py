@@ -0,0 +1,158 @@
+__author__ = 'Numan Tok'
+
+
+from contextlib import contextmanager
+import threading
+import time
+
+
+def _new_timing():
+    return {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0}
+
+
+def _add_timing(timing, seconds):
+    timing['count'] += 1
+    timing['seconds'] += seconds
+    timing['max_seconds'] = max(timing['max_seconds'], seconds)
+
+
+def _merge(total, counters):
+    """Adds counters to total, except for max_seconds which is maximized."""
+
+    for name, value in counters.items():
+        if name == 'max_seconds':
+            total[name] = max(total.get(name, 0.0), value)
+        else:
+            total[name] = total.get(name, 0) + value
+
+
+class Trace:
+    """Records where the time of one request goes.
+
+    A trace is passed along with a request and filled by all parts of the
+    pipeline, also from worker threads. Stages can be entered several times
+    and nest, e.g. 'audio_features' is part of 'universe' and 'playlists',
+    so their times add up to more than the total.
+
+    Attributes:
+        started_at (float): The unix time the trace was created.
+        finished_at (float): The unix time of finish(), None before.
+        stages (dict): Maps stage names to their count, total seconds and
+            maximal seconds.
+        api_calls (dict): Maps API endpoints to their number of calls,
+            errors, total and maximal seconds and received bytes.
+        caches (dict): Maps cache names to their hits and misses.
+
+    """
+
+    def __init__(self) -> None:
+        self.started_at = time.time()
+        self.finished_at = None
+        self.stages = {}
+        self.api_calls = {}
+        self.caches = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """Measures the wall time of the with block as stage name."""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                _add_timing(self.stages.setdefault(name, _new_timing()),
+                            seconds)
+
+    def record_call(self, endpoint, seconds, num_bytes=0, error=False):
+        """Records one call of an API endpoint."""
+
+        with self._lock:
+            call = self.api_calls.get(endpoint)
+            if call is None:
+                call = self.api_calls[endpoint] = dict(
+                    _new_timing(), errors=0, bytes=0)
+            _add_timing(call, seconds)
+            call['errors'] += int(error)
+            call['bytes'] += num_bytes
+
+    def record_cache(self, name, hits=0, misses=0):
+        """Records the hits and misses of a cache lookup."""
+
+        with self._lock:
+            cache = self.caches.setdefault(name, {'hits': 0, 'misses': 0})
+            cache['hits'] += hits
+            cache['misses'] += misses
+
+    def finish(self):
+        self.finished_at = time.time()
+
+    def to_dict(self):
+        """Returns the trace as a JSON serializable dict."""
+
+        with self._lock:
+            end = self.finished_at if self.finished_at is not None \
+                else time.time()
+            return {
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'seconds': end - self.started_at,
+                'stages': {name: dict(timing)
+                           for name, timing in self.stages.items()},
+                'api_calls': {endpoint: dict(call)
+                              for endpoint, call in self.api_calls.items()},
+                'caches': {name: dict(cache)
+                           for name, cache in self.caches.items()},
+            }
+
+
+class Metrics:
+    """Adds up the traces of all finished requests of the process.
+
+    Attributes:
+        num_requests (int): The number of recorded requests.
+        num_failed (int): The number of recorded requests that failed.
+
+    """
+
+    def __init__(self) -> None:
+        self.num_requests = 0
+        self.num_failed = 0
+        self._requests = _new_timing()
+        self._stages = {}
+        self._api_calls = {}
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    def record(self, trace, failed=False):
+        """Adds a finished trace."""
+
+        trace = trace.to_dict()
+        with self._lock:
+            self.num_requests += 1
+            self.num_failed += int(failed)
+            _add_timing(self._requests, trace['seconds'])
+            for kind in ('stages', 'api_calls', 'caches'):
+                totals = getattr(self, '_' + kind)
+                for name, counters in trace[kind].items():
+                    _merge(totals.setdefault(name, {}), counters)
+
+    def to_dict(self):
+        """Returns the totals as a JSON serializable dict."""
+
+        with self._lock:
+            return {
+                'requests': dict(self._requests, failed=self.num_failed),
+                'stages': {name: dict(timing)
+                           for name, timing in self._stages.items()},
+                'api_calls': {endpoint: dict(call)
+                              for endpoint, call in self._api_calls.items()},
+                'caches': {name: dict(cache)
+                           for name, cache in self._caches.items()},
+            }
+
+
+# Shared by all requests of the process
+metrics = Metrics()
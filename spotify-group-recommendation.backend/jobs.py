@@ -0,0 +1,208 @@
+__author__ = 'Numan Tok'
+
+
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import Trace
+
+
+# The stages a playlist generation goes through, in order
+STAGES = ['fetch', 'normalize', 'weights', 'paths', 'upload']
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted to a full JobQueue."""
+
+
+class Job:
+    """A playlist generation that runs in the background.
+
+    Every change of the job increases its revision, which lets clients wait
+    for the next change instead of polling in a loop.
+
+    Attributes:
+        id (str): The unique ID of the job.
+        status (str): One of QUEUED, RUNNING, DONE and FAILED.
+        stage (str): The current stage of STAGES, None before the job runs.
+        result: The return value of the job function once it is DONE.
+        error (str): The error message once the job FAILED.
+        created_at (float): The unix time the job was submitted.
+        updated_at (float): The unix time of the last change.
+        revision (int): The number of changes so far.
+        trace (instrumentation.Trace): Records where the time of the job 
+            goes.
+
+    """
+
+    def __init__(self) -> None:
+        self.id = uuid.uuid4().hex
+        self.status = QUEUED
+        self.stage = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.revision = 0
+        self.trace = Trace()
+        self._changed = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    def _update(self, **attributes):
+        with self._changed:
+            for name, value in attributes.items():
+                setattr(self, name, value)
+            self.updated_at = time.time()
+            self.revision += 1
+            self._changed.notify_all()
+
+    def set_stage(self, stage):
+        """Reports that the job entered stage, one of STAGES."""
+
+        self._update(stage=stage)
+
+    def wait_for_change(self, revision, timeout=None):
+        """Blocks until the job changed after revision or it finished.
+
+        Args:
+            revision (int): The last revision the caller has seen.
+            timeout (float): The maximal number of seconds to wait.
+
+        Returns:
+            True if the job changed, False if the timeout expired.
+
+        """
+
+        with self._changed:
+            return self._changed.wait_for(
+                lambda: self.revision > revision or self.finished, timeout)
+
+    def to_dict(self):
+        """Returns the state of the job as a JSON serializable dict."""
+
+        with self._changed:
+            return {
+                'id': self.id,
+                'status': self.status,
+                'stage': self.stage,
+                'progress': self._progress(),
+                'result': self.result,
+                'error': self.error,
+                'created_at': self.created_at,
+                'updated_at': self.updated_at,
+                'revision': self.revision,
+            }
+
+    def _progress(self):
+        if self.status == DONE:
+            return 1.0
+        if self.stage is None:
+            return 0.0
+        return STAGES.index(self.stage) / len(STAGES)
+
+
+class JobQueue:
+    """Runs jobs on a bounded pool of worker threads.
+
+    Jobs are started in the order they are submitted. At most max_workers
+    jobs run at the same time and at most max_queued jobs wait for a worker,
+    further submissions are rejected with a QueueFullError. Finished jobs are
+    forgotten after keep_finished seconds.
+
+    Attributes:
+        max_workers (int): The maximal number of concurrently running jobs.
+        max_queued (int): The maximal number of jobs waiting for a worker.
+        keep_finished (float): How many seconds finished jobs can be looked
+            up.
+
+    """
+
+    def __init__(self, max_workers=2, max_queued=20,
+                 keep_finished=60*60) -> None:
+        if max_workers < 1:
+            raise ValueError('max_workers must be at least 1.')
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.keep_finished = keep_finished
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='job')
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def submit(self, function, *args, **kwargs):
+        """Queues function to be run in the background.
+
+        Args:
+            function (callable): Called with args, kwargs, progress, a
+                callable that takes the name of the stage the job entered,
+                and trace, the instrumentation.Trace of the job.
+            *args: The positional arguments for function.
+            **kwargs: The keyword arguments for function.
+
+        Returns:
+            The queued Job.
+
+        Raises:
+            QueueFullError: If max_queued jobs are already waiting.
+
+        """
+
+        job = Job()
+        with self._lock:
+            self._forget_finished()
+            num_queued = sum(queued.status == QUEUED
+                             for queued in self._jobs.values())
+            if num_queued >= self.max_queued:
+                raise QueueFullError('There are already %d queued jobs.'
+                                     % num_queued)
+            self._jobs[job.id] = job
+
+        self._executor.submit(self._run, job, function, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        """Returns the Job with job_id or None if there is none."""
+
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        """Returns the number of known jobs per status."""
+
+        with self._lock:
+            counts = {status: 0 for status in (QUEUED, RUNNING, DONE, FAILED)}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return counts
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def _run(self, job, function, args, kwargs):
+        job._update(status=RUNNING)
+        try:
+            result = function(*args, progress=job.set_stage, trace=job.trace,
+                              **kwargs)
+        except Exception as e:
+            traceback.print_exc()
+            job._update(status=FAILED, error='%s: %s' % (type(e).__name__, e))
+        else:
+            job._update(status=DONE, result=result)
+
+    def _forget_finished(self):
+        now = time.time()
+        for job_id in [job.id for job in self._jobs.values()
+                       if job.finished
+                       and now - job.updated_at > self.keep_finished]:
+            del self._jobs[job_id]
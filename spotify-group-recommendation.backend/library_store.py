@@ -0,0 +1,101 @@
+__author__ = 'Numan Tok'
+
+
+import json
+import sqlite3
+import threading
+
+
+class LibraryStore:
+    """Remembers the library playlists of the users between requests.
+
+    Every playlist is stored with the snapshot_id it had at its last sync,
+    the number of its tracks with audio features and the sums of the raw
+    feature distances between its consecutive tracks. A playlist whose
+    snapshot_id did not change since then has the same tracks, so it does
+    not have to be retrieved again and its distance sums can be reused for
+    the feature weights. The store can be shared between threads.
+
+    Playlists are stored by their ID only. A playlist that several users
+    saved in their library is therefore synced once for all of them.
+
+    Attributes:
+        path (str): The path of the SQLite database file. ':memory:' creates
+            a store that is not persisted.
+        hits (int): Number of playlists that were unchanged.
+        misses (int): Number of playlists that were new or changed.
+
+    """
+
+    def __init__(self, path) -> None:
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS playlists ('
+                'playlist_id TEXT PRIMARY KEY, snapshot_id TEXT NOT NULL, '
+                'num_tracks INTEGER NOT NULL, distance_sums TEXT NOT NULL)')
+
+    def stats(self):
+        """Returns the hit and miss counters as a dict."""
+
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+    def get_unchanged(self, playlists):
+        """Looks up the playlists that did not change since their last sync.
+
+        Args:
+            playlists (list(dict())): Playlist objects returned by the
+                spotify API, with at least 'id' and 'snapshot_id'.
+
+        Returns:
+            A dict that maps the IDs of the unchanged playlists to a tuple
+            (number of tracks with audio features (int), distance sums
+            (dict that maps features to floats)). New and changed playlists
+            are missing.
+
+        """
+
+        snapshot_ids = {playlist['id']: playlist['snapshot_id']
+                        for playlist in playlists}
+        playlist_ids = list(snapshot_ids)
+        unchanged = {}
+        with self._lock:
+            # Stay below SQLite's limit of variables per statement
+            for i in range(0, len(playlist_ids), 500):
+                chunk = playlist_ids[i:i+500]
+                rows = self._connection.execute(
+                    'SELECT playlist_id, snapshot_id, num_tracks, '
+                    'distance_sums FROM playlists WHERE playlist_id IN (%s)'
+                    % ','.join('?' * len(chunk)), chunk).fetchall()
+                for playlist_id, snapshot_id, num_tracks, sums in rows:
+                    if snapshot_id == snapshot_ids[playlist_id]:
+                        unchanged[playlist_id] = (num_tracks,
+                                                  json.loads(sums))
+            self.hits += len(unchanged)
+            self.misses += len(snapshot_ids) - len(unchanged)
+
+        return unchanged
+
+    def put_many(self, playlists):
+        """Stores synced playlists.
+
+        Args:
+            playlists (dict): A dict that maps playlist IDs to a tuple
+                (snapshot_id (str), number of tracks with audio features
+                (int), distance sums (dict that maps features to floats)).
+
+        """
+
+        with self._lock:
+            with self._connection:
+                self._connection.executemany(
+                    'INSERT OR REPLACE INTO playlists VALUES (?, ?, ?, ?)',
+                    [(playlist_id, snapshot_id, num_tracks,
+                      json.dumps(distance_sums))
+                     for playlist_id, (snapshot_id, num_tracks,
+                                       distance_sums) in playlists.items()])
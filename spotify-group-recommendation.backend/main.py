@@ -1,16 +1,94 @@
 
 
-from flask import Flask, request
+import json
+import os
+
+from flask import Flask, Response, request
 from flask_cors import CORS, cross_origin
 
 import ml_main
+from instrumentation import metrics
+from jobs import DONE, FAILED, JobQueue, QueueFullError
+
+# How many playlists are generated at the same time and how many requests
+# may wait for a free worker before new ones are rejected
+MAX_CONCURRENT_JOBS = int(os.environ.get('MAX_CONCURRENT_JOBS', 2))
+MAX_QUEUED_JOBS = int(os.environ.get('MAX_QUEUED_JOBS', 20))
+# How long a client waits for the next progress event before a keep-alive
+EVENT_KEEP_ALIVE = 15  # seconds
+
+job_queue = JobQueue(max_workers=MAX_CONCURRENT_JOBS,
+                     max_queued=MAX_QUEUED_JOBS)
 
 app = Flask(__name__)
 @app.route("/token", methods=["POST"])
 @cross_origin()
 def token():
     token = request.args.get("token")[9:][:-9].split("separator")
-    return {"success": ml_main.mainly(token)}
+    try:
+        job = job_queue.submit(ml_main.mainly, token)
+    except QueueFullError as e:
+        return {"success": False, "error": str(e)}, 503
+    return {"success": True, "job_id": job.id,
+            "status_url": "/jobs/%s" % job.id,
+            "events_url": "/jobs/%s/events" % job.id}, 202
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+@cross_origin()
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return {"error": "Unknown job."}, 404
+    return job.to_dict()
+
+
+@app.route("/jobs/<job_id>/trace", methods=["GET"])
+@cross_origin()
+def job_trace(job_id):
+    """Returns the stage timings, API calls and cache hits of a job."""
+
+    job = job_queue.get(job_id)
+    if job is None:
+        return {"error": "Unknown job."}, 404
+    return job.trace.to_dict()
+
+
+@app.route("/metrics", methods=["GET"])
+@cross_origin()
+def metrics_endpoint():
+    """Returns the totals of all finished requests and the current load."""
+
+    return dict(metrics.to_dict(), jobs=job_queue.stats(),
+                feature_cache=ml_main.feature_cache.stats(),
+                library_store=ml_main.library_store.stats(),
+                user_id_cache=ml_main.spotify_api.user_id_cache.stats(),
+                result_cache=ml_main.result_cache.stats())
+
+
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+@cross_origin()
+def job_events(job_id):
+    """Streams the state of a job as server-sent events until it finished."""
+
+    job = job_queue.get(job_id)
+    if job is None:
+        return {"error": "Unknown job."}, 404
+
+    def events():
+        revision = -1
+        while True:
+            if not job.wait_for_change(revision, timeout=EVENT_KEEP_ALIVE):
+                yield ": keep-alive\n\n"
+                continue
+            state = job.to_dict()
+            revision = state["revision"]
+            yield "data: %s\n\n" % json.dumps(state)
+            if state["status"] in (DONE, FAILED):
+                return
+
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache"})
 
 if __name__ == "__main__":
-    app.run()
+    app.run(threaded=True)
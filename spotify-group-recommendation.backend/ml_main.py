@@ -2,47 +2,210 @@ __author__ = 'Numan Tok'
 
 import main
 import spotify_api
+from feature_cache import AudioFeatureCache
+from instrumentation import Trace, metrics
+from library_store import LibraryStore
+from result_cache import ResultCache
+from universe_store import UniverseStore
 
 
-def mainly(tokens):
-    from spotify_api import authorize
-    from prepare_data import DataPreparation
-    from graph import GraphModel
+###########################################################################
+# ! Avoid !:
+# -- num_tracks_to_find >= len(track_universe)
+# -- len(start_tracks) >= num_tracks_to_find
+# -- max_playlists_per_user = 50
+###########################################################################
+NUM_TRACKS_TO_FIND = 50
+SELECTED_FEATURES = ['danceability', 'energy',
+                     'key', 'loudness', 'mode', 'speechiness', 'acousticness', 'instrumentalness', 'liveness',
+                     'valence', 'tempo', 'duration_ms', 'time_signature']
+MAX_PLAYLISTS_PER_USER = 50  # max 50
+MIN_UNIVERSE_SIZE = 1000
+AUDIO_FEATURE_CACHE_PATH = 'audio_features.sqlite'
+UNIVERSE_STORE_PATH = 'universe'
+LIBRARY_STORE_PATH = 'libraries.sqlite'
+UNIVERSE_MAX_AGE = 24 * 60 * 60  # seconds
+UNIVERSE_MARKETS = ['DE']
+# Neighbours per track in the graph of each universe snapshot, None to search
+# the whole universe in every step instead
+NEIGHBOR_GRAPH_K = None
+# 'kdtree', or 'uint8' / 'float16' to scan compact copies of the features
+NEIGHBOR_BACKEND = 'kdtree'
+# Advance the paths of all top tracks together, one pass over the universe per
+# step of all paths instead of one per found track
+LOCKSTEP_PATHS = False
+RESULT_CACHE_SIZE = 128
+RESULT_CACHE_TTL = 10 * 60  # seconds
+
+# Shared by all requests, audio features never change for a track
+feature_cache = AudioFeatureCache(AUDIO_FEATURE_CACHE_PATH)
+universe_store = UniverseStore(UNIVERSE_STORE_PATH, max_age=UNIVERSE_MAX_AGE,
+                               neighbor_graph_k=NEIGHBOR_GRAPH_K)
+# Unchanged library playlists are not retrieved again
+library_store = LibraryStore(LIBRARY_STORE_PATH)
+# Group playlists of recent and in-flight requests, by group and settings
+result_cache = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+
+
+def mainly(tokens, progress=None, trace=None):
+    """Creates and uploads the group playlist of one group.
+
+    Args:
+        tokens (list(str)): The access tokens of the group members.
+        progress (callable): Optionally called with the name of each stage 
+            of jobs.STAGES when it starts.
+        trace (instrumentation.Trace): Optionally records where the time of 
+            the request goes. The finished trace is added to 
+            instrumentation.metrics.
+
+    Returns:
+        The upload result.
+
+    """
+
     from send_data import sendit
 
+    if progress is None:
+        def progress(stage):
+            pass
+    if trace is None:
+        trace = Trace()
 
-    ###########################################################################
-    # ! Avoid !:
-    # -- num_tracks_to_find >= len(track_universe)
-    # -- len(start_tracks) >= num_tracks_to_find
-    # -- max_playlists_per_user = 50
-    ###########################################################################
-    # Example usage:
+    failed = True
+    try:
+        # Example usage:
 
-    clients, username = spotify_api.authorize(tokens)
-    num_tracks_to_find = 50
-    selected_features = ['danceability', 'energy',
-                         'key', 'loudness', 'mode', 'speechiness', 'acousticness', 'instrumentalness', 'liveness',
-                         'valence', 'tempo', 'duration_ms', 'time_signature']
+        with trace.stage('authorize'):
+            clients, username = spotify_api.authorize(tokens, trace=trace)
+
+        # The same group asking again shortly after, or while its playlist 
+        # is still being found, gets the same playlist without finding it 
+        # again
+        key = (tuple(sorted(username)), tuple(SELECTED_FEATURES),
+               NUM_TRACKS_TO_FIND)
+        computed = []
+
+        def compute():
+            computed.append(True)
+            return find_playlist(clients, progress, trace)
+
+        group_playlist = result_cache.get_or_compute(key, compute)
+        trace.record_cache('result_cache', hits=int(not computed),
+                           misses=int(bool(computed)))
+        print('-' * 50)
+        print('-' * 50)
+        print("Group Playlist (Track IDs):")
+        print()
+        print(group_playlist)
+        print('-' * 50)
+        print('-' * 50)
+        progress('upload')
+        with trace.stage('upload'):
+            result = sendit(clients, group_playlist, username)
+        failed = False
+        return result
+    finally:
+        trace.finish()
+        metrics.record(trace, failed=failed)
+
+
+def find_playlist(clients, progress, trace=None):
+    """Finds the group playlist of the users of clients.
+
+    Args:
+        clients (list(spotify_client.SpotifyClient)): A client for each 
+            group member.
+        progress (callable): Called with the name of each stage when it 
+            starts.
+        trace (instrumentation.Trace): Optionally records the time of each 
+            stage.
+
+    Returns:
+        A list including the track IDs (str) of the group playlist.
+
+    """
+
+    from prepare_data import DataPreparation
+    from graph import GraphModel
+
+    if trace is None:
+        trace = Trace()
 
     data = DataPreparation(
-        selected_features=selected_features,
+        selected_features=SELECTED_FEATURES,
         users=clients,
-        max_playlists_per_user=50,  # max 50
-        min_universe_size=1000)
+        max_playlists_per_user=MAX_PLAYLISTS_PER_USER,
+        min_universe_size=MIN_UNIVERSE_SIZE,
+        feature_cache=feature_cache,
+        universe_store=universe_store,
+        markets=UNIVERSE_MARKETS,
+        progress=progress,
+        trace=trace,
+        library_store=library_store)
 
     users_playlists = data.custom_users_playlists
     track_universe = data.track_universe
     start_tracks = data.users_top_tracks
 
-    graph_model = GraphModel(users_playlists, track_universe,
-                             num_tracks_to_find, start_tracks)
-    group_playlist = graph_model.find_group_playlist()
-    print('-' * 50)
-    print('-' * 50)
-    print("Group Playlist (Track IDs):")
-    print()
-    print(group_playlist)
-    print('-' * 50)
-    print('-' * 50)
-    return sendit(clients, group_playlist, username)
\ No newline at end of file
+    progress('weights')
+    # Includes building the neighbour index
+    with trace.stage('weights'):
+        graph_model = GraphModel(users_playlists, track_universe,
+                                 NUM_TRACKS_TO_FIND, start_tracks,
+                                 neighbor_backend=NEIGHBOR_BACKEND,
+                                 neighbor_graph=data.neighbor_graph)
+    progress('paths')
+    with trace.stage('paths'):
+        return graph_model.find_group_playlist(lockstep=LOCKSTEP_PATHS)
+
+
+def mainly_batch(groups_tokens):
+    """Creates and uploads the group playlists of several groups at once.
+
+    The track universe is only loaded for the first group and shared by all
+    other groups. The playlists of all groups are then found in one batch
+    with graph.find_group_playlists().
+
+    Args:
+        groups_tokens (list(list(str))): The access tokens of the members of
+            each group.
+
+    Returns:
+        A list including the upload result of each group.
+
+    """
+
+    from prepare_data import DataPreparation
+    from graph import find_group_playlists
+    from send_data import sendit
+
+    if not groups_tokens:
+        return []
+
+    authorized_groups = [spotify_api.authorize(tokens)
+                         for tokens in groups_tokens]
+
+    raw_track_universe = None
+    groups = []
+    for clients, _ in authorized_groups:
+        data = DataPreparation(
+            selected_features=SELECTED_FEATURES,
+            users=clients,
+            max_playlists_per_user=MAX_PLAYLISTS_PER_USER,
+            min_universe_size=MIN_UNIVERSE_SIZE,
+            track_universe=raw_track_universe,
+            feature_cache=feature_cache,
+            universe_store=universe_store,
+            markets=UNIVERSE_MARKETS,
+            library_store=library_store)
+        raw_track_universe = data.raw_track_universe
+        groups.append((data.custom_users_playlists, data.users_top_tracks))
+
+    # Every group normalizes the shared universe in the same way
+    group_playlists = find_group_playlists(
+        groups, data.track_universe, NUM_TRACKS_TO_FIND,
+        neighbor_backend=NEIGHBOR_BACKEND)
+
+    return [sendit(clients, group_playlist, username)
+            for (clients, username), group_playlist
+            in zip(authorized_groups, group_playlists)]
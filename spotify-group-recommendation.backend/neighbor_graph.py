@@ -0,0 +1,136 @@
+__author__ = 'Numan Tok'
+
+
+import argparse
+import json
+import os
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class NeighborGraph:
+    """The k nearest neighbours of every track of a track universe.
+
+    The graph is built once per universe snapshot under the unweighted L1
+    distance of the normalized features and stored as a CSR adjacency: the
+    neighbours of track i are indices[indptr[i]:indptr[i+1]], ordered from
+    the nearest to the farthest. Like a TrackMatrix it can be saved to a
+    directory and is memory-mapped when it is loaded.
+
+    GraphModel walks the edges of the graph and re-ranks the neighbours of
+    the current track with the feature weights of the group, instead of
+    searching the whole universe in every step.
+
+    Attributes:
+        indptr (numpy.ndarray(int64)): The offsets of the neighbours of each
+            track, one more than there are tracks.
+        indices (numpy.ndarray(int32)): The rows of the neighbours.
+        distances (numpy.ndarray(float32)): The unweighted L1 distance of
+            each edge.
+
+    """
+
+    def __init__(self, indptr, indices, distances) -> None:
+        self.indptr = np.asarray(indptr, dtype='int64')
+        self.indices = np.asarray(indices, dtype='int32')
+        self.distances = np.asarray(distances, dtype='float32')
+        if len(self.indices) != len(self.distances) or \
+                len(self.indices) != self.indptr[-1]:
+            raise ValueError('Expected one distance per edge.')
+
+    @classmethod
+    def build(cls, features, k=32, batch_size=10000, workers=-1):
+        """Finds the k nearest neighbours of every row of features.
+
+        Args:
+            features (numpy.ndarray(float64 or float32)): The normalized
+                features with one row per track.
+            k (int): The number of neighbours per track, at most the number
+                of tracks - 1.
+            batch_size (int): How many tracks are queried at once, which
+                bounds the memory of the query results.
+            workers (int): The number of threads of each query, -1 for all
+                processors.
+
+        Returns:
+            A NeighborGraph.
+
+        """
+
+        num_tracks = len(features)
+        k = max(0, min(k, num_tracks - 1))
+        indices = np.empty((num_tracks, k), dtype='int32')
+        distances = np.empty((num_tracks, k), dtype='float32')
+        if k > 0:
+            tree = cKDTree(np.asarray(features, dtype='float64'))
+            for start in range(0, num_tracks, batch_size):
+                stop = min(start + batch_size, num_tracks)
+                batch_distances, batch_indices = tree.query(
+                    features[start:stop], k=k + 1, p=1, workers=workers)
+
+                # Drop the track itself, or the farthest neighbour if the
+                # track is hidden behind duplicates of its features
+                is_other = batch_indices != \
+                    np.arange(start, stop)[:, np.newaxis]
+                is_other[is_other.all(axis=1), -1] = False
+                indices[start:stop] = batch_indices[is_other].reshape(-1, k)
+                distances[start:stop] = \
+                    batch_distances[is_other].reshape(-1, k)
+
+        return cls(np.arange(num_tracks + 1, dtype='int64') * k,
+                   indices.ravel(), distances.ravel())
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def neighbors(self, row):
+        """Returns the rows (numpy.ndarray(int32)) of the neighbours of row."""
+
+        return self.indices[self.indptr[row]:self.indptr[row + 1]]
+
+    def save(self, path):
+        """Saves the graph to the directory path."""
+
+        os.makedirs(path, exist_ok=True)
+        for name in ('indptr', 'indices', 'distances'):
+            np.save(os.path.join(path, name + '.npy'), getattr(self, name))
+        with open(os.path.join(path, 'meta.json'), 'w') as file:
+            json.dump({'num_tracks': len(self),
+                       'num_edges': len(self.indices)}, file)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Loads a graph that was saved with save()."""
+
+        mmap_mode = 'r' if mmap else None
+        return cls(*[np.load(os.path.join(path, name + '.npy'),
+                             mmap_mode=mmap_mode)
+                     for name in ('indptr', 'indices', 'distances')])
+
+
+def main():
+    from universe_store import UniverseStore
+
+    parser = argparse.ArgumentParser(
+        description='Build the neighbour graphs of the current universe '
+                    'snapshots.')
+    parser.add_argument('--store', default='universe',
+                        help='the directory of the universe store')
+    parser.add_argument('--markets', nargs='+', default=['DE'])
+    parser.add_argument('--k', type=int, default=32,
+                        help='the number of neighbours per track')
+    args = parser.parse_args()
+
+    store = UniverseStore(args.store)
+    for market in args.markets:
+        graph = store.build_neighbor_graph(market, args.k)
+        if graph is None:
+            print('%s: no snapshot' % market)
+        else:
+            print('%s: %d tracks, %d edges' % (market, len(graph),
+                                               len(graph.indices)))
+
+
+if __name__ == '__main__':
+    main()
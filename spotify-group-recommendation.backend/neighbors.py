@@ -0,0 +1,315 @@
+__author__ = 'Numan Tok'
+
+
+import copy
+import functools
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class BruteForceIndex:
+    """Neighbour search that scans every point on each query.
+
+    This is the reference implementation the other backends are checked
+    against. Distances are weighted L1 distances, i.e. the weighted feature 
+    distances of the graph model. The features are used as they are, so a 
+    memory-mapped matrix is never copied.
+
+    Attributes:
+        features (numpy.ndarray(float64 or float32)): A matrix with one row 
+            per point.
+        weights (numpy.ndarray(float64)): The weight of each feature.
+
+    """
+
+    def __init__(self, features, weights) -> None:
+        self.features = features
+        self.weights = weights
+
+    def __len__(self):
+        return len(self.features)
+
+    def with_weights(self, weights):
+        """Returns an index of the same points under other feature weights.
+
+        All data that does not depend on the weights is shared with self.
+
+        """
+
+        return BruteForceIndex(self.features, weights)
+
+    def distances(self, features, point):
+        """Returns the weighted L1 distances between each row and point."""
+
+        return np.absolute(features - point) @ self.weights
+
+    def distance_matrix(self, points, max_chunk_size=2**16):
+        """Returns the distances between several points and every row.
+
+        The rows are processed in chunks that fit into the CPU cache, so the 
+        absolute differences of at most max_chunk_size values are held at 
+        once. Each chunk is reduced with one matrix-vector product.
+
+        Args:
+            points (numpy.ndarray(float64)): The query points, one per row.
+            max_chunk_size (int): Bounds the memory of a chunk.
+
+        Returns:
+            A numpy ndarray of shape (number of points, number of rows).
+
+        """
+
+        num_points, num_features = points.shape
+        num_rows = len(self.features)
+        chunk_rows = max(1, max_chunk_size // max(1, num_points*num_features))
+        differences = np.empty((min(chunk_rows, num_rows), num_points,
+                                num_features))
+        distances = np.empty((num_rows, num_points))
+        for start in range(0, num_rows, chunk_rows):
+            stop = min(start + chunk_rows, num_rows)
+            chunk = differences[:stop - start]
+            np.subtract(self.features[start:stop, np.newaxis],
+                        points[np.newaxis], out=chunk)
+            np.absolute(chunk, out=chunk)
+            np.matmul(chunk.reshape(-1, num_features), self.weights,
+                      out=distances[start:stop].reshape(-1))
+
+        return distances.T
+
+    def nearest(self, point, available):
+        """Finds the nearest available point.
+
+        Ties are broken in favour of the point with the lowest index.
+
+        Args:
+            point (numpy.ndarray(float64)): The query point.
+            available (numpy.ndarray(bool)): A mask with one entry per point
+                that is False for all points that must not be returned.
+
+        Returns:
+            The index (int) of the nearest available point.
+
+        """
+
+        if not available.any():
+            raise ValueError('There are no selectable tracks left.')
+
+        # Only the available points are compared, which also holds if all 
+        # of their distances are infinite
+        candidates = np.flatnonzero(available)
+        distances = self.distances(self.features, point)
+
+        return int(candidates[np.argmin(distances[candidates])])
+
+
+class KDTreeIndex(BruteForceIndex):
+    """Neighbour search backed by a KD-tree.
+
+    The tree is built once and queried for the k nearest points. If none of
+    them is available, k is doubled until an available point is found, so
+    "nearest not-yet-used" queries stay cheap as long as only a small part of
+    the points has been used. The candidates are re-ranked with the exact
+    distances of BruteForceIndex to return the same results.
+
+    The tree is built on the weight scaled features, where the L1 distance 
+    equals the weighted feature distance.
+
+    Attributes:
+        features (numpy.ndarray(float64 or float32)): A matrix with one row 
+            per point.
+        weights (numpy.ndarray(float64)): The weight of each feature.
+        initial_k (int): How many neighbours are requested by the first query.
+
+    """
+
+    def __init__(self, features, weights, initial_k=16) -> None:
+        super().__init__(features, weights)
+        self.initial_k = initial_k
+        self.tree = cKDTree(features * weights)
+
+    def with_weights(self, weights):
+        # The tree is built in the weighted feature space
+        return KDTreeIndex(self.features, weights, self.initial_k)
+
+    def nearest(self, point, available):
+        num_points = len(self.features)
+        k = min(self.initial_k, num_points)
+        weighted_point = point * self.weights
+
+        while True:
+            tree_distances, indices = self.tree.query(
+                weighted_point, k=k, p=1)
+            tree_distances = np.atleast_1d(tree_distances)
+            indices = np.atleast_1d(indices)
+
+            candidates = np.sort(indices[available[indices]])
+            if len(candidates) > 0:
+                distances = self.distances(self.features[candidates], point)
+                best = np.argmin(distances)
+                # Only trust the result if no point outside of the k queried
+                # ones can be as near as the best candidate
+                kth_distance = tree_distances[-1]
+                if k == num_points or \
+                        distances[best] < kth_distance - 1e-9*(1+kth_distance):
+                    return int(candidates[best])
+            elif k == num_points:
+                raise ValueError('There are no selectable tracks left.')
+
+            k = min(2*k, num_points)
+
+
+def _aligned_empty(shape, dtype, alignment=64):
+    """Allocates a C-contiguous array that starts at a cache line boundary."""
+
+    dtype = np.dtype(dtype)
+    num_bytes = int(np.prod(shape)) * dtype.itemsize
+    buffer = np.empty(num_bytes + alignment, dtype=np.uint8)
+    offset = -buffer.ctypes.data % alignment
+    return buffer[offset:offset + num_bytes].view(dtype).reshape(shape)
+
+
+class QuantizedIndex(BruteForceIndex):
+    """Neighbour search on a compact copy of the features.
+
+    Every feature is scaled to [0, 1] by its range and stored with 1 byte 
+    (uint8) or 2 bytes (float16) instead of 8, in one contiguous, aligned 
+    array. A query scans the compact array in cache-sized chunks and gets 
+    approximate distances, whose error is bounded by the quantization step. 
+    Only the points that may be the nearest one under this bound are 
+    re-checked with the exact distances of BruteForceIndex, so the results 
+    are the same. The full-precision features are only read for these 
+    candidates, e.g. a few pages of a memory-mapped matrix.
+
+    Attributes:
+        features (numpy.ndarray(float64 or float32)): A matrix with one row 
+            per point.
+        weights (numpy.ndarray(float64)): The weight of each feature.
+        dtype (numpy.dtype): The data type of the codes, uint8 or float16.
+        chunk_size (int): How many points are scanned at once.
+        codes (numpy.ndarray(uint8 or float16)): The compact features.
+        error_bound (float): The maximal difference between an approximate 
+            and an exact distance, apart from a shift that is the same for 
+            all points.
+
+    """
+
+    # The maximal error of a scaled feature difference, half a step of the
+    # quantized point and half a step of the quantized query each
+    QUANTIZATION_ERRORS = {'uint8': 1 / 255, 'float16': 2**-11}
+
+    def __init__(self, features, weights, dtype='uint8',
+                 chunk_size=16384) -> None:
+        super().__init__(features, weights)
+        self.dtype = np.dtype(dtype)
+        self.chunk_size = chunk_size
+        self.feature_min = np.asarray(
+            features.min(axis=0, initial=np.inf), dtype='float64')
+        feature_range = np.asarray(
+            features.max(axis=0, initial=-np.inf), dtype='float64') - \
+            self.feature_min
+        feature_range[~(feature_range > 0)] = 1
+        self.feature_min[~np.isfinite(self.feature_min)] = 0
+        self.feature_range = feature_range
+        self.levels = 255 if self.dtype == np.uint8 else 1
+
+        self.codes = _aligned_empty(features.shape, self.dtype)
+        for start in range(0, len(features), chunk_size):
+            self.codes[start:start + chunk_size] = self._quantize(
+                features[start:start + chunk_size])
+
+        self._set_weights(weights)
+
+    def with_weights(self, weights):
+        # The codes do not depend on the weights
+        index = copy.copy(self)
+        index._set_weights(weights)
+        return index
+
+    def _set_weights(self, weights):
+        self.weights = weights
+        # Weights for code differences, which are accumulated in float32
+        scaled_weights = weights * self.feature_range / self.levels
+        self._code_weights = scaled_weights.astype('float32')
+        self.error_bound = float(np.sum(weights * self.feature_range)) * \
+            (self.QUANTIZATION_ERRORS[self.dtype.name] + 1e-6)
+
+    def _quantize(self, features):
+        scaled = np.clip((features - self.feature_min) / self.feature_range,
+                         0, 1)
+        if self.dtype == np.uint8:
+            return np.rint(scaled * 255).astype(self.dtype)
+        return scaled.astype(self.dtype)
+
+    def approximate_distances(self, point):
+        """Returns the approximate distances between each point and point.
+
+        A query point outside of the range of the features is moved onto 
+        its boundary, which shifts the distances of all points equally.
+
+        Returns:
+            A numpy ndarray(float32) with one distance per point.
+
+        """
+
+        code = self._quantize(point)
+        distances = np.empty(len(self.codes), dtype='float32')
+        for start in range(0, len(self.codes), self.chunk_size):
+            chunk = self.codes[start:start + self.chunk_size]
+            if self.dtype == np.uint8:
+                # Stays within uint8, unlike a subtraction
+                differences = np.maximum(chunk, code) - \
+                    np.minimum(chunk, code)
+            else:
+                differences = chunk.astype('float32')
+                differences -= code.astype('float32')
+                np.absolute(differences, out=differences)
+            np.matmul(differences, self._code_weights,
+                      out=distances[start:start + len(chunk)])
+
+        return distances
+
+    def nearest(self, point, available):
+        if not available.any():
+            raise ValueError('There are no selectable tracks left.')
+
+        distances = self.approximate_distances(point)
+        distances[~available] = np.inf
+        # The exact nearest point is at most 2 error bounds farther away
+        candidates = np.flatnonzero(
+            (distances <= float(distances.min()) + 2*self.error_bound) &
+            available)
+        exact_distances = self.distances(self.features[candidates], point)
+
+        return int(candidates[np.argmin(exact_distances)])
+
+
+NEIGHBOR_BACKENDS = {
+    'brute': BruteForceIndex,
+    'kdtree': KDTreeIndex,
+    'uint8': QuantizedIndex,
+    'float16': functools.partial(QuantizedIndex, dtype='float16'),
+}
+
+
+def build_neighbor_index(backend, features, weights):
+    """Builds a neighbour search index.
+
+    Args:
+        backend (str): The name of the backend, one of NEIGHBOR_BACKENDS.
+        features (numpy.ndarray(float64 or float32)): A matrix with one row 
+            per point.
+        weights (numpy.ndarray(float64)): The weight of each feature.
+
+    Returns:
+        An index with a nearest(point, available) method.
+
+    """
+
+    try:
+        index_class = NEIGHBOR_BACKENDS[backend]
+    except KeyError:
+        raise ValueError('Unknown neighbour backend %r, expected one of %s.'
+                         % (backend, ', '.join(NEIGHBOR_BACKENDS))) from None
+
+    return index_class(features, weights)
@@ -1,10 +1,18 @@
 __author__ = 'Numan Tok'
 
 
-import pandas as pd
+import copy
+import itertools
+
+import numpy as np
 import spotipy.exceptions
-from sklearn.preprocessing import MinMaxScaler
-import time
+
+from fetching import ConcurrentFetcher
+from instrumentation import Trace
+from spotify_client import ClientScheduler
+from track_matrix import PlaylistCollection, TrackMatrix, TrackTable, \
+    consecutive_distance_sums
+from universe_store import AUDIO_FEATURES, UniverseSnapshot
 
 
 class DataPreparation:
@@ -13,75 +21,122 @@ class DataPreparation:
     Attributes:
         selected_features (list(strings)): Audio features that should be used 
             in the model.
-        users (list(<class 'spotipy.client.Spotify'>)): A list that includes a 
-            spotify client for each user/group member.
+        users (list(<class 'spotify_client.SpotifyClient'>)): A list that 
+            includes a spotify client for each user/group member. The clients 
+            take care of rate limiting and retries.
+        clients (spotify_client.ClientScheduler): Spreads the calls that do 
+            not depend on the user, like audio features, featured playlists 
+            and pages of public playlists, over all clients in self.users.
         max_playlists_per_user (int): How many library saved playlists should 
             be retrieved per user. Must be between 1 and 50.
-        min_universe_size (int): The desired minimal track universe size.
+        min_universe_size (int): The desired minimal track universe size 
+            when the universe is crawled for the request. It is not used 
+            with a universe_store, whose snapshots always hold the tracks of 
+            all featured playlists of their market.
+        feature_cache (feature_cache.AudioFeatureCache): An optional cache 
+            for the audio features of tracks. Only the tracks that are not 
+            cached are retrieved from the spotify API.
+        max_concurrency (int): The maximal number of concurrent requests to 
+            the spotify API, shared by all streams of self.fetcher.
+        universe_store (universe_store.UniverseStore): An optional store of 
+            track universe snapshots. If given, the track universe is loaded 
+            from it instead of being crawled, and stale snapshots are 
+            refreshed in the background.
+        markets (list(str)): The markets (ISO 3166-1 alpha-2 country codes) 
+            whose featured playlists form the track universe when a 
+            universe_store is used.
+        raw_track_universe (pandas.core.frame.DataFrame(float64) or 
+            track_matrix.TrackMatrix): The track universe before 
+            normalize_data(). It can be passed as track_universe to another 
+            DataPreparation to share the universe between groups. A normalized 
+            TrackMatrix is used by normalize_data() without any copy.
+        progress (callable): Optionally called with the name of each stage 
+            ('fetch', 'normalize') when it starts.
+        trace (instrumentation.Trace): Records the time of each stage and 
+            the audio feature cache hits of the request.
+        track_table (track_matrix.TrackTable): The audio features of all 
+            tracks retrieved for the request, each unique track once. The 
+            playlists, top tracks and a crawled universe are built from it.
+        library_store (library_store.LibraryStore): An optional store of the 
+            synced library playlists. If given, only the playlists that 
+            changed since their last sync are retrieved.
+        neighbor_graph (neighbor_graph.NeighborGraph): The neighbour graph 
+            of self.track_universe if it was loaded from a snapshot of one 
+            market that has one, otherwise None. It is built under all 
+            AUDIO_FEATURES, so it fits best if all of them are selected.
 
     """
 
-    def __init__(self, selected_features, users, max_playlists_per_user=50, min_universe_size=1000) -> None:
+    def __init__(self, selected_features, users, max_playlists_per_user=50, min_universe_size=1000, track_universe=None, feature_cache=None, max_concurrency=8, universe_store=None, markets=('DE',), progress=None, trace=None, library_store=None) -> None:
         self.selected_features = selected_features
         self.users = users
+        self.clients = ClientScheduler(users)
         self.max_playlists_per_user = max_playlists_per_user
         self.min_universe_size = min_universe_size
-        self.track_universe = self.prepare_track_universe()
-        self.custom_users_playlists = self.prepare_user_playlists()
-        self.users_top_tracks = self.prepare_users_top_tracks()
-        self.normalize_data()
+        self.feature_cache = feature_cache
+        self.fetcher = ConcurrentFetcher(max_concurrency)
+        self.universe_store = universe_store
+        self.markets = markets
+        self.library_store = library_store
+        self.neighbor_graph = None
+        self.progress = progress if progress is not None else \
+            lambda stage: None
+        self.trace = trace if trace is not None else Trace()
+        self.track_table = TrackTable(AUDIO_FEATURES + [
+            feature for feature in selected_features
+            if feature not in AUDIO_FEATURES])
+        self.progress('fetch')
+        with self.trace.stage('universe'):
+            if track_universe is None and universe_store is not None:
+                track_universe = self.load_track_universe()
+            elif track_universe is None:
+                track_universe = self.prepare_track_universe()
+        self.raw_track_universe = track_universe
+        self.track_universe = track_universe
+        with self.trace.stage('playlists'):
+            self.custom_users_playlists = self.prepare_user_playlists()
+        with self.trace.stage('top_tracks'):
+            self.users_top_tracks = self.prepare_users_top_tracks()
+        self.progress('normalize')
+        with self.trace.stage('normalize'):
+            self.normalize_data()
 
     def normalize_data(self):
-        """Normalizes all track data with a MinMaxScaler.
+        """Normalizes all track data to the range [0, 1] like a MinMaxScaler.
 
-        A MinMaxScaler is fitted on self.track_universe for the features given in self.selected_features which then transforms self.track_universe, self.custom_users_playlists and self.users_top_tracks.
+        The minimum and maximum of each feature in self.track_universe are 
+        computed in one vectorized pass and used to scale self.
+        track_universe, self.custom_users_playlists and self.
+        users_top_tracks. The playlists are scaled at once, as one matrix of 
+        their unique tracks.
+
+        If self.track_universe is an already normalized track_matrix.
+        TrackMatrix, its stored feature ranges are used instead and it is not 
+        transformed again.
 
         """
 
-        # Fit scaler to self.track_universe and use this scale for every data
-        scaler = MinMaxScaler()
-        scaler.fit(self.track_universe.iloc[:, 1:])
-
-        # Scale self.track_universe
-        track_universe_id_col = self.track_universe.iloc[:, 0]
-        track_universe_scaled = pd.DataFrame(scaler.transform(
-            self.track_universe.iloc[:, 1:]))
-        self.track_universe = pd.concat(
-            [track_universe_id_col, track_universe_scaled], axis=1)
-
-        # Scale self.custom_users_playlists
-        custom_users_playlists_id_col = [
-            [playlist.iloc[:, 0]
-             for playlist in user_playlists]
-            for user_playlists in self.custom_users_playlists
-        ]
-        custom_users_playlist_scaled = [
-            [pd.DataFrame(scaler.transform(playlist.iloc[:, 1:]))
-             for playlist in user_playlists]
-            for user_playlists in self.custom_users_playlists
-        ]
-        self.custom_users_playlists = [
-            [pd.concat([
-                custom_users_playlists_id_col[user_j][playlist_i],
-                custom_users_playlist_scaled[user_j][playlist_i]
-            ], axis=1)
-                for playlist_i in range(len(self.custom_users_playlists[user_j]))]
-            for user_j in range(len(self.custom_users_playlists))
-        ]
-
-        # Scale self.users_top_tracks
-        users_top_tracks_id_col = self.users_top_tracks.iloc[:, 0]
-        users_top_tracks_scaled = pd.DataFrame(
-            scaler.transform(self.users_top_tracks.iloc[:, 1:]))
-        self.users_top_tracks = pd.concat(
-            [users_top_tracks_id_col, users_top_tracks_scaled], axis=1)
+        if not isinstance(self.track_universe, TrackMatrix):
+            self.track_universe = TrackMatrix.from_dataframe(
+                self.track_universe)
+        if not self.track_universe.is_normalized:
+            self.track_universe = self.track_universe.normalize()
+        feature_min = self.track_universe.feature_min
+        feature_max = self.track_universe.feature_max
+
+        self.custom_users_playlists = self.custom_users_playlists.normalize(
+            feature_min, feature_max)
+
+        self.users_top_tracks = TrackMatrix.from_dataframe(
+            self.users_top_tracks).normalize(
+                feature_min, feature_max).to_dataframe()
 
     def retrieve_audio_features(self, tracks):
         """Retrieves a selection of audio features for tracks.
 
         For each track given in tracks the audio features are retrieved from 
-        the spotify API and stored in a pandas DataFrame together with the 
-        track ID.
+        self.feature_cache or, if they are not cached, from the spotify API 
+        and stored in a pandas DataFrame together with the track ID.
 
         Args:
             tracks (dict): A dictionary including track information returned by 
@@ -96,110 +151,355 @@ class DataPreparation:
         # Get all track IDs
         track_ids = [track['track']['id']
                      for track in tracks if track['track'] is not None]
+        self._intern_audio_features(track_ids)
 
-        # Split track IDs into chunks of 100 (maximum allowed by the endpoint)
-        track_id_chunks = [track_ids[i:i+100]
-                           for i in range(0, len(track_ids), 100)]
+        return self._audio_features_frame(track_ids)
 
-        # Get the audio features of all tracks in each chunk
-        audio_features_chunks = []
-        for chunk in track_id_chunks:
-            audio_features = self.users[0]._get(
-                'audio-features', ids=','.join(chunk))
-            audio_features_chunks.append(audio_features)
-        # Combine audio features from all chunks into a single list
-        audio_features = [
-            item for chunk in audio_features_chunks for item in chunk['audio_features']]
+    def _intern_audio_features(self, track_ids, track_table=None):
+        """Adds the audio features of tracks to a track table.
 
-        # Filter the audio features by self.selected_features
-        while None in audio_features:
-            track_ids.remove(track_ids[audio_features.index(None)])
-            audio_features.remove(None)
+        track_ids is consumed lazily, e.g. while the pages of playlists are 
+        still being retrieved. Tracks that are already in self.track_table 
+        are skipped, so the audio features of every track are retrieved only 
+        once per request. The other tracks are looked up in batches of 100 
+        IDs in self.feature_cache, and the tracks that are not cached are 
+        retrieved from the spotify API in concurrent batches of 100 as soon 
+        as there are enough of them.
 
-        selected_audio_features = [{
-            key: track_features[key] for key in self.selected_features}
-            for track_features in audio_features]
+        Args:
+            track_ids (iterable(str)): The IDs of the tracks. Tracks without 
+                audio features are not added.
+            track_table (track_matrix.TrackTable): The table to add the 
+                tracks to. Defaults to self.track_table.
 
+        """
 
+        if track_table is None:
+            track_table = self.track_table
 
-        # Create a DataFrame with columns 'id' and all self.audio_features
-        df = pd.DataFrame(
-            {'id': track_ids, **{key: [feature[key] for feature in
-                                       selected_audio_features] for key in self.selected_features}},
-            dtype='float64')
+        # Audio features found in the cache while collecting missing tracks
+        cached = {}
 
-        return df
+        def missing_batches():
+            seen = set()
+            candidates = []
+            missing = []
+            for track_id in track_ids:
+                if track_id is None or track_id in seen or \
+                        track_id in track_table:
+                    continue
+                seen.add(track_id)
+                candidates.append(track_id)
+                if len(candidates) == 100:
+                    missing.extend(self._lookup_cached(candidates, cached))
+                    candidates = []
+                    if len(missing) >= 100:
+                        yield missing[:100]
+                        missing = missing[100:]
+            if candidates:
+                missing.extend(self._lookup_cached(candidates, cached))
+            for i in range(0, len(missing), 100):
+                yield missing[i:i+100]
+
+        for retrieved in self.fetcher.imap(self._fetch_audio_features,
+                                           missing_batches()):
+            for track_id, track_features in itertools.chain(
+                    retrieved.items(), cached.items()):
+                if track_features is not None:
+                    track_table.add(track_id, track_features)
+            cached.clear()
+        for track_id, track_features in cached.items():
+            if track_features is not None:
+                track_table.add(track_id, track_features)
+
+    def _lookup_cached(self, track_ids, found):
+        """Adds the cached audio features of track_ids to found.
+
+        Tracks with a negative cache entry are added with None, so they are 
+        not retrieved again.
 
-    def custom_audio_features_playlists(self, playlists):
-        """Get a custom playlists representation with audio features.
+        Returns:
+            A list including the IDs of the tracks that are not cached.
 
-        Loop through each playlist and retrieve its tracks and their audio 
-        features. The playlists include the track IDs and audio features.
+        """
+
+        if self.feature_cache is not None:
+            found_before = len(found)
+            found.update(self.feature_cache.get_many(track_ids))
+            num_hits = len(found) - found_before
+        else:
+            num_hits = 0
+        self.trace.record_cache('audio_features', hits=num_hits,
+                                misses=len(track_ids) - num_hits)
+        return [track_id for track_id in track_ids if track_id not in found]
+
+    def _fetch_audio_features(self, track_ids):
+        """Retrieves the audio features of up to 100 tracks from the API.
+
+        Returns:
+            A dict that maps the track IDs to their audio features (dict). 
+            Tracks without audio features are missing, they get a negative 
+            entry in self.feature_cache.
+
+        """
+
+        with self.trace.stage('audio_features'):
+            response = self.clients._get(
+                'audio-features', ids=','.join(track_ids))
+            retrieved = dict(zip(track_ids, response['audio_features']))
+            if self.feature_cache is not None and retrieved:
+                self.feature_cache.put_many(retrieved)
+
+        return {track_id: track_features
+                for track_id, track_features in retrieved.items()
+                if track_features is not None}
+
+    def _audio_features_frame(self, track_ids, features=None):
+        """Creates a DataFrame with the selected audio features of tracks.
 
         Args:
-            playlists (list(dict())): A list of dictionaries including playlist 
-            data returned by the spotify API.
+            track_ids (list(str)): The IDs of the tracks, one row each. 
+                Tracks that are not in self.track_table are dropped.
+            features (list(str)): The audio features to select. Defaults to 
+                self.selected_features.
 
         Returns:
-            A list of pandas DataFrames including values of type float64 for 
-            the columns 'id' and self.selected_features each representing one 
-            playlist.
+            A pandas DataFrame including values of type float64 for the columns 
+            'id' and features.
 
         """
 
-        custom_playlists = []
+        if features is None:
+            features = self.selected_features
 
-        for playlist in playlists:
-            # Retrieve playlist tracks
-            correct_user = ""
-            for user in self.users:
+        return self.track_table.track_matrix(
+            self.track_table.rows(track_ids), features).to_dataframe()
+
+    def _iter_playlists_track_ids(self, playlists, limit=100, public=False):
+        """Streams the track IDs of several playlists.
+
+        The pages of public playlists are retrieved with self.clients, so 
+        they are spread over all clients. The first page of any other 
+        playlist is retrieved with the first client in self.users that has 
+        access to it, and its remaining pages with the same client. The 
+        remaining pages are retrieved concurrently and every page is reduced 
+        to its track IDs as soon as it arrives.
+
+        Args:
+            playlists (list(dict())): A list of dictionaries including playlist 
+                data returned by the spotify API.
+            limit (int): The number of tracks per page, at most 100.
+            public (bool): Whether all playlists are public, like featured 
+                playlists. Otherwise only the playlists whose 'public' is 
+                True are.
+
+        Yields:
+            A tuple (index of the playlist in playlists, list of track IDs 
+            (str) of one page). The pages of each playlist are yielded in 
+            order. Playlists that no client has access to are yielded once 
+            without tracks.
+
+        """
+
+        def retrieve_first_page(playlist):
+            users = self.users
+            if public or playlist.get('public') is True:
+                users = [self.clients] + users
+            for user in users:
                 try:
-                    results = user.playlist_tracks(playlist['id'])
-                    break
+                    page = user.playlist_tracks(playlist['id'], limit=limit)
                 except spotipy.exceptions.SpotifyException:
                     continue
+                paging = {key: page[key]
+                          for key in ('offset', 'limit', 'total', 'next')}
+                return user, paging, _page_track_ids(page)
+            return None, None, []
+
+        first_pages = []
+        for i, (user, paging, track_ids) in enumerate(
+                self.fetcher.imap(retrieve_first_page, playlists)):
+            first_pages.append((user, paging))
+            yield i, track_ids
+        accessible = [i for i, (_, paging) in enumerate(first_pages)
+                      if paging is not None]
+
+        def retrieve_page(j, offset):
+            user = first_pages[accessible[j]][0]
+            return _page_track_ids(user.playlist_tracks(
+                playlists[accessible[j]]['id'], limit=limit, offset=offset))
+
+        for j, track_ids in self.fetcher.iter_remaining_pages(
+                [first_pages[i][1] for i in accessible], retrieve_page):
+            yield accessible[j], track_ids
+
+    def _retrieve_playlists(self, playlists):
+        """Retrieves the track IDs of playlists and their audio features.
+
+        The audio features are added to self.track_table while the pages of 
+        the playlists are still arriving, so no page is kept in memory.
+
+        Returns:
+            A list including a list of track IDs (str) for each playlist.
+
+        """
+
+        playlists_track_ids = [[] for _ in playlists]
+
+        def track_ids():
+            for i, page_track_ids in self._iter_playlists_track_ids(
+                    playlists):
+                playlists_track_ids[i].extend(page_track_ids)
+                yield from page_track_ids
+
+        self._intern_audio_features(track_ids())
+
+        return playlists_track_ids
+
+    def _custom_playlists(self, playlists):
+        """Like custom_audio_features_playlists(), but keeps empty playlists.
+
+        Returns:
+            A list including a pandas DataFrame for each playlist, or None if 
+            the playlist has no tracks.
+
+        """
+
+        playlists_track_ids = self._retrieve_playlists(playlists)
+
+        return [self._audio_features_frame(track_ids)
+                if len(track_ids) > 0 else None
+                for track_ids in playlists_track_ids]
+
+    def custom_audio_features_playlists(self, playlists):
+        """Get a custom playlists representation with audio features.
 
-            tracks = results['items']
+        Loop through each playlist and retrieve its tracks and their audio 
+        features. The playlists include the track IDs and audio features.
 
-            while results['next']:
-                while True:
-                    try:
-                        results = user.next(results)
-                        break
-                    except spotipy.exceptions.SpotifyException:
-                        continue
+        Args:
+            playlists (list(dict())): A list of dictionaries including playlist 
+            data returned by the spotify API.
 
-                tracks.extend(results['items'])
+        Returns:
+            A list of pandas DataFrames including values of type float64 for 
+            the columns 'id' and self.selected_features each representing one 
+            playlist.
 
-            if len(tracks) > 0:
-                custom_playlists.append(self.retrieve_audio_features(tracks))
+        """
 
-        return custom_playlists
+        return [playlist for playlist in self._custom_playlists(playlists)
+                if playlist is not None]
 
     def prepare_user_playlists(self):
         """Retrieve the necessary playlist data for each user. 
 
         Up to self.max_playlists_per_user playlists that a user has saved in 
-        their library are retrieved for each user and then prepared with self.
-        custom_audio_features_playlists().
+        their library are retrieved for each user. The tracks of all 
+        playlists are stored without any DataFrame in one 
+        track_matrix.PlaylistCollection, which can be normalized at once.
+
+        With a self.library_store only the playlists whose snapshot_id 
+        changed since their last sync are retrieved. The collection then 
+        includes the distance sums of all playlists, but only the tracks of 
+        the retrieved ones.
 
         Returns:
-            A list including a list for each user that includes pandas 
-            DataFrames including values of type float64 for the columns 
-            'id' and self.selected_features each representing one playlist.
+            A track_matrix.PlaylistCollection with the columns self.
+            selected_features. Playlists without tracks and users without 
+            playlists are left out.
         """
 
-        users_playlists = [sp_client.current_user_playlists(
-            limit=self.max_playlists_per_user, offset=0) for sp_client in self.users]
-        custom_users_playlists = []
-
+        users_playlists = self.fetcher.map(
+            lambda sp_client: sp_client.current_user_playlists(
+                limit=self.max_playlists_per_user, offset=0),
+            self.users)
+        playlists = [playlist for user in users_playlists
+                     for playlist in user['items']]
+
+        # Retrieve the playlists of all users at once and split them up again
+        if self.library_store is None:
+            playlists_track_ids = self._retrieve_playlists(playlists)
+            playlists_distance_sums = None
+        else:
+            playlists_track_ids, playlists_distance_sums = \
+                self._sync_playlists(playlists)
+        users_playlists_track_ids = []
+        users_playlists_distance_sums = []
+        start = 0
         for user in users_playlists:
-            custom_playlists = self.custom_audio_features_playlists(
-                user['items'])
-            if len(custom_playlists) > 0:
-                custom_users_playlists.append(custom_playlists)
+            end = start + len(user['items'])
+            users_playlists_track_ids.append(playlists_track_ids[start:end])
+            if playlists_distance_sums is not None:
+                users_playlists_distance_sums.append(
+                    playlists_distance_sums[start:end])
+            start = end
+
+        return PlaylistCollection.from_track_table(
+            users_playlists_track_ids, self.track_table,
+            self.selected_features,
+            users_playlists_distance_sums=users_playlists_distance_sums
+            if playlists_distance_sums is not None else None)
+
+    def _sync_playlists(self, playlists):
+        """Retrieves the playlists that changed since their last sync.
+
+        The unchanged playlists are looked up in self.library_store by their 
+        snapshot_id. The other ones are retrieved once each, even if several 
+        users saved them, and the raw distance sums of their tracks are 
+        stored in self.library_store.
+
+        Args:
+            playlists (list(dict())): A list of dictionaries including playlist 
+                data returned by the spotify API.
+
+        Returns:
+            A tuple of two lists with an entry for each playlist: the track 
+            IDs (list(str)), which are empty for unchanged playlists, and the 
+            distance sums of self.selected_features (numpy.ndarray(float64)) 
+            or None if the playlist has no tracks with audio features.
+
+        """
+
+        unchanged = {
+            playlist_id: (num_tracks, distance_sums)
+            for playlist_id, (num_tracks, distance_sums)
+            in self.library_store.get_unchanged(playlists).items()
+            if all(feature in distance_sums
+                   for feature in self.selected_features)}
+        changed = list({playlist['id']: playlist for playlist in playlists
+                        if playlist['id'] not in unchanged}.values())
+        self.trace.record_cache('library', hits=len(unchanged),
+                                misses=len(changed))
+
+        changed_track_ids = self._retrieve_playlists(changed)
+        changed_rows = [self.track_table.rows(track_ids)
+                        for track_ids in changed_track_ids]
+        offsets = np.cumsum([0] + [len(rows) for rows in changed_rows])
+        distance_sums = consecutive_distance_sums(
+            self.track_table.track_matrix(
+                list(itertools.chain.from_iterable(changed_rows))).features,
+            offsets)
+        synced = {playlist['id']: (playlist['snapshot_id'], len(rows),
+                                   dict(zip(self.track_table.columns,
+                                            sums.tolist())))
+                  for playlist, rows, sums
+                  in zip(changed, changed_rows, distance_sums)}
+        self.library_store.put_many(synced)
+
+        track_ids = dict(zip([playlist['id'] for playlist in changed],
+                             changed_track_ids))
+        playlists_track_ids = []
+        playlists_distance_sums = []
+        for playlist in playlists:
+            playlists_track_ids.append(track_ids.get(playlist['id'], []))
+            num_tracks, sums = unchanged[playlist['id']] \
+                if playlist['id'] in unchanged else synced[playlist['id']][1:]
+            playlists_distance_sums.append(
+                np.array([sums[feature]
+                          for feature in self.selected_features])
+                if num_tracks > 0 else None)
 
-        return custom_users_playlists
+        return playlists_track_ids, playlists_distance_sums
 
     def prepare_track_universe(self, limit=50):
         """Prepares a pool of tracks to select from.
@@ -215,52 +515,189 @@ class DataPreparation:
 
         """
 
-        all_tracks = []
-        all_track_ids = set()
-        current_track_count = 0
+        all_track_ids = []
         offset = 0
-        delay = limit * 0  # set to 0 because this method seems to not work
-        time_at_last_call = time.time()-delay
-        while True:
-            before_loop_track_count = current_track_count
 
-            # Use delay to avoid hitting API limits
-            time_since_last_call = time.time() - time_at_last_call
-            time_at_last_call = time.time()
-            time.sleep(max(0, delay-time_since_last_call))
+        def new_track_ids(playlists):
+            known_track_ids = set(all_track_ids)
+            for _, track_ids in self._iter_playlists_track_ids(
+                    playlists, public=True):
+                for track_id in track_ids:
+                    if track_id not in known_track_ids:
+                        known_track_ids.add(track_id)
+                        all_track_ids.append(track_id)
+                        yield track_id
+
+        while True:
+            before_loop_track_count = len(all_track_ids)
 
             # Get random playlists available in spotify
-            featured_playlists = self.users[0].featured_playlists(
+            featured_playlists = self.clients.featured_playlists(
                 country='DE', limit=limit, offset=offset)
-            playlist_ids = [item['id'] for item in
-                            featured_playlists['playlists']['items']]
-
-            # Collect all available tracks
-            for playlist_id in playlist_ids:
-                results = self.users[0].playlist_tracks(playlist_id, limit=50)
-                tracks = [track
-                          for track in results['items'] if track['track'] is not None]
-                while results['next']:
-                    results = self.users[0].next(results)
-                    tracks.extend(
-                        [track for track in results['items'] if track['track'] is not None])
-
-                # Add unique tracks to all_tracks and all_track_ids
-                for track in tracks:
-                    if track['track']['id'] not in all_track_ids:
-                        all_tracks.append(track)
-                        all_track_ids.add(track['track']['id'])
-                        current_track_count += 1
+
+            # Collect the unique tracks and retrieve their audio features 
+            # while the pages of the playlists arrive
+            self._intern_audio_features(
+                new_track_ids(featured_playlists['playlists']['items']))
 
             # Stop if we have enough tracks or if no tracks were added
-            if current_track_count >= self.min_universe_size or \
-                    current_track_count == before_loop_track_count:
+            if len(all_track_ids) >= self.min_universe_size or \
+                    len(all_track_ids) == before_loop_track_count:
                 break
             offset += limit
 
-        all_tracks = self.retrieve_audio_features(all_tracks)
+        return self._audio_features_frame(all_track_ids)
+
+    def load_track_universe(self):
+        """Loads the track universe from self.universe_store.
 
-        return all_tracks
+        The snapshots of all self.markets are combined. A market that was 
+        never crawled is crawled right away, a stale snapshot is used as it 
+        is and refreshed in the background.
+
+        Returns:
+            A track_matrix.TrackMatrix with the columns self.selected_features 
+            representing the pool of tracks to select from (aka track 
+            universe).
+
+        """
+
+        snapshots = []
+        for market in self.markets:
+            snapshot = self.universe_store.load(market)
+            self.trace.record_cache('universe_store',
+                                    hits=int(snapshot.version > 0),
+                                    misses=int(snapshot.version == 0))
+            if snapshot.version == 0:
+                snapshot = self.refresh_track_universe(
+                    snapshot, track_table=self.track_table)
+                self.universe_store.save(snapshot)
+            elif self.universe_store.is_stale(snapshot):
+                self.universe_store.refresh_in_background(
+                    market, self._background_copy().refresh_track_universe)
+            snapshots.append(snapshot)
+
+        if len(snapshots) == 1:
+            # The normalized, memory-mapped snapshot can be used as it is
+            tracks = snapshots[0].normalized_tracks
+            if tracks is None:
+                tracks = snapshots[0].tracks
+            # Selecting features keeps the rows the graph refers to
+            self.neighbor_graph = snapshots[0].neighbor_graph
+        else:
+            tracks = TrackMatrix.concatenate(
+                [snapshot.tracks for snapshot in snapshots])
+
+        return tracks.select(self.selected_features)
+
+    def _background_copy(self):
+        """Returns a copy for refreshing the track universe in the background.
+
+        A background refresh outlives the request that started it, so the 
+        copy has its own clients, fetcher, Trace and track table and does not 
+        report progress. The clients still use the tokens of the group 
+        members.
+
+        Returns:
+            A DataPreparation.
+
+        """
+
+        background = copy.copy(self)
+        background.users = [user.with_trace(None) for user in self.users]
+        background.clients = ClientScheduler(background.users)
+        background.fetcher = ConcurrentFetcher(self.fetcher.max_concurrency)
+        background.trace = Trace()
+        background.progress = lambda stage: None
+        background.track_table = TrackTable(self.track_table.columns)
+        return background
+
+    def refresh_track_universe(self, snapshot, limit=50, track_table=None):
+        """Rebuilds snapshot from the current featured playlists.
+
+        All featured playlists of the snapshot's market are listed, but only 
+        the playlists that are not in the snapshot yet or whose snapshot_id 
+        changed are retrieved. The new universe consists of the tracks of 
+        the listed playlists only, so tracks of playlists that are no longer 
+        featured or that were removed from a playlist are dropped. Audio 
+        features are only retrieved for tracks that are new to the universe, 
+        the features of the other tracks are taken from the snapshot.
+
+        Args:
+            snapshot (universe_store.UniverseSnapshot): The current snapshot.
+            limit (int): Specifies how many featured playlists are to be 
+                retrieved per call of the Spotify API function 
+                featured_playlists().
+            track_table (track_matrix.TrackTable): The table the audio 
+                features of the new tracks are added to. Refreshes in the 
+                background use a new table, because self.track_table is not 
+                thread-safe.
+
+        Returns:
+            A new universe_store.UniverseSnapshot with the tracks of the 
+            current featured playlists and all AUDIO_FEATURES.
+
+        """
+
+        # List all featured playlists of the market
+        playlists = []
+        offset = 0
+        while True:
+            featured_playlists = self.clients.featured_playlists(
+                country=snapshot.market, limit=limit, offset=offset)
+            playlists.extend(playlist for playlist in
+                             featured_playlists['playlists']['items']
+                             if playlist is not None)
+            if not featured_playlists['playlists']['next']:
+                break
+            offset += limit
+
+        # Playlists of snapshots without playlist_tracks are retrieved again
+        playlist_tracks = {
+            playlist['id']: snapshot.playlist_tracks[playlist['id']]
+            for playlist in playlists
+            if playlist['id'] in snapshot.playlist_tracks and
+            snapshot.playlists.get(playlist['id']) ==
+            playlist.get('snapshot_id')}
+        changed_playlists = [playlist for playlist in playlists
+                             if playlist['id'] not in playlist_tracks]
+
+        # Retrieve the tracks that are new to the universe
+        known_track_ids = set(snapshot.tracks.ids)
+        new_track_ids = []
+
+        def track_ids():
+            for j, page_track_ids in self._iter_playlists_track_ids(
+                    changed_playlists, public=True):
+                playlist_tracks.setdefault(
+                    changed_playlists[j]['id'], []).extend(page_track_ids)
+                for track_id in page_track_ids:
+                    if track_id not in known_track_ids:
+                        known_track_ids.add(track_id)
+                        new_track_ids.append(track_id)
+                        yield track_id
+
+        if track_table is None:
+            track_table = TrackTable(AUDIO_FEATURES)
+        self._intern_audio_features(track_ids(), track_table)
+        new_tracks = track_table.track_matrix(
+            track_table.rows(new_track_ids), AUDIO_FEATURES)
+
+        # Keep the known tracks that are still in a listed playlist
+        member_track_ids = set(itertools.chain.from_iterable(
+            playlist_tracks.values()))
+        is_member = np.isin(snapshot.tracks.ids, list(member_track_ids))
+        kept_tracks = TrackMatrix(snapshot.tracks.ids[is_member],
+                                  snapshot.tracks.features[is_member],
+                                  snapshot.tracks.columns)
+
+        return UniverseSnapshot(
+            snapshot.market, snapshot.version, snapshot.updated_at,
+            {playlist['id']: playlist.get('snapshot_id')
+             for playlist in playlists},
+            TrackMatrix.concatenate([kept_tracks, new_tracks],
+                                    drop_duplicates=False),
+            playlist_tracks=playlist_tracks)
 
     def prepare_users_top_tracks(self, tracks_per_user=3):
         """Prepares the top tracks of all users.
@@ -277,13 +714,22 @@ class DataPreparation:
         """
 
         # Add top tracks from all users/group members
-        top_tracks = []
-        for sp_client in self.users:
-            top_tracks.extend(sp_client.current_user_top_tracks(
+        users_top_tracks = self.fetcher.map(
+            lambda sp_client: sp_client.current_user_top_tracks(
                 limit=tracks_per_user, time_range='long_term')['items']
-                [:tracks_per_user])
+            [:tracks_per_user],
+            self.users)
+        top_tracks = [track for user_top_tracks in users_top_tracks
+                      for track in user_top_tracks]
         top_tracks = [{'track': {'id': track['id']}}
                       for track in top_tracks]
         top_tracks = self.retrieve_audio_features(top_tracks)
 
         return top_tracks
+
+
+def _page_track_ids(page):
+    """Returns the IDs of the tracks of a page of playlist items."""
+
+    return [item['track']['id'] for item in page['items']
+            if item['track'] is not None and item['track']['id'] is not None]
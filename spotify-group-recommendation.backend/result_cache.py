@@ -0,0 +1,103 @@
+__author__ = 'Numan Tok'
+
+
+from collections import OrderedDict
+from concurrent.futures import Future
+import threading
+import time
+
+
+class ResultCache:
+    """An in-process cache for results that are expensive to compute.
+
+    Results expire ttl seconds after they were computed, and the least
+    recently used results are evicted once more than max_size are cached.
+    Concurrent requests for a key that is being computed are coalesced: the
+    first caller computes the result and all others wait for it instead of
+    computing it again. Errors are passed to all waiting callers but are not
+    cached.
+
+    Attributes:
+        max_size (int): How many results are kept.
+        ttl (float): How many seconds a result is valid.
+        hits (int): Number of requests answered from the cache.
+        coalesced (int): Number of requests that waited for a computation
+            that was already in flight.
+        misses (int): Number of requests that computed the result.
+
+    """
+
+    def __init__(self, max_size=128, ttl=10*60) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def stats(self):
+        """Returns the hit, coalesced and miss counters as a dict."""
+
+        with self._lock:
+            return {'hits': self.hits,
+                    'coalesced': self.coalesced,
+                    'misses': self.misses}
+
+    def get_or_compute(self, key, compute):
+        """Returns the result for key and computes it if necessary.
+
+        Args:
+            key (hashable): Identifies the result.
+            compute (callable): Called without arguments to compute the
+                result if it is neither cached nor in flight.
+
+        Returns:
+            The result for key.
+
+        """
+
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None and time.monotonic() < cached[0]:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return cached[1]
+
+            future = self._in_flight.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = self._in_flight[key] = Future()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not is_owner:
+            return future.result()
+
+        try:
+            result = compute()
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._in_flight[key]
+            self._remember(key, result)
+        future.set_result(result)
+        return result
+
+    def invalidate(self, key):
+        """Removes the cached result for key, if there is one."""
+
+        with self._lock:
+            self._results.pop(key, None)
+
+    def _remember(self, key, result):
+        self._results[key] = (time.monotonic() + self.ttl, result)
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_size:
+            self._results.popitem(last=False)
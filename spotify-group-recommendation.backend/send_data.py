@@ -1,16 +1,86 @@
+import time
+
 import spotify_api
+from fetching import ConcurrentFetcher
+
+
+PLAYLIST_NAME = "mixr"
+PLAYLIST_DESCRIPTION = "Trapaholics! Damn, son! Where did you find this?"
+# The spotify API accepts at most 100 tracks per call
+MAX_TRACKS_PER_REQUEST = 100
+
+
+def sendit(sp, group_playlist, username, max_concurrency=8):
+    """Uploads the group playlist to the library of every group member.
+
+    The uploads of all members run concurrently. Each member's "mixr"
+    playlist is reused if there is one, its items are replaced by the
+    group playlist, otherwise it is created.
+
+    Args:
+        sp (list(spotify_client.SpotifyClient)): A client for each member.
+        group_playlist (list(str)): The track IDs of the group playlist.
+        username (list(str)): The user ID of each member.
+        max_concurrency (int): How many members are uploaded to at once.
+
+    Returns:
+        A dict with the status and, for each member, the user ID, the
+        playlist ID and the seconds the upload took.
+
+    """
 
+    fetcher = ConcurrentFetcher(max_concurrency)
+    uploads = fetcher.map(
+        lambda member: upload_playlist(member[0], member[1], group_playlist),
+        list(zip(sp, username)))
+    for upload in uploads:
+        print("%s: %s (%.2fs)" % (upload["user"], upload["playlist_id"],
+                                  upload["seconds"]))
+    return {"status": "done", "uploads": uploads}
 
-def sendit(sp, group_playlist, username):
-    for sp, user_id in zip(sp, username):
-        playlist = sp.user_playlist_create(user=user_id, name="mixr", public=True,
-                                           collaborative=False,
-                                           description="Trapaholics! Damn, son! Where did you find this?")
+
+def upload_playlist(sp, user_id, group_playlist):
+    """Replaces the items of the "mixr" playlist of one user.
+
+    The tracks are sent in batches of MAX_TRACKS_PER_REQUEST, the first
+    batch replaces the old items and the others are appended in order.
+
+    Returns:
+        A dict with the user ID, the playlist ID and the seconds it took.
+
+    """
+
+    start = time.perf_counter()
+    playlist_id = find_playlist(sp, user_id, PLAYLIST_NAME)
+    if playlist_id is None:
+        playlist = sp.user_playlist_create(user=user_id, name=PLAYLIST_NAME,
+                                           public=True, collaborative=False,
+                                           description=PLAYLIST_DESCRIPTION)
         playlist_id = playlist["id"]
-        print(playlist_id)
-        upload = sp.user_playlist_add_tracks(user=user_id, playlist_id=playlist_id, tracks=group_playlist,
-                                             position=0)
-    return "done"
 
+    batches = [group_playlist[i:i + MAX_TRACKS_PER_REQUEST]
+               for i in range(0, len(group_playlist), MAX_TRACKS_PER_REQUEST)]
+    sp.playlist_replace_items(playlist_id, batches[0] if batches else [])
+    for batch in batches[1:]:
+        sp.playlist_add_items(playlist_id, batch)
+
+    return {"user": user_id, "playlist_id": playlist_id,
+            "seconds": time.perf_counter() - start}
+
+
+def find_playlist(sp, user_id, name):
+    """Returns the ID of the first playlist called name that user_id owns.
+
+    Returns:
+        The playlist ID (str) or None if the user has no such playlist.
 
+    """
 
+    page = sp.current_user_playlists(limit=50)
+    while page:
+        for playlist in page["items"]:
+            if playlist["name"] == name and \
+                    playlist["owner"]["id"] == user_id:
+                return playlist["id"]
+        page = sp.next(page) if page["next"] else None
+    return None
@@ -1,19 +1,57 @@
 __author__ = 'Numan Tok, Krystof Belak'
 
 
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
-import spotipy.util as util
+import hashlib
+
 import main
+from fetching import ConcurrentFetcher
+from result_cache import ResultCache
+from spotify_client import SpotifyClient
 
-def authorize(tokens):
-    sp = []
-    username = []
-    print(tokens)
-    for token in tokens:
-        sp_obj = spotipy.Spotify(auth=token)
-        sp.append(sp_obj)
-        username.append(sp_obj.current_user()["id"])
-        print(username)
-    return sp, username
+# The user ID of a token is looked up at most once per USER_ID_TTL seconds
+USER_ID_CACHE_SIZE = 1024
+USER_ID_TTL = 60  # seconds
+MAX_CONCURRENT_LOOKUPS = 16
+
+user_id_cache = ResultCache(USER_ID_CACHE_SIZE, USER_ID_TTL)
+
+
+def authorize(tokens, trace=None):
+    """Creates a client for each token and looks up the user IDs.
+
+    The clients share one pooled HTTP session. The user IDs of all tokens
+    are looked up concurrently, or taken from user_id_cache if the same
+    token was used within the last USER_ID_TTL seconds.
+
+    Args:
+        tokens (list(str)): The access tokens of the group members.
+        trace (instrumentation.Trace): Optionally records the API calls and
+            the hits of user_id_cache.
 
+    Returns:
+        A tuple (list of spotify_client.SpotifyClient, list of user IDs
+        (str)), both in the order of tokens.
+
+    """
+
+    sp = [SpotifyClient.from_token(token, trace=trace) for token in tokens]
+
+    def lookup(i):
+        # Only a hash of the token is kept in memory
+        key = hashlib.sha256(tokens[i].encode()).hexdigest()
+        computed = []
+
+        def compute():
+            computed.append(True)
+            return sp[i].current_user()["id"]
+
+        user_id = user_id_cache.get_or_compute(key, compute)
+        if trace is not None:
+            trace.record_cache('user_ids', hits=int(not computed),
+                               misses=int(bool(computed)))
+        return user_id
+
+    username = ConcurrentFetcher(MAX_CONCURRENT_LOOKUPS).map(
+        lookup, range(len(tokens)))
+    print(username)
+    return sp, username
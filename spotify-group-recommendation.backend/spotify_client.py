@@ -0,0 +1,387 @@
+__author__ = 'Numan Tok'
+
+
+import random
+import threading
+import time
+
+import requests
+import spotipy
+import spotipy.exceptions
+
+
+# Spotify does not publish its limit, it is enforced on a rolling window
+DEFAULT_REQUESTS_PER_SECOND = 25
+DEFAULT_BURST_SIZE = 50
+# Server errors are retried by SpotifyClient, not by spotipy
+SERVER_ERRORS = (500, 502, 503, 504)
+# How long a client is rate limited after a 429 without a Retry-After header
+DEFAULT_RATE_LIMIT_SECONDS = 5
+# Kept-alive connections to the API per host, shared by all clients
+CONNECTION_POOL_SIZE = 32
+
+_session = None
+_session_lock = threading.Lock()
+# The bytes of the responses of the call running on each thread
+_received = threading.local()
+
+
+class _SharedSession(requests.Session):
+    """A session that stays open when a client that uses it is deleted.
+
+    spotipy closes the session of a client when the client is garbage
+    collected, which would drop the kept-alive connections of all clients.
+
+    """
+
+    def close(self):
+        pass
+
+
+def shared_session():
+    """Returns the HTTP session that all clients of the process share.
+
+    The session keeps up to CONNECTION_POOL_SIZE connections to the API 
+    alive, so clients of later requests reuse them instead of opening new 
+    ones with a new TLS handshake. It only holds connections, the access 
+    token is sent by each client with every request.
+
+    Returns:
+        A requests.Session.
+
+    """
+
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = _SharedSession()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=CONNECTION_POOL_SIZE,
+                pool_maxsize=CONNECTION_POOL_SIZE, max_retries=0)
+            session.mount('https://', adapter)
+            session.hooks['response'].append(_count_bytes)
+            _session = session
+        return _session
+
+
+def _count_bytes(response, *args, **kwargs):
+    _received.bytes = getattr(_received, 'bytes', 0) + len(response.content)
+
+
+class TokenBucket:
+    """A thread-safe token bucket rate limiter.
+
+    Every request takes one token. Tokens are refilled at a constant rate up
+    to the bucket capacity, which allows short bursts. The bucket only caps
+    the overall request rate of the process, a Retry-After of the API is
+    respected by the client that received it.
+
+    Attributes:
+        rate (float): The number of tokens refilled per second.
+        capacity (float): The maximal number of tokens.
+
+    """
+
+    def __init__(self, rate=DEFAULT_REQUESTS_PER_SECOND,
+                 capacity=DEFAULT_BURST_SIZE) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available and takes it."""
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+# Shared by all clients of the process
+default_rate_limiter = TokenBucket()
+
+
+class SpotifyClient:
+    """Wraps a spotipy client with rate limiting and retries.
+
+    Every method of the wrapped client can be called on the wrapper. Each
+    call first takes a token from rate_limiter. Calls that fail with a 429,
+    a server error or a connection error are retried up to max_retries times
+    with exponential backoff and full jitter. After a 429 the client is rate 
+    limited for the Retry-After of the response, and no call of the client 
+    is sent before it has passed. This only delays the calls of this client. 
+    Other errors are raised right away.
+
+    If a trace is given, every attempt is recorded in it with its endpoint,
+    latency, outcome and, for real spotipy clients, the received bytes.
+
+    Attributes:
+        client (spotipy.client.Spotify): The wrapped client.
+        rate_limiter (TokenBucket): The rate limiter, shared by default.
+        max_retries (int): How often a failed call is retried.
+        backoff_base (float): The backoff of the first retry in seconds.
+        backoff_max (float): The maximal backoff in seconds.
+        trace (instrumentation.Trace): The trace of the request the client 
+            belongs to, or None.
+        rate_limited_until (float): The time.monotonic() until which the 
+            client is rate limited after its last 429 response.
+
+    """
+
+    def __init__(self, client, rate_limiter=None, max_retries=5,
+                 backoff_base=0.5, backoff_max=30, trace=None) -> None:
+        self.client = client
+        self.rate_limiter = rate_limiter if rate_limiter is not None \
+            else default_rate_limiter
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.trace = trace
+        self.rate_limited_until = 0
+        session = getattr(client, '_session', None)
+        if trace is not None and session is not None and \
+                _count_bytes not in session.hooks['response']:
+            session.hooks['response'].append(_count_bytes)
+
+    @classmethod
+    def from_token(cls, token, **kwargs):
+        """Creates a client for an access token.
+
+        spotipy's own retries are disabled, so that all retries go through
+        the backoff and rate limiting of the wrapper. The client uses the
+        shared_session() of the process.
+
+        """
+
+        return cls(spotipy.Spotify(auth=token,
+                                   requests_session=shared_session(),
+                                   retries=0, status_retries=0,
+                                   status_forcelist=SERVER_ERRORS),
+                   **kwargs)
+
+    def with_trace(self, trace):
+        """Returns a client for the same token that records into trace.
+
+        The new client shares the wrapped client, and so the HTTP session,
+        and the rate limiter with self.
+
+        """
+
+        return SpotifyClient(self.client, self.rate_limiter,
+                             self.max_retries, self.backoff_base,
+                             self.backoff_max, trace=trace)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            return self.call(attribute, *args, **kwargs)
+
+        return call
+
+    def call(self, function, *args, **kwargs):
+        """Calls function with rate limiting and retries.
+
+        Args:
+            function (callable): A method of self.client.
+            *args: The positional arguments for function.
+            **kwargs: The keyword arguments for function.
+
+        Returns:
+            The return value of function.
+
+        """
+
+        return self._call(function, args, kwargs)
+
+    def call_unless_rate_limited(self, name, *args, **kwargs):
+        """Calls the method name like call(), but does not wait after a 429.
+
+        The client is marked as rate limited and the SpotifyException of the
+        429 is raised right away, so that the caller can retry on another 
+        client. If the client is already rate limited, such an exception is 
+        raised without sending the call.
+
+        Args:
+            name (str): The name of a method of self.client.
+            *args: The positional arguments for the method.
+            **kwargs: The keyword arguments for the method.
+
+        Returns:
+            The return value of the method.
+
+        """
+
+        return self._call(getattr(self.client, name), args, kwargs,
+                          wait_rate_limited=False)
+
+    def _call(self, function, args, kwargs, wait_rate_limited=True):
+        for attempt in range(self.max_retries + 1):
+            if wait_rate_limited:
+                self._wait_until_not_rate_limited()
+            elif self.is_rate_limited():
+                raise spotipy.exceptions.SpotifyException(
+                    429, -1, 'The client is rate limited.')
+            self.rate_limiter.acquire()
+            try:
+                return self._traced(function, args, kwargs)
+            except spotipy.exceptions.SpotifyException as e:
+                retry_after = self._retry_after(e)
+                if e.http_status == 429:
+                    self.rate_limited_until = max(
+                        self.rate_limited_until, time.monotonic() + (
+                            retry_after if retry_after is not None
+                            else DEFAULT_RATE_LIMIT_SECONDS))
+                    if not wait_rate_limited:
+                        raise
+                if (e.http_status != 429 and e.http_status < 500) or \
+                        attempt == self.max_retries:
+                    raise
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                retry_after = None
+
+            if retry_after is not None:
+                delay = retry_after + random.uniform(0, self.backoff_base)
+            else:
+                delay = random.uniform(
+                    0, min(self.backoff_max, self.backoff_base * 2**attempt))
+            time.sleep(delay)
+
+    def is_rate_limited(self):
+        return time.monotonic() < self.rate_limited_until
+
+    def _wait_until_not_rate_limited(self):
+        # Another thread may extend the limit while this one sleeps
+        while True:
+            wait = self.rate_limited_until - time.monotonic()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def _traced(self, function, args, kwargs):
+        """Calls function once and records the call in self.trace."""
+
+        if self.trace is None:
+            return function(*args, **kwargs)
+
+        # Generic requests are named after their path, e.g. audio-features
+        endpoint = function.__name__
+        if endpoint in ('_get', '_post', '_put', '_delete') and args:
+            endpoint = args[0].split('?')[0]
+        _received.bytes = 0
+        error = True
+        start = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+            error = False
+            return result
+        finally:
+            self.trace.record_call(endpoint, time.perf_counter() - start,
+                                   _received.bytes, error)
+
+    @staticmethod
+    def _retry_after(exception):
+        """Returns the Retry-After header of exception in seconds or None."""
+
+        headers = getattr(exception, 'headers', None) or {}
+        try:
+            return float(headers['Retry-After'])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+
+class ClientScheduler:
+    """Spreads read-only API calls over the clients of a group.
+
+    Every call goes to the client with the fewest outstanding calls, so the
+    requests of a group are shared by the tokens of all members instead of
+    landing on one of them. Clients that are rate limited are left out until
+    their Retry-After has passed. A call that is answered with a 429 is
+    retried right away on another client that is not rate limited. Only if
+    all clients are rate limited, the call waits for the client whose limit
+    ends first. Ties go to the earlier client, so a group of one uses its
+    only client.
+
+    Only calls whose result does not depend on the user, like audio features,
+    featured playlists and pages of public playlists, may be scheduled. The
+    methods of SpotifyClient can be called on the scheduler directly.
+
+    Attributes:
+        clients (list(SpotifyClient)): The clients of the group.
+
+    """
+
+    def __init__(self, clients) -> None:
+        self.clients = list(clients)
+        self._outstanding = [0] * len(self.clients)
+        self._calls = [0] * len(self.clients)
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            return self.call(name, *args, **kwargs)
+
+        return call
+
+    def call(self, name, *args, **kwargs):
+        """Calls the method name of the least busy client.
+
+        Args:
+            name (str): The name of a method of SpotifyClient.
+            *args: The positional arguments for the method.
+            **kwargs: The keyword arguments for the method.
+
+        Returns:
+            The return value of the method.
+
+        """
+
+        tried = set()
+        while True:
+            with self._lock:
+                candidates = [i for i, client in enumerate(self.clients)
+                              if i not in tried and
+                              not client.is_rate_limited()]
+                last_resort = not candidates
+                if last_resort:
+                    candidates = [min(range(len(self.clients)),
+                                      key=lambda i:
+                                      self.clients[i].rate_limited_until)]
+                i = min(candidates, key=lambda i: self._outstanding[i])
+                self._outstanding[i] += 1
+                self._calls[i] += 1
+            try:
+                if last_resort:
+                    # Waits until the rate limit of the client has passed
+                    return getattr(self.clients[i], name)(*args, **kwargs)
+                return self.clients[i].call_unless_rate_limited(
+                    name, *args, **kwargs)
+            except spotipy.exceptions.SpotifyException as e:
+                if last_resort or e.http_status != 429:
+                    raise
+                tried.add(i)
+            finally:
+                with self._lock:
+                    self._outstanding[i] -= 1
+
+    def stats(self):
+        """Returns the number of scheduled calls of each client as a list."""
+
+        with self._lock:
+            return list(self._calls)
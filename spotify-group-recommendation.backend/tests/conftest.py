@@ -0,0 +1,9 @@
+__author__ = 'Numan Tok'
+
+
+import os
+import sys
+
+
+# The modules of the backend are imported by their names, like main.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
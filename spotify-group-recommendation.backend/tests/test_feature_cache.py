@@ -0,0 +1,54 @@
+__author__ = 'Numan Tok'
+
+
+import time
+
+from feature_cache import AudioFeatureCache
+
+
+FEATURES = {'danceability': 0.5, 'energy': 0.7}
+
+
+def test_features_are_read_from_memory_and_disk(tmp_path):
+    path = str(tmp_path / 'features.sqlite')
+    cache = AudioFeatureCache(path)
+    cache.put_many({'a': FEATURES})
+
+    assert cache.get_many(['a', 'b']) == {'a': FEATURES}
+    assert AudioFeatureCache(path).get_many(['a']) == {'a': FEATURES}
+    assert cache.stats() == {'memory_hits': 1, 'disk_hits': 0, 'misses': 1}
+
+
+def test_least_recently_used_tracks_leave_memory():
+    cache = AudioFeatureCache(':memory:', lru_size=1)
+    cache.put_many({'a': FEATURES, 'b': FEATURES})
+
+    assert cache.get_many(['a', 'b']) == {'a': FEATURES, 'b': FEATURES}
+    assert cache.stats()['disk_hits'] == 1
+
+
+def test_negative_entries_are_hits_until_they_expire(tmp_path):
+    path = str(tmp_path / 'features.sqlite')
+    cache = AudioFeatureCache(path, missing_ttl=0.2)
+    cache.put_many({'missing': None})
+
+    assert cache.get_many(['missing']) == {'missing': None}
+    assert AudioFeatureCache(path, missing_ttl=0.2).get_many(
+        ['missing']) == {'missing': None}
+    assert cache.stats()['misses'] == 0
+
+    time.sleep(0.25)
+    assert cache.get_many(['missing']) == {}
+    assert AudioFeatureCache(path).get_many(['missing']) == {}
+    assert cache.stats()['misses'] == 1
+
+
+def test_features_replace_a_negative_entry(tmp_path):
+    path = str(tmp_path / 'features.sqlite')
+    cache = AudioFeatureCache(path)
+    cache.put_many({'track': None})
+    cache.put_many({'track': FEATURES})
+
+    assert cache.get_many(['track']) == {'track': FEATURES}
+    assert AudioFeatureCache(path).get_many(['track']) == \
+        {'track': FEATURES}
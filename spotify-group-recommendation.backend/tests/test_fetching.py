@@ -0,0 +1,55 @@
+__author__ = 'Numan Tok'
+
+
+import threading
+import time
+
+from fetching import ConcurrentFetcher
+
+
+class InFlight:
+    """Counts the calls that run at the same time."""
+
+    def __init__(self) -> None:
+        self.current = 0
+        self.maximum = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, item):
+        with self._lock:
+            self.current += 1
+            self.maximum = max(self.maximum, self.current)
+        time.sleep(0.005)
+        with self._lock:
+            self.current -= 1
+        return item
+
+
+def test_results_keep_the_order_of_the_items():
+    fetcher = ConcurrentFetcher(4)
+    in_flight = InFlight()
+
+    assert fetcher.map(in_flight, range(20)) == list(range(20))
+    assert list(fetcher.imap(in_flight, range(20))) == list(range(20))
+    assert in_flight.maximum <= 4
+
+
+def test_nested_streams_share_the_limit():
+    fetcher = ConcurrentFetcher(4)
+    in_flight = InFlight()
+    pages = fetcher.imap(in_flight, range(40))
+    batches = fetcher.imap(in_flight, pages)
+
+    assert list(batches) == list(range(40))
+    assert in_flight.maximum <= 4
+
+
+def test_remaining_pages_are_fetched_in_order():
+    fetcher = ConcurrentFetcher(3)
+    first_pages = [{'offset': 0, 'limit': 10, 'total': 35, 'next': 'x'},
+                   {'offset': 0, 'limit': 10, 'total': 10, 'next': None},
+                   {'offset': 0, 'limit': 10, 'total': 20, 'next': 'x'}]
+
+    assert list(fetcher.iter_remaining_pages(
+        first_pages, lambda i, offset: offset)) == \
+        [(0, 10), (0, 20), (0, 30), (2, 10)]
@@ -0,0 +1,175 @@
+__author__ = 'Numan Tok'
+
+
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import random_tracks, random_users_playlists
+from graph import GraphModel, find_group_playlists
+from neighbors import NEIGHBOR_BACKENDS, BruteForceIndex, build_neighbor_index
+from track_matrix import TrackMatrix
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+@pytest.fixture
+def universe(rng):
+    return TrackMatrix.from_dataframe(random_tracks(rng, 2000))
+
+
+@pytest.fixture
+def users_playlists(rng):
+    return random_users_playlists(rng, 3, 5, 20)
+
+
+def reference_lockstep(model, tracks_per_path):
+    """Advances all paths one track per round with plain distance scans."""
+
+    reference = BruteForceIndex(model.track_matrix.features,
+                                model.feature_weights)
+    available = ~np.isin(model.track_matrix.ids,
+                         model.start_points['id'].values)
+    current_points = np.array(model.start_points.iloc[:, 1:], dtype='float64')
+    paths = [[] for _ in tracks_per_path]
+    for step in range(max(tracks_per_path) - 1):
+        for i, path_length in enumerate(tracks_per_path):
+            if step < path_length - 1:
+                nearest = reference.nearest(current_points[i], available)
+                paths[i].append(nearest)
+                available[nearest] = False
+                current_points[i] = model.track_matrix.features[nearest]
+    return paths
+
+
+@pytest.mark.parametrize('backend', list(NEIGHBOR_BACKENDS))
+def test_backends_match_brute_force(rng, backend):
+    features = rng.random((3000, 13))
+    # Duplicates of the first rows are tied with them
+    features[-100:] = features[:100]
+    weights = rng.random(13) * 10
+    available = rng.random(len(features)) < 0.7
+    reference = build_neighbor_index('brute', features, weights)
+    index = build_neighbor_index(backend, features, weights)
+
+    for _ in range(200):
+        # Queries on existing rows are tied with their duplicates and find 
+        # used tracks at distance 0
+        if rng.random() < 0.5:
+            point = features[rng.integers(len(features))].copy()
+        else:
+            point = rng.random(13)
+        assert index.nearest(point, available) == \
+            reference.nearest(point, available)
+
+
+@pytest.mark.parametrize('backend', list(NEIGHBOR_BACKENDS))
+def test_nearest_ignores_used_tracks(backend):
+    features = np.zeros((5, 2))
+    available = np.array([False, False, True, True, False])
+    index = build_neighbor_index(backend, features, np.ones(2))
+
+    assert index.nearest(np.zeros(2), available) == 2
+    with pytest.raises(ValueError):
+        index.nearest(np.zeros(2), np.zeros(5, dtype=bool))
+
+
+def test_nearest_with_infinite_distances():
+    index = BruteForceIndex(np.zeros((4, 2)), np.array([np.inf, 1.0]))
+    available = np.array([False, True, True, False])
+
+    assert index.nearest(np.ones(2), available) == 1
+
+
+@pytest.mark.parametrize('backend', list(NEIGHBOR_BACKENDS))
+def test_group_playlist_matches_brute_force(rng, universe, users_playlists,
+                                            backend):
+    start_points = random_tracks(rng, 4)
+    playlists = [GraphModel(users_playlists, universe, 40, start_points,
+                            neighbor_backend=name).find_group_playlist()
+                 for name in ('brute', backend)]
+
+    assert playlists[0] == playlists[1]
+
+
+def test_parallel_matches_sequential(rng, universe, users_playlists):
+    start_points = random_tracks(rng, 9)
+    model = GraphModel(users_playlists, universe, 100, start_points)
+
+    assert model.find_group_playlist(parallel=True, max_workers=4) == \
+        model.find_group_playlist()
+
+
+def test_lockstep_matches_reference(rng, universe, users_playlists):
+    start_points = random_tracks(rng, 6)
+    model = GraphModel(users_playlists, universe, 50, start_points,
+                       neighbor_backend='brute')
+    playlist = model.find_group_playlist(lockstep=True)
+
+    expected = []
+    for i, path in enumerate(reference_lockstep(model, [9, 9, 8, 8, 8, 8])):
+        expected.append(start_points['id'].values[i])
+        expected.extend(universe.ids[path].tolist())
+    assert playlist == expected
+
+
+@pytest.mark.parametrize('mode', [{}, {'parallel': True}, {'lockstep': True}])
+def test_start_points_are_not_repeated(universe, users_playlists, mode):
+    start_points = universe.to_dataframe().iloc[[3, 500, 1999]]
+    model = GraphModel(users_playlists, universe, 60,
+                       start_points.reset_index(drop=True))
+    playlist = model.find_group_playlist(**mode)
+
+    assert len(playlist) == 60
+    assert len(set(playlist)) == 60
+
+
+@pytest.mark.parametrize('backend', list(NEIGHBOR_BACKENDS))
+def test_empty_library_gets_uniform_weights(rng, universe, backend):
+    model = GraphModel([[]], universe, 10, random_tracks(rng, 2),
+                       neighbor_backend=backend)
+
+    assert np.all(model.feature_weights == model.feature_weights[0])
+    assert len(set(model.find_group_playlist())) == 10
+
+
+@pytest.mark.parametrize('backend', list(NEIGHBOR_BACKENDS))
+def test_constant_feature_gets_finite_weight(rng, universe, backend):
+    playlist = random_tracks(rng, 20)
+    playlist[4] = 0.5
+    model = GraphModel([[playlist]], universe, 10, random_tracks(rng, 2),
+                       neighbor_backend=backend)
+
+    assert np.all(np.isfinite(model.feature_weights))
+    assert model.feature_weights.argmax() == 4
+    assert len(set(model.find_group_playlist())) == 10
+
+
+@pytest.mark.parametrize('backend', list(NEIGHBOR_BACKENDS))
+def test_reweighted_index_matches_new_index(rng, backend):
+    features = rng.random((2000, 13))
+    index = build_neighbor_index(backend, features, rng.random(13))
+    weights = rng.random(13) * 10
+    reweighted = index.with_weights(weights)
+    reference = build_neighbor_index(backend, features, weights)
+    available = rng.random(len(features)) < 0.7
+
+    for point in rng.random((50, 13)):
+        assert reweighted.nearest(point, available) == \
+            reference.nearest(point, available)
+
+
+@pytest.mark.parametrize('backend', list(NEIGHBOR_BACKENDS))
+def test_batch_matches_single_groups(rng, universe, backend):
+    groups = [(random_users_playlists(rng, 2, 3, 20), random_tracks(rng, 3))
+              for _ in range(3)]
+    playlists = find_group_playlists(groups, universe, 30,
+                                     neighbor_backend=backend)
+
+    assert playlists == [
+        GraphModel(users_playlists, universe, 30, start_points,
+                   neighbor_backend=backend).find_group_playlist()
+        for users_playlists, start_points in groups]
+    assert find_group_playlists([], universe, 30) == []
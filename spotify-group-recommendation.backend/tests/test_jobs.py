@@ -0,0 +1,82 @@
+__author__ = 'Numan Tok'
+
+
+import threading
+
+import pytest
+
+from jobs import DONE, FAILED, RUNNING, STAGES, JobQueue, QueueFullError
+
+
+@pytest.fixture
+def queue():
+    queue = JobQueue(max_workers=1, max_queued=2)
+    yield queue
+    queue.shutdown()
+
+
+def blocking_job(release):
+    def run(progress, trace):
+        release.wait(10)
+        return 'done'
+
+    return run
+
+
+def test_full_queue_rejects_jobs(queue):
+    release = threading.Event()
+    running = queue.submit(blocking_job(release))
+    assert running.wait_for_change(0, timeout=10)
+    queued = [queue.submit(blocking_job(release)) for _ in range(2)]
+
+    with pytest.raises(QueueFullError):
+        queue.submit(blocking_job(release))
+    assert queue.stats()['queued'] == 2
+
+    release.set()
+    for job in [running] + queued:
+        while not job.finished:
+            job.wait_for_change(job.revision, timeout=10)
+        assert job.status == DONE
+        assert job.result == 'done'
+
+
+def test_stages_are_reported_in_order(queue):
+    entered = threading.Event()
+    release = threading.Event()
+
+    def run(progress, trace):
+        for stage in STAGES[:2]:
+            progress(stage)
+        entered.set()
+        release.wait(10)
+        return 'playlist'
+
+    job = queue.submit(run)
+    assert entered.wait(10)
+    state = job.to_dict()
+    assert state['status'] == RUNNING
+    assert state['stage'] == STAGES[1]
+    assert state['progress'] == 1 / len(STAGES)
+
+    release.set()
+    while not job.finished:
+        job.wait_for_change(job.revision, timeout=10)
+    state = job.to_dict()
+    assert state['status'] == DONE
+    assert state['progress'] == 1.0
+    assert state['result'] == 'playlist'
+
+
+def test_errors_fail_the_job(queue, capsys):
+    def run(progress, trace):
+        raise RuntimeError('no tracks')
+
+    job = queue.submit(run)
+    while not job.finished:
+        job.wait_for_change(job.revision, timeout=10)
+
+    assert job.status == FAILED
+    assert job.error == 'RuntimeError: no tracks'
+    assert queue.get(job.id) is job
+    assert queue.get('unknown') is None
@@ -0,0 +1,52 @@
+__author__ = 'Numan Tok'
+
+
+from collections import Counter
+
+from benchmarks.fake_spotify import FakeCatalog, FakeSpotify
+from prepare_data import DataPreparation
+from spotify_client import SpotifyClient
+from universe_store import AUDIO_FEATURES, UniverseStore
+
+
+def data_preparation(catalog, store):
+    users = [SpotifyClient(FakeSpotify(catalog, user_id))
+             for user_id in catalog.users]
+    return DataPreparation(AUDIO_FEATURES, users, universe_store=store)
+
+
+def api_calls(data):
+    return sum((user.client.calls for user in data.users), Counter())
+
+
+def test_refresh_drops_tracks_of_rotated_playlists(tmp_path):
+    catalog = FakeCatalog.synthetic(1000, 2)
+    store = UniverseStore(str(tmp_path))
+    data = data_preparation(catalog, store)
+    # The playlists of the snapshot are read from disk
+    snapshot = UniverseStore(str(tmp_path)).load('DE')
+    assert set(snapshot.tracks.ids) == set(catalog.track_ids[:1000])
+
+    # Replace half of the featured playlists with a new one
+    featured = catalog.featured['DE']
+    old_tracks = set().union(*(catalog.playlists[playlist_id]['tracks']
+                               for playlist_id in featured))
+    new_tracks = [track_id for track_id in catalog.track_ids
+                  if track_id not in old_tracks][:30]
+    catalog.playlists['new'] = {'snapshot_id': '1', 'owner': 'spotify',
+                                'tracks': new_tracks}
+    kept = featured[:len(featured) // 2]
+    catalog.featured['DE'] = kept + ['new']
+    calls = api_calls(data)
+
+    refreshed = data.refresh_track_universe(snapshot)
+
+    expected = set(new_tracks).union(*(catalog.playlists[playlist_id]
+                                       ['tracks'] for playlist_id in kept))
+    assert set(refreshed.tracks.ids) == expected
+    assert len(refreshed.tracks.ids) == len(expected)
+    assert set(refreshed.playlists) == set(kept) | {'new'}
+    # Only the new playlist and its tracks were retrieved
+    calls = api_calls(data) - calls
+    assert calls['playlist_tracks'] == 1
+    assert calls['audio_features'] == 1
@@ -0,0 +1,115 @@
+__author__ = 'Numan Tok'
+
+
+import threading
+import time
+
+from result_cache import ResultCache
+
+
+def test_result_is_cached():
+    cache = ResultCache()
+    calls = []
+
+    for _ in range(3):
+        assert cache.get_or_compute('key', lambda: calls.append(1) or 42) \
+            == 42
+
+    assert len(calls) == 1
+    assert cache.stats() == {'hits': 2, 'coalesced': 0, 'misses': 1}
+
+
+def test_concurrent_requests_are_coalesced():
+    cache = ResultCache()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(10)
+        return 'result'
+
+    results = []
+    owner = threading.Thread(
+        target=lambda: results.append(cache.get_or_compute('key', compute)))
+    owner.start()
+    assert started.wait(10)
+    waiters = [threading.Thread(
+        target=lambda: results.append(cache.get_or_compute('key', compute)))
+        for _ in range(4)]
+    for waiter in waiters:
+        waiter.start()
+    # Wait until all waiters are blocked on the computation in flight
+    while cache.stats()['coalesced'] < 4:
+        time.sleep(0.001)
+    release.set()
+    for thread in [owner] + waiters:
+        thread.join()
+
+    assert results == ['result'] * 5
+    assert len(calls) == 1
+    assert cache.stats() == {'hits': 0, 'coalesced': 4, 'misses': 1}
+
+
+def test_results_expire_after_ttl():
+    cache = ResultCache(ttl=0.05)
+    cache.get_or_compute('key', lambda: 1)
+    time.sleep(0.06)
+
+    assert cache.get_or_compute('key', lambda: 2) == 2
+    assert cache.stats()['misses'] == 2
+
+
+def test_least_recently_used_result_is_evicted():
+    cache = ResultCache(max_size=2)
+    cache.get_or_compute('a', lambda: 'a')
+    cache.get_or_compute('b', lambda: 'b')
+    # Makes 'b' the least recently used result
+    cache.get_or_compute('a', lambda: 'not cached')
+    cache.get_or_compute('c', lambda: 'c')
+
+    assert cache.get_or_compute('a', lambda: 'a again') == 'a'
+    assert cache.get_or_compute('b', lambda: 'b again') == 'b again'
+
+
+def test_errors_are_passed_on_but_not_cached():
+    cache = ResultCache()
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(10)
+        raise RuntimeError('failed')
+
+    errors = []
+
+    def request():
+        try:
+            cache.get_or_compute('key', fail)
+        except RuntimeError as e:
+            errors.append(e)
+
+    owner = threading.Thread(target=request)
+    owner.start()
+    assert started.wait(10)
+    waiter = threading.Thread(target=request)
+    waiter.start()
+    while cache.stats()['coalesced'] < 1:
+        time.sleep(0.001)
+    release.set()
+    owner.join()
+    waiter.join()
+
+    assert len(errors) == 2
+    assert cache.get_or_compute('key', lambda: 'ok') == 'ok'
+
+
+def test_invalidate_removes_the_result():
+    cache = ResultCache()
+    cache.get_or_compute('key', lambda: 1)
+    cache.invalidate('key')
+
+    assert cache.get_or_compute('key', lambda: 2) == 2
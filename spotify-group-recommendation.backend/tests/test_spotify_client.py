@@ -0,0 +1,164 @@
+__author__ = 'Numan Tok'
+
+
+import threading
+import time
+
+import pytest
+import spotipy.exceptions
+
+import spotify_client
+from spotify_client import ClientScheduler, SpotifyClient, TokenBucket
+
+
+RETRY_AFTER = 0.3
+
+
+class RateLimitedSpotify:
+    """Answers the first num_limited calls with a 429 and a Retry-After."""
+
+    def __init__(self, num_limited=1, retry_after=RETRY_AFTER) -> None:
+        self.num_limited = num_limited
+        self.retry_after = retry_after
+        self.sent_at = []
+        self._lock = threading.Lock()
+
+    def current_user(self):
+        with self._lock:
+            self.sent_at.append(time.monotonic())
+            limited = len(self.sent_at) <= self.num_limited
+        if limited:
+            raise spotipy.exceptions.SpotifyException(
+                429, -1, 'API rate limit exceeded',
+                headers={'Retry-After': str(self.retry_after)})
+        return {'id': 'user'}
+
+
+class FailingSpotify:
+    """Fails every call with the given HTTP status."""
+
+    def __init__(self, http_status, num_failures) -> None:
+        self.http_status = http_status
+        self.num_failures = num_failures
+        self.calls = 0
+
+    def current_user(self):
+        self.calls += 1
+        if self.calls <= self.num_failures:
+            raise spotipy.exceptions.SpotifyException(
+                self.http_status, -1, 'failed')
+        return {'id': 'user'}
+
+
+def client_for(spotify, **kwargs):
+    return SpotifyClient(spotify, rate_limiter=TokenBucket(1000, 1000),
+                         backoff_base=0.01, **kwargs)
+
+
+def test_retry_waits_for_retry_after():
+    spotify = RateLimitedSpotify()
+    client = client_for(spotify)
+
+    assert client.current_user() == {'id': 'user'}
+    assert spotify.sent_at[1] - spotify.sent_at[0] >= RETRY_AFTER
+
+
+def test_no_calls_are_sent_while_rate_limited():
+    spotify = RateLimitedSpotify()
+    client = client_for(spotify, max_retries=0)
+    with pytest.raises(spotipy.exceptions.SpotifyException):
+        client.current_user()
+    assert client.is_rate_limited()
+
+    threads = [threading.Thread(target=client.current_user)
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(spotify.sent_at) == 6
+    assert min(spotify.sent_at[1:]) - spotify.sent_at[0] >= RETRY_AFTER
+
+
+def test_call_unless_rate_limited_raises_without_sending():
+    spotify = RateLimitedSpotify()
+    client = client_for(spotify)
+    for _ in range(2):
+        with pytest.raises(spotipy.exceptions.SpotifyException) as info:
+            client.call_unless_rate_limited('current_user')
+        assert info.value.http_status == 429
+
+    assert len(spotify.sent_at) == 1
+
+
+def test_scheduler_moves_rate_limited_calls_to_other_clients():
+    limited = RateLimitedSpotify(num_limited=100, retry_after=10)
+    healthy = RateLimitedSpotify(num_limited=0)
+    scheduler = ClientScheduler([client_for(limited), client_for(healthy)])
+
+    start = time.monotonic()
+    for _ in range(5):
+        assert scheduler.current_user() == {'id': 'user'}
+
+    assert time.monotonic() - start < 1
+    assert len(limited.sent_at) == 1
+    assert len(healthy.sent_at) == 5
+
+
+def test_scheduler_waits_if_all_clients_are_rate_limited():
+    spotifies = [RateLimitedSpotify(), RateLimitedSpotify()]
+    scheduler = ClientScheduler([client_for(spotify)
+                                 for spotify in spotifies])
+
+    assert scheduler.current_user() == {'id': 'user'}
+    first_sent = min(spotify.sent_at[0] for spotify in spotifies)
+    retries = [sent_at for spotify in spotifies
+               for sent_at in spotify.sent_at[1:]]
+    assert len(retries) == 1
+    assert retries[0] - first_sent >= RETRY_AFTER
+
+
+def test_token_bucket_allows_bursts_then_the_rate():
+    bucket = TokenBucket(rate=50, capacity=5)
+    start = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    assert time.monotonic() - start < 0.05
+
+    for _ in range(5):
+        bucket.acquire()
+    assert time.monotonic() - start >= 4 / 50
+
+
+def test_server_errors_are_retried():
+    spotify = FailingSpotify(503, 2)
+
+    assert client_for(spotify).current_user() == {'id': 'user'}
+    assert spotify.calls == 3
+
+
+def test_client_errors_are_not_retried():
+    spotify = FailingSpotify(404, 1)
+
+    with pytest.raises(spotipy.exceptions.SpotifyException):
+        client_for(spotify).current_user()
+    assert spotify.calls == 1
+
+
+def test_retries_are_limited():
+    spotify = FailingSpotify(503, 10)
+
+    with pytest.raises(spotipy.exceptions.SpotifyException):
+        client_for(spotify, max_retries=2).current_user()
+    assert spotify.calls == 3
+
+
+def test_rate_limit_without_retry_after_uses_default(monkeypatch):
+    monkeypatch.setattr(spotify_client, 'DEFAULT_RATE_LIMIT_SECONDS', 0.2)
+    spotify = FailingSpotify(429, 1)
+    client = client_for(spotify)
+    start = time.monotonic()
+
+    assert client.current_user() == {'id': 'user'}
+    assert time.monotonic() - start >= 0.2
@@ -0,0 +1,74 @@
+__author__ = 'Numan Tok'
+
+
+import threading
+
+import numpy as np
+
+import universe_store
+from track_matrix import TrackMatrix
+from universe_store import AUDIO_FEATURES, UniverseSnapshot, UniverseStore
+
+
+def snapshot_of(market, num_tracks, seed=0):
+    rng = np.random.default_rng(seed)
+    ids = np.array(['track_%d' % i for i in range(num_tracks)])
+    tracks = TrackMatrix(ids, rng.random((num_tracks, len(AUDIO_FEATURES))),
+                         AUDIO_FEATURES)
+    return UniverseSnapshot(market, playlists={'playlist': 'a'},
+                            tracks=tracks)
+
+
+def test_save_and_load(tmp_path):
+    store = UniverseStore(str(tmp_path))
+    store.save(snapshot_of('DE', 50))
+
+    snapshot = UniverseStore(str(tmp_path)).load('DE')
+    assert snapshot.version == 1
+    assert snapshot.playlists == {'playlist': 'a'}
+    assert len(snapshot.tracks.ids) == 50
+    assert snapshot.normalized_tracks.features.max() <= 1
+
+
+def test_loading_is_not_blocked_by_a_save(tmp_path, monkeypatch):
+    store = UniverseStore(str(tmp_path), neighbor_graph_k=4)
+    store.save(snapshot_of('DE', 50))
+
+    building = threading.Event()
+    release = threading.Event()
+    build = universe_store.NeighborGraph.build
+
+    def slow_build(*args, **kwargs):
+        building.set()
+        release.wait(10)
+        return build(*args, **kwargs)
+
+    monkeypatch.setattr(universe_store.NeighborGraph, 'build', slow_build)
+    thread = threading.Thread(target=store.save,
+                              args=(snapshot_of('DE', 80, seed=1),))
+    thread.start()
+    try:
+        assert building.wait(10)
+        # A lock held during the build would block the load until release
+        loaded = []
+        loader = threading.Thread(
+            target=lambda: loaded.append(store.load('DE')))
+        loader.start()
+        loader.join(2)
+        assert loaded and loaded[0].version == 1
+    finally:
+        release.set()
+        thread.join()
+
+    snapshot = store.load('DE')
+    assert snapshot.version == 2
+    assert len(snapshot.neighbor_graph) == 80
+
+
+def test_old_versions_are_removed(tmp_path):
+    store = UniverseStore(str(tmp_path), keep_versions=2)
+    for seed in range(4):
+        store.save(snapshot_of('DE', 20, seed))
+
+    assert sorted(path.name for path in (tmp_path / 'DE').iterdir()
+                  if path.is_dir()) == ['v3', 'v4']
@@ -0,0 +1,531 @@
+__author__ = 'Numan Tok'
+
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def consecutive_distance_sums(features, offsets):
+    """Sums up the feature distances of consecutive tracks per playlist.
+
+    Args:
+        features (numpy.ndarray): The features of the tracks of all
+            playlists, stacked row by row.
+        offsets (numpy.ndarray(int64)): Playlist i consists of the rows
+            offsets[i] to offsets[i+1]-1.
+
+    Returns:
+        A numpy ndarray of shape (number of playlists, number of features)
+        including the sums of the absolute differences between each pair of
+        consecutive tracks of each playlist.
+
+    """
+
+    offsets = np.asarray(offsets, dtype='int64')
+    sums = np.zeros((len(offsets) - 1, features.shape[1]))
+    if len(features) < 2:
+        return sums
+
+    # Calculate the distances between all consecutive tracks at once and
+    # drop the pairs that cross the boundary between 2 playlists
+    distances = np.absolute(np.diff(features, axis=0))
+    boundaries = offsets[1:-1] - 1
+    distances[boundaries[(boundaries >= 0) &
+                         (boundaries < len(distances))]] = 0
+
+    # Pair j is between track j and j+1, so playlist i has the pairs
+    # offsets[i] to offsets[i+1]-2
+    starts = offsets[:-1]
+    has_pairs = offsets[1:] - starts > 1
+    if has_pairs.any():
+        sums[has_pairs] = np.add.reduceat(distances, starts[has_pairs],
+                                          axis=0)
+
+    return sums
+
+
+class TrackMatrix:
+    """An immutable set of tracks with their audio features.
+
+    The features are kept in one C-contiguous, read-only matrix, so the
+    graph model can use them without copying and without the risk of
+    modifying them by accident.
+
+    A TrackMatrix can be saved to a directory with one .npy file for the IDs,
+    one for the features and a meta.json. Loading memory-maps the files, so
+    several worker processes that load the same directory share one copy of
+    the tracks in memory.
+
+    Attributes:
+        ids (numpy.ndarray(str)): The track IDs, one per row of features.
+        features (numpy.ndarray(float64 or float32)): A read-only matrix of
+            shape (number of tracks, number of features).
+        columns (list(str)): The names of the feature columns.
+        feature_min (numpy.ndarray(float64)): For normalized features the
+            minimum of each feature before normalization, otherwise None.
+        feature_max (numpy.ndarray(float64)): For normalized features the
+            maximum of each feature before normalization, otherwise None.
+
+    """
+
+    def __init__(self, ids, features, columns=None, dtype=None,
+                 feature_min=None, feature_max=None) -> None:
+        features = np.asarray(features)
+        if dtype is None:
+            dtype = features.dtype if features.dtype in \
+                (np.float32, np.float64) else np.float64
+        # Only copy if the data type or memory layout does not fit, and use a
+        # view so the flags of the caller's array stay untouched
+        features = np.require(features, dtype=dtype, requirements='C').view()
+        if features.ndim != 2 or len(features) != len(ids):
+            raise ValueError('Expected one row of features per track ID.')
+        features.flags.writeable = False
+
+        self.ids = np.asarray(ids)
+        self.features = features
+        self.columns = list(columns) if columns is not None else \
+            list(range(features.shape[1]))
+        self.feature_min = None if feature_min is None else \
+            np.asarray(feature_min, dtype='float64')
+        self.feature_max = None if feature_max is None else \
+            np.asarray(feature_max, dtype='float64')
+
+    @classmethod
+    def from_dataframe(cls, tracks, dtype='float64'):
+        """Creates a TrackMatrix from a DataFrame.
+
+        Args:
+            tracks (pandas.core.frame.DataFrame(float64)): Tracks with 'id'
+                and the audio features as columns.
+            dtype (str): The data type of the feature matrix, 'float64' or
+                'float32'.
+
+        Returns:
+            A TrackMatrix.
+
+        """
+
+        features = tracks.drop(columns=['id'])
+        return cls(tracks['id'].to_numpy(), features.to_numpy(dtype=dtype),
+                   columns=features.columns, dtype=dtype)
+
+    @classmethod
+    def concatenate(cls, track_matrices, drop_duplicates=True):
+        """Stacks several TrackMatrix objects with the same columns.
+
+        Args:
+            track_matrices (list(TrackMatrix)): The matrices to stack.
+            drop_duplicates (bool): Whether to keep only the first row of
+                each track ID.
+
+        Returns:
+            A TrackMatrix.
+
+        """
+
+        ids = np.concatenate([tracks.ids for tracks in track_matrices])
+        features = np.concatenate(
+            [tracks.features for tracks in track_matrices], axis=0)
+        if drop_duplicates:
+            _, first_rows = np.unique(ids, return_index=True)
+            first_rows.sort()
+            ids, features = ids[first_rows], features[first_rows]
+
+        return cls(ids, features, columns=track_matrices[0].columns)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def num_features(self):
+        return self.features.shape[1]
+
+    @property
+    def is_normalized(self):
+        return self.feature_min is not None
+
+    def select(self, columns):
+        """Returns a TrackMatrix with only the given feature columns.
+
+        No data is copied if columns are all columns in the same order.
+
+        """
+
+        columns = list(columns)
+        if columns == self.columns:
+            return self
+
+        indices = [self.columns.index(column) for column in columns]
+        return TrackMatrix(
+            self.ids, self.features[:, indices], columns,
+            feature_min=None if self.feature_min is None else
+            self.feature_min[indices],
+            feature_max=None if self.feature_max is None else
+            self.feature_max[indices])
+
+    def normalize(self, feature_min=None, feature_max=None):
+        """Scales every feature to the range [0, 1] like a MinMaxScaler.
+
+        Args:
+            feature_min (numpy.ndarray(float64)): The minimum of each feature
+                to scale with, e.g. of another TrackMatrix. Defaults to the
+                minimum of self.features.
+            feature_max (numpy.ndarray(float64)): The maximum of each feature
+                to scale with. Defaults to the maximum of self.features.
+
+        Returns:
+            A new, normalized TrackMatrix that remembers the minimum and
+            maximum of each feature.
+
+        """
+
+        if feature_min is None:
+            feature_min = self.features.min(axis=0, initial=np.inf)
+        if feature_max is None:
+            feature_max = self.features.max(axis=0, initial=-np.inf)
+        feature_min = np.asarray(feature_min, dtype='float64')
+        feature_max = np.asarray(feature_max, dtype='float64')
+        feature_range = feature_max - feature_min
+        feature_range[feature_range == 0] = 1
+        features = (self.features - feature_min) / feature_range
+
+        return TrackMatrix(self.ids, features, self.columns,
+                           dtype=self.features.dtype,
+                           feature_min=feature_min, feature_max=feature_max)
+
+    def to_dataframe(self):
+        """Returns a DataFrame with 'id' and the features as columns."""
+
+        tracks = pd.DataFrame(self.features, columns=self.columns)
+        tracks.insert(0, 'id', self.ids.astype(object))
+        return tracks
+
+    def save(self, path, dtype='float32'):
+        """Saves the tracks to the directory path.
+
+        Args:
+            path (str): The directory, it is created if necessary.
+            dtype (str): The data type the features are stored with.
+
+        """
+
+        os.makedirs(path, exist_ok=True)
+        ids = self.ids.astype(str) if len(self.ids) > 0 else \
+            np.empty(0, dtype='<U1')
+        np.save(os.path.join(path, 'ids.npy'), ids)
+        np.save(os.path.join(path, 'features.npy'),
+                np.ascontiguousarray(self.features, dtype=dtype))
+        meta = {
+            'columns': self.columns,
+            'num_tracks': len(self),
+            'feature_min': None if self.feature_min is None else
+            self.feature_min.tolist(),
+            'feature_max': None if self.feature_max is None else
+            self.feature_max.tolist(),
+        }
+        with open(os.path.join(path, 'meta.json'), 'w') as file:
+            json.dump(meta, file)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Loads tracks that were saved with save().
+
+        Args:
+            path (str): The directory.
+            mmap (bool): Whether to memory-map the files instead of reading
+                them into memory.
+
+        Returns:
+            A TrackMatrix.
+
+        """
+
+        mmap_mode = 'r' if mmap else None
+        with open(os.path.join(path, 'meta.json')) as file:
+            meta = json.load(file)
+        ids = np.load(os.path.join(path, 'ids.npy'), mmap_mode=mmap_mode)
+        features = np.load(os.path.join(path, 'features.npy'),
+                           mmap_mode=mmap_mode)
+
+        return cls(ids, features, meta['columns'],
+                   feature_min=meta['feature_min'],
+                   feature_max=meta['feature_max'])
+
+
+class TrackTable:
+    """Interns the tracks of one request.
+
+    Every unique track ID is mapped to one row of features, no matter how
+    often the track shows up in playlists, the track universe or top tracks.
+    Playlists and top tracks can then refer to the rows by integer index,
+    and the audio features of a track are only retrieved once.
+
+    Attributes:
+        columns (list(str)): The names of the stored features.
+
+    """
+
+    def __init__(self, columns) -> None:
+        self.columns = list(columns)
+        self._rows = {}
+        self._features = []
+        self._ids = None
+        self._matrix = None
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, track_id):
+        return track_id in self._rows
+
+    def add(self, track_id, features):
+        """Adds a track unless it is already known.
+
+        Args:
+            track_id (str): The ID of the track.
+            features (dict): The audio features of the track, at least the
+                ones in self.columns.
+
+        Returns:
+            The row (int) of the track.
+
+        """
+
+        row = self._rows.get(track_id)
+        if row is None:
+            row = self._rows[track_id] = len(self._features)
+            self._features.append([features[column]
+                                   for column in self.columns])
+            self._matrix = None
+        return row
+
+    def rows(self, track_ids):
+        """Returns the rows (list(int)) of the known tracks of track_ids."""
+
+        return [self._rows[track_id] for track_id in track_ids
+                if track_id in self._rows]
+
+    def track_matrix(self, rows=None, columns=None, dtype='float64'):
+        """Copies tracks into a TrackMatrix.
+
+        Args:
+            rows (list(int)): The rows to copy, by default all rows.
+            columns (list(str)): The features to copy, by default all.
+            dtype (str): The data type of the feature matrix.
+
+        Returns:
+            A TrackMatrix.
+
+        """
+
+        if self._matrix is None:
+            self._matrix = np.array(self._features, dtype='float64').reshape(
+                len(self._features), len(self.columns))
+            self._ids = np.array(list(self._rows), dtype=object)
+        rows = np.arange(len(self)) if rows is None else \
+            np.asarray(rows, dtype='int64')
+        features = self._matrix[rows]
+        if columns is None:
+            columns = self.columns
+        else:
+            features = features[:, [self.columns.index(column)
+                                    for column in columns]]
+
+        return TrackMatrix(self._ids[rows], features, columns, dtype=dtype)
+
+
+class PlaylistCollection:
+    """The playlists of several users in a compact, dictionary encoded form.
+
+    Every unique track is stored once in tracks. The playlists refer to the
+    rows of tracks by integer index, are stacked into one index array and are
+    separated by offsets. Like a TrackMatrix, a PlaylistCollection can be
+    saved to a directory and memory-mapped when it is loaded.
+
+    Attributes:
+        tracks (TrackMatrix): The unique tracks of all playlists.
+        track_indices (numpy.ndarray(int32)): The rows of tracks of all
+            playlists, one after another.
+        playlist_offsets (numpy.ndarray(int64)): Playlist i consists of
+            track_indices[playlist_offsets[i]:playlist_offsets[i+1]].
+        user_offsets (numpy.ndarray(int64)): The playlists of user j are the
+            playlists user_offsets[j] to user_offsets[j+1]-1.
+        distance_sums (numpy.ndarray(float64)): Optionally, the sums of the
+            feature distances between consecutive tracks of each playlist,
+            one row per playlist (see consecutive_distance_sums()). If they
+            are given, playlists whose sums are known from an earlier sync
+            may be stored without their tracks.
+
+    """
+
+    def __init__(self, tracks, track_indices, playlist_offsets,
+                 user_offsets, distance_sums=None) -> None:
+        self.tracks = tracks
+        self.track_indices = np.asarray(track_indices, dtype='int32')
+        self.playlist_offsets = np.asarray(playlist_offsets, dtype='int64')
+        self.user_offsets = np.asarray(user_offsets, dtype='int64')
+        self.distance_sums = None if distance_sums is None else \
+            np.asarray(distance_sums, dtype='float64').reshape(
+                len(self.playlist_offsets) - 1, tracks.num_features)
+
+    @classmethod
+    def from_users_playlists(cls, users_playlists, dtype='float64'):
+        """Creates a PlaylistCollection from DataFrames.
+
+        Args:
+            users_playlists (list(list(pandas.core.frame.DataFrame(float64)))):
+                A list of playlists for each user with 'id' and the audio
+                features as columns.
+            dtype (str): The data type of the feature matrix.
+
+        Returns:
+            A PlaylistCollection.
+
+        """
+
+        playlists = [playlist for user in users_playlists
+                     for playlist in user]
+        playlist_offsets = np.cumsum(
+            [0] + [len(playlist.index) for playlist in playlists])
+        user_offsets = np.cumsum([0] + [len(user) for user in users_playlists])
+        if len(playlists) == 0:
+            return cls(TrackMatrix(np.empty(0, dtype=object),
+                                   np.empty((0, 0), dtype=dtype)),
+                       [], playlist_offsets, user_offsets)
+
+        stacked = pd.concat(playlists, ignore_index=True)
+        track_indices, unique_ids = pd.factorize(stacked['id'])
+        _, first_rows = np.unique(track_indices, return_index=True)
+        features = stacked.drop(columns=['id'])
+        tracks = TrackMatrix(np.asarray(unique_ids, dtype=object),
+                             features.to_numpy(dtype=dtype)[first_rows],
+                             features.columns, dtype=dtype)
+
+        return cls(tracks, track_indices, playlist_offsets, user_offsets)
+
+    @classmethod
+    def from_track_table(cls, users_playlists_track_ids, track_table,
+                         columns=None, dtype='float64',
+                         users_playlists_distance_sums=None):
+        """Creates a PlaylistCollection from track IDs of a TrackTable.
+
+        Tracks that are not in track_table are dropped, and so are playlists 
+        without tracks and users without playlists. Only the tracks of the 
+        playlists are copied from track_table.
+
+        Args:
+            users_playlists_track_ids (list(list(list(str)))): The track IDs
+                of each playlist of each user.
+            track_table (TrackTable): The features of the tracks.
+            columns (list(str)): The features to use, by default all columns
+                of track_table.
+            dtype (str): The data type of the feature matrix.
+            users_playlists_distance_sums (list(list(numpy.ndarray))): 
+                Optionally, the distance sums of each playlist of each user 
+                in the order of columns, or None for a playlist without 
+                tracks. If given, exactly the playlists with distance sums 
+                are kept, also if none of their tracks are in track_table.
+
+        Returns:
+            A PlaylistCollection.
+
+        """
+
+        if columns is None:
+            columns = track_table.columns
+        table_rows = []
+        playlist_offsets = [0]
+        user_offsets = [0]
+        distance_sums = []
+        for u, user_playlists in enumerate(users_playlists_track_ids):
+            for p, track_ids in enumerate(user_playlists):
+                rows = track_table.rows(track_ids)
+                if users_playlists_distance_sums is None:
+                    if len(rows) == 0:
+                        continue
+                else:
+                    sums = users_playlists_distance_sums[u][p]
+                    if sums is None:
+                        continue
+                    distance_sums.append(sums)
+                table_rows.extend(rows)
+                playlist_offsets.append(len(table_rows))
+            if len(playlist_offsets) - 1 > user_offsets[-1]:
+                user_offsets.append(len(playlist_offsets) - 1)
+
+        unique_rows, track_indices = np.unique(
+            np.asarray(table_rows, dtype='int64'), return_inverse=True)
+        if users_playlists_distance_sums is None:
+            distance_sums = None
+        elif len(distance_sums) == 0:
+            distance_sums = np.empty((0, len(columns)))
+        return cls(track_table.track_matrix(unique_rows, columns, dtype),
+                   track_indices, playlist_offsets, user_offsets,
+                   distance_sums)
+
+    @property
+    def num_users(self):
+        return len(self.user_offsets) - 1
+
+    @property
+    def num_playlists(self):
+        return len(self.playlist_offsets) - 1
+
+    def stacked_features(self):
+        """Returns the features of all playlist tracks stacked row by row."""
+
+        return self.tracks.features[self.track_indices]
+
+    def normalize(self, feature_min, feature_max):
+        """Scales the tracks and the distance sums like TrackMatrix.normalize().
+
+        The distance between two scaled tracks is their distance divided by 
+        the range of each feature, so the distance sums are scaled by the 
+        same ranges without touching the playlist tracks.
+
+        Returns:
+            A new, normalized PlaylistCollection.
+
+        """
+
+        distance_sums = self.distance_sums
+        if distance_sums is not None:
+            feature_range = np.asarray(feature_max, dtype='float64') - \
+                np.asarray(feature_min, dtype='float64')
+            feature_range[feature_range == 0] = 1
+            distance_sums = distance_sums / feature_range
+
+        return PlaylistCollection(
+            self.tracks.normalize(feature_min, feature_max),
+            self.track_indices, self.playlist_offsets, self.user_offsets,
+            distance_sums)
+
+    def save(self, path, dtype='float32'):
+        """Saves the playlists to the directory path."""
+
+        self.tracks.save(os.path.join(path, 'tracks'), dtype=dtype)
+        np.save(os.path.join(path, 'track_indices.npy'), self.track_indices)
+        np.save(os.path.join(path, 'playlist_offsets.npy'),
+                self.playlist_offsets)
+        np.save(os.path.join(path, 'user_offsets.npy'), self.user_offsets)
+        if self.distance_sums is not None:
+            np.save(os.path.join(path, 'distance_sums.npy'),
+                    self.distance_sums)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Loads playlists that were saved with save()."""
+
+        mmap_mode = 'r' if mmap else None
+        distance_sums_path = os.path.join(path, 'distance_sums.npy')
+        distance_sums = np.load(distance_sums_path, mmap_mode=mmap_mode) \
+            if os.path.exists(distance_sums_path) else None
+        return cls(TrackMatrix.load(os.path.join(path, 'tracks'), mmap=mmap),
+                   *[np.load(os.path.join(path, name + '.npy'),
+                             mmap_mode=mmap_mode)
+                     for name in ('track_indices', 'playlist_offsets',
+                                  'user_offsets')],
+                   distance_sums=distance_sums)
@@ -0,0 +1,311 @@
+__author__ = 'Numan Tok'
+
+
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from neighbor_graph import NeighborGraph
+from track_matrix import TrackMatrix
+
+
+# All audio features are stored, so every selection of features can be
+# served from the same snapshot
+AUDIO_FEATURES = ['danceability', 'energy', 'key', 'loudness', 'mode',
+                  'speechiness', 'acousticness', 'instrumentalness',
+                  'liveness', 'valence', 'tempo', 'duration_ms',
+                  'time_signature']
+
+
+class UniverseSnapshot:
+    """One version of the track universe of a market.
+
+    Attributes:
+        market (str): An ISO 3166-1 alpha-2 country code.
+        version (int): The version of the snapshot, 0 for an empty one.
+        updated_at (float): The unix time of the last refresh.
+        playlists (dict): Maps the IDs of all crawled playlists to their
+            snapshot_id at the time they were crawled.
+        playlist_tracks (dict): Maps the IDs of all crawled playlists to 
+            the IDs of their tracks, empty for snapshots that were stored 
+            before it was kept.
+        tracks (track_matrix.TrackMatrix): The tracks with all
+            AUDIO_FEATURES as columns.
+        normalized_tracks (track_matrix.TrackMatrix): tracks normalized to
+            the range [0, 1], None if the snapshot was not stored yet.
+        neighbor_graph (neighbor_graph.NeighborGraph): The nearest
+            neighbours of the normalized tracks, None if none was built.
+
+    """
+
+    def __init__(self, market, version=0, updated_at=0, playlists=None,
+                 tracks=None, normalized_tracks=None,
+                 neighbor_graph=None, playlist_tracks=None) -> None:
+        self.market = market
+        self.version = version
+        self.updated_at = updated_at
+        self.playlists = playlists if playlists is not None else {}
+        self.playlist_tracks = playlist_tracks \
+            if playlist_tracks is not None else {}
+        self.tracks = tracks if tracks is not None else \
+            TrackMatrix(np.empty(0, dtype=str),
+                        np.empty((0, len(AUDIO_FEATURES))), AUDIO_FEATURES)
+        self.normalized_tracks = normalized_tracks
+        self.neighbor_graph = neighbor_graph
+
+    def age(self):
+        """Returns the seconds since the last refresh."""
+
+        return time.time() - self.updated_at
+
+
+class UniverseStore:
+    """Stores versioned snapshots of the track universe on disk.
+
+    The featured playlists of a market are the same for every group, so the
+    universe is crawled once, stored and then refreshed incrementally: only
+    playlists that are new or whose snapshot_id changed are crawled again.
+    Each market lives in its own directory with a manifest.json that points
+    to the current snapshot directory. New snapshots are written next to the
+    old ones and the manifest is replaced atomically, so readers never see a
+    partial snapshot. Writing a snapshot does not block loading snapshots.
+
+    A snapshot directory holds the raw and the normalized tracks as
+    track_matrix.TrackMatrix directories, the track IDs of every crawled
+    playlist in playlist_tracks.json and optionally the
+    neighbor_graph.NeighborGraph of the normalized tracks. They are
+    memory-mapped when they are loaded, so all processes serving the same
+    market share them.
+
+    Attributes:
+        path (str): The directory of the store.
+        max_age (float): The number of seconds after which a snapshot is
+            stale and should be refreshed.
+        keep_versions (int): How many snapshot directories are kept per
+            market.
+        neighbor_graph_k (int): If set, a neighbour graph with this many
+            neighbours per track is built for every saved snapshot.
+
+    """
+
+    def __init__(self, path, max_age=24*60*60, keep_versions=2,
+                 neighbor_graph_k=None) -> None:
+        self.path = path
+        self.max_age = max_age
+        self.keep_versions = keep_versions
+        self.neighbor_graph_k = neighbor_graph_k
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._cache = {}
+        # The last reserved version of each market and the versions whose 
+        # directories are being written
+        self._last_versions = {}
+        self._writing = set()
+
+    def _market_path(self, market, *names):
+        return os.path.join(self.path, market, *names)
+
+    def load(self, market):
+        """Loads the current snapshot of a market.
+
+        Snapshots are kept in memory after they are loaded once.
+
+        Args:
+            market (str): An ISO 3166-1 alpha-2 country code.
+
+        Returns:
+            A UniverseSnapshot, with version 0 if the market was never
+            crawled.
+
+        """
+
+        try:
+            with open(self._market_path(market, 'manifest.json')) as file:
+                manifest = json.load(file)
+        except FileNotFoundError:
+            return UniverseSnapshot(market)
+
+        with self._lock:
+            snapshot = self._cache.get(market)
+            if snapshot is not None and \
+                    snapshot.version == manifest['version']:
+                return snapshot
+
+        snapshot_path = self._market_path(market, manifest['directory'])
+        graph_path = os.path.join(snapshot_path, 'neighbor_graph')
+        try:
+            with open(os.path.join(snapshot_path,
+                                   'playlist_tracks.json')) as file:
+                playlist_tracks = json.load(file)
+        except FileNotFoundError:
+            playlist_tracks = None
+        snapshot = UniverseSnapshot(
+            market, manifest['version'], manifest['updated_at'],
+            manifest['playlists'],
+            TrackMatrix.load(os.path.join(snapshot_path, 'raw')),
+            TrackMatrix.load(os.path.join(snapshot_path, 'normalized')),
+            NeighborGraph.load(graph_path)
+            if os.path.isdir(graph_path) else None,
+            playlist_tracks)
+        with self._lock:
+            self._cache[market] = snapshot
+
+        return snapshot
+
+    def is_stale(self, snapshot):
+        return snapshot.version == 0 or snapshot.age() > self.max_age
+
+    def save(self, snapshot):
+        """Stores snapshot as the next version of its market.
+
+        The snapshot directory, including the neighbour graph, is written 
+        without holding the lock of the store, so loading snapshots is not 
+        blocked by a refresh. The lock is only taken to reserve the version 
+        and to replace the manifest. If another save of the market finished 
+        with a newer version in the meantime, the snapshot is discarded.
+
+        Args:
+            snapshot (UniverseSnapshot): The refreshed snapshot. Its version
+                and updated_at are set by the store.
+
+        """
+
+        market = snapshot.market
+        os.makedirs(self._market_path(market), exist_ok=True)
+        with self._lock:
+            # Saves running at the same time write different directories
+            version = max(self.load_version(market),
+                          self._last_versions.get(market, 0)) + 1
+            self._last_versions[market] = version
+            self._writing.add((market, version))
+        directory = 'v%d' % version
+        snapshot.version = version
+        snapshot.updated_at = time.time()
+
+        try:
+            tracks = snapshot.tracks.select(AUDIO_FEATURES)
+            snapshot.normalized_tracks = tracks.normalize()
+            tracks.save(self._market_path(market, directory, 'raw'),
+                        dtype='float64')
+            snapshot.normalized_tracks.save(
+                self._market_path(market, directory, 'normalized'))
+            with open(self._market_path(market, directory,
+                                        'playlist_tracks.json'), 'w') as file:
+                json.dump(snapshot.playlist_tracks, file)
+            snapshot.neighbor_graph = None
+            if self.neighbor_graph_k is not None:
+                snapshot.neighbor_graph = NeighborGraph.build(
+                    snapshot.normalized_tracks.features,
+                    self.neighbor_graph_k)
+                snapshot.neighbor_graph.save(
+                    self._market_path(market, directory, 'neighbor_graph'))
+        except BaseException:
+            with self._lock:
+                self._writing.discard((market, version))
+            shutil.rmtree(self._market_path(market, directory),
+                          ignore_errors=True)
+            raise
+
+        with self._lock:
+            self._writing.discard((market, version))
+            if version > self.load_version(market):
+                manifest = {'version': version,
+                            'updated_at': snapshot.updated_at,
+                            'directory': directory,
+                            'playlists': snapshot.playlists}
+                manifest_path = self._market_path(market, 'manifest.json')
+                with open(manifest_path + '.tmp', 'w') as file:
+                    json.dump(manifest, file)
+                os.replace(manifest_path + '.tmp', manifest_path)
+                self._cache[market] = snapshot
+                obsolete = range(version - self.keep_versions, 0, -1)
+            else:
+                obsolete = [version]
+            writing = set(self._writing)
+
+        # Remove old versions that are not needed anymore
+        for old_version in obsolete:
+            if (market, old_version) in writing:
+                continue
+            version_path = self._market_path(market, 'v%d' % old_version)
+            if not os.path.isdir(version_path):
+                break
+            shutil.rmtree(version_path)
+
+    def build_neighbor_graph(self, market, k=32):
+        """Builds the neighbour graph of the current snapshot of a market.
+
+        This is meant to be run offline, e.g. for snapshots that were saved 
+        without a neighbour graph. An existing graph is replaced.
+
+        Args:
+            market (str): An ISO 3166-1 alpha-2 country code.
+            k (int): The number of neighbours per track.
+
+        Returns:
+            The neighbor_graph.NeighborGraph or None if the market was never 
+            crawled.
+
+        """
+
+        snapshot = self.load(market)
+        if snapshot.version == 0:
+            return None
+
+        graph = NeighborGraph.build(snapshot.normalized_tracks.features, k)
+        with open(self._market_path(market, 'manifest.json')) as file:
+            directory = json.load(file)['directory']
+        graph_path = self._market_path(market, directory, 'neighbor_graph')
+        # Write next to the old graph first, readers may have it mapped
+        graph.save(graph_path + '.tmp')
+        if os.path.isdir(graph_path):
+            shutil.rmtree(graph_path)
+        os.replace(graph_path + '.tmp', graph_path)
+        snapshot.neighbor_graph = graph
+
+        return graph
+
+    def load_version(self, market):
+        """Returns the current version of a market, 0 if there is none."""
+
+        try:
+            with open(self._market_path(market, 'manifest.json')) as file:
+                return json.load(file)['version']
+        except FileNotFoundError:
+            return 0
+
+    def refresh_in_background(self, market, refresh):
+        """Refreshes the snapshot of a market on a background thread.
+
+        Nothing happens if the market is already being refreshed.
+
+        Args:
+            market (str): An ISO 3166-1 alpha-2 country code.
+            refresh (callable): Called with the current UniverseSnapshot of
+                the market, returns the refreshed UniverseSnapshot.
+
+        Returns:
+            The started threading.Thread or None.
+
+        """
+
+        with self._lock:
+            if market in self._refreshing:
+                return None
+            self._refreshing.add(market)
+
+        def run():
+            try:
+                self.save(refresh(self.load(market)))
+            finally:
+                with self._lock:
+                    self._refreshing.discard(market)
+
+        thread = threading.Thread(target=run, daemon=True,
+                                  name='universe-refresh-%s' % market)
+        thread.start()
+        return thread